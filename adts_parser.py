@@ -1,62 +1,253 @@
 # https://wiki.multimedia.cx/index.php/ADTS
 # https://wiki.multimedia.cx/index.php/MPEG-4_Audio
 
-def parse_adts(buf):
-    profile_map = {
-            "00": "Main",
-            "01": "LC",     # Low Complexity
-            "10": "SSR",    # Scalable Sample Rate
-            "11": "LTP",    # Long Term Prediction
-            }
+from array import array
 
-    freq_index_map = {
-            "0000": "96000Hz",
-            "0001": "88200Hz",
-            "0010": "64000Hz",
-            "0011": "48000Hz",
-            "0100": "44100Hz",
-            "0101": "32000Hz",
-            "0110": "24000Hz",
-            "0111": "22050Hz",
-            "1000": "16000Hz",
-            "1001": "12000Hz",
-            "1010": "11025Hz",
-            "1011": "8000Hz",
-            "1100": "7350Hz",
-            "1101": "RESERVED",
-            "1110": "RESERVED",
-            "1111": "EXPLICIT",
-            }
+# sampling_frequency_index
+sampling_frequency_tab = (96000, 88200, 64000, 48000, 44100, 32000, 24000,
+                          22050, 16000, 12000, 11025, 8000, 7350)
+
+profile_tab = ("Main",
+               "LC",    # Low Complexity
+               "SSR",   # Scalable Sample Rate
+               "LTP")   # Long Term Prediction
+
+freq_tab = tuple(f"{v}Hz" for v in sampling_frequency_tab) + (
+        "RESERVED", "RESERVED", "EXPLICIT")
+
+ch_conf_tab = ("PCE", "1ch", "2ch", "3ch", "4ch", "5ch", "5.1ch", "7.1ch")
 
-    ch_conf_map = {
-            "000": "PCE",
-            "001": "1ch",
-            "010": "2ch",
-            "011": "3ch",
-            "100": "4ch",
-            "101": "5ch",
-            "110": "5.1ch",
-            "111": "7.1ch",
+def decode_adts_header(v):
+    """
+    decode the 56 bits of the ADTS header in v.
+    AAAAAAAA AAAABCCD EEFFFFGH HHIJKLMM MMMMMMMM MMMOOOOO OOOOOOPP
+    """
+    return {
+            "header_length": 7 if v >> 40 & 1 else 9,
+            "version": "MP2" if v >> 43 & 1 else "MP4",
+            "b_crc_absent": v >> 40 & 1, # 0:CRC 1:No-CRC
+            "profile": profile_tab[v >> 38 & 3],
+            "freq": freq_tab[v >> 34 & 0xf],
+            "b_private_bit": v >> 33 & 1,
+            "ch_conf": ch_conf_tab[v >> 30 & 7],
+            "b_originality": v >> 29 & 1,
+            "b_home": v >> 28 & 1,
+            "b_crid_bit": v >> 27 & 1,
+            "b_crid_start": v >> 26 & 1,
+            "frame_length": v >> 13 & 0x1fff,
+            "buffer_fullness": v >> 2 & 0x7ff,
+            "nb_aac_frames": 1 + (v & 3), # nb of AAC frames - 1
             }
 
-    h = bin(int.from_bytes(buf[:7],"big"))[2:].rjust(56,"0")
+def parse_adts(buf, offset=0):
+    """
+    decode the ADTS header at offset of buf.
+    """
+    if len(buf) - offset < 7:
+        raise ValueError(f"ADTS header at {offset} is truncated")
+    return decode_adts_header(int.from_bytes(buf[offset:offset+7], "big"))
+
+def walk_adts(buf, offset=0, end=None):
+    """
+    yield (offset, the 56 bits of the header) of each frame in buf.
+    """
+    if end is None:
+        end = len(buf)
+    while offset < end:
+        if end - offset < 7:
+            raise ValueError(f"ADTS header at {offset} is truncated")
+        v = int.from_bytes(buf[offset:offset+7], "big")
+        if v >> 44 != 0xfff:
+            raise ValueError(f"no ADTS syncword at {offset}")
+        frame_length = v >> 13 & 0x1fff
+        if frame_length < (7 if v >> 40 & 1 else 9):
+            raise ValueError(f"frame_length {frame_length} at {offset} "
+                             "is too small")
+        if offset + frame_length > end:
+            raise ValueError(f"ADTS frame at {offset} is truncated")
+        yield offset, v
+        offset += frame_length
+
+def iter_adts(buf, offset=0, end=None):
+    """
+    yield the header of each ADTS frame in buf, e.g. bytes or mmap, from
+    offset to end.  the header has "offset" of the frame and "payload",
+    which is the memoryview of the raw data blocks in buf.
+    """
+    buf = memoryview(buf)
+    for offset,v in walk_adts(buf, offset, end):
+        hdr = decode_adts_header(v)
+        hdr["offset"] = offset
+        hdr["payload"] = buf[offset+hdr["header_length"]:
+                             offset+hdr["frame_length"]]
+        yield hdr
+
+def parse_adts_headers(buf, offset=0, end=None):
+    """
+    decode the headers of all ADTS frames in buf at once, and return the
+    arrays of the fields, i.e.
+        offset, header_length, profile, sampling_frequency_index,
+        channel_configuration, frame_length, buffer_fullness, nb_aac_frames
+    where profile, sampling_frequency_index and channel_configuration
+    are the indexes of profile_tab, freq_tab and ch_conf_tab.
+    """
+    offsets = array("Q")
+    headers = []
+    for offset,v in walk_adts(memoryview(buf), offset, end):
+        offsets.append(offset)
+        headers.append(v)
     return {
-            "header_length": 7 if h[15] == "1" else 9,
-            "version": "MP4" if h[12] == "0" else "MP2",
-            "b_crc_absent": int(h[15]), # 0:CRC 1:No-CRC
-            "profile": profile_map.get(h[16:18]),
-            "freq": freq_index_map.get(h[18:22]),
-            "b_private_bit": int(h[22]),
-            "ch_conf": ch_conf_map.get(h[23:26]),
-            "b_originality": int(h[26]),
-            "b_home": int(h[27]),
-            "b_crid_bit": int(h[28]),
-            "b_crid_start": int(h[29]),
-            "frame_length": int(h[30:43],2),
-            "buffer_fullness": int(h[43:54],2),
-            "nb_aac_frames": 1 + int(h[54:56],2), # nb of AAC frames - 1
+            "offset": offsets,
+            "header_length": array("B", [7 if v >> 40 & 1 else 9
+                                         for v in headers]),
+            "profile": array("B", [v >> 38 & 3 for v in headers]),
+            "sampling_frequency_index": array("B", [v >> 34 & 0xf
+                                                    for v in headers]),
+            "channel_configuration": array("B", [v >> 30 & 7
+                                                 for v in headers]),
+            "frame_length": array("H", [v >> 13 & 0x1fff for v in headers]),
+            "buffer_fullness": array("H", [v >> 2 & 0x7ff for v in headers]),
+            "nb_aac_frames": array("B", [1 + (v & 3) for v in headers]),
             }
 
+class BitReader:
+    """
+    read the bits of buf from the most significant bit.
+    """
+    def __init__(self, buf):
+        self.value = int.from_bytes(buf, "big")
+        self.nb_bits = len(buf)*8
+
+    def read(self, nb_bits):
+        if nb_bits > self.nb_bits:
+            raise ValueError(f"{nb_bits} bits exceed the buffer, "
+                             f"{self.nb_bits} bits left")
+        self.nb_bits -= nb_bits
+        return (self.value >> self.nb_bits) & ((1 << nb_bits) - 1)
+
+def decode_audio_specific_config(buf):
+    """
+    AudioSpecificConfig () {
+        audioObjectType = GetAudioObjectType();
+        samplingFrequencyIndex;                 4 bits
+        if ( samplingFrequencyIndex == 0xf )
+            samplingFrequency;                  24 bits
+        channelConfiguration;                   4 bits
+        sbrPresentFlag = -1;
+        psPresentFlag = -1;
+        if ( audioObjectType == 5 || audioObjectType == 29 ) {
+            extensionAudioObjectType = 5;
+            sbrPresentFlag = 1;
+            if ( audioObjectType == 29 )
+                psPresentFlag = 1;
+            extensionSamplingFrequencyIndex;    4 bits
+            if ( extensionSamplingFrequencyIndex == 0xf )
+                extensionSamplingFrequency;     24 bits
+            audioObjectType = GetAudioObjectType();
+            ...
+        }
+        ...
+    }
+    GetAudioObjectType() {
+        audioObjectType;                        5 bits
+        if (audioObjectType == 31)
+            audioObjectType = 32 + audioObjectTypeExt;  6 bits
+        return audioObjectType;
+    }
+    Note: the fields after the core audioObjectType are not decoded.
+        for HE-AAC, audio_object_type and sampling_frequency_index are of
+        the core, which ADTS carries.
+    """
+    r = BitReader(buf)
+    def get_audio_object_type():
+        v = r.read(5)
+        return 32 + r.read(6) if v == 31 else v
+    def get_sampling_frequency():
+        index = r.read(4)
+        if index == 0xf:
+            return index, r.read(24)
+        if index >= len(sampling_frequency_tab):
+            raise ValueError(f"reserved samplingFrequencyIndex {index}")
+        return index, sampling_frequency_tab[index]
+    asc = {}
+    asc["audio_object_type"] = get_audio_object_type()
+    (asc["sampling_frequency_index"],
+     asc["sampling_frequency"]) = get_sampling_frequency()
+    asc["channel_configuration"] = r.read(4)
+    if asc["audio_object_type"] in (5, 29):
+        asc["extension_audio_object_type"] = 5
+        asc["sbr_present_flag"] = 1
+        asc["ps_present_flag"] = 1 if asc["audio_object_type"] == 29 else -1
+        (asc["extension_sampling_frequency_index"],
+         asc["extension_sampling_frequency"]) = get_sampling_frequency()
+        asc["audio_object_type"] = get_audio_object_type()
+    return asc
+
+def make_adts_template(audio_object_type=2, sampling_frequency_index=8,
+                       channel_configuration=2):
+    """
+    return the 56 bits of the ADTS header of which frame_length is 0,
+    i.e. MPEG-4, no CRC, buffer fullness 0x7FF and a raw data block.
+    the default is the header which had been fixed, i.e. LC, 16000Hz
+    and 2ch.
+    """
+    if not 1 <= audio_object_type <= 4:
+        raise ValueError("ADTS can not carry audio object type "
+                         f"{audio_object_type}")
+    if sampling_frequency_index >= len(sampling_frequency_tab):
+        raise ValueError("ADTS can not carry sampling frequency index "
+                         f"{sampling_frequency_index}")
+    if channel_configuration > 7:
+        raise ValueError("ADTS can not carry channel configuration "
+                         f"{channel_configuration}")
+    return (0xfff << 44 |                       # syncword
+            1 << 40 |                           # protection_absent
+            (audio_object_type - 1) << 38 |     # profile
+            sampling_frequency_index << 34 |
+            channel_configuration << 30 |
+            0x7ff << 2)                         # adts_buffer_fullness
+
+def make_adts_template_from_config(buf):
+    """
+    return the template of the ADTS header from AudioSpecificConfig.
+    """
+    asc = decode_audio_specific_config(buf)
+    sampling_frequency_index = asc["sampling_frequency_index"]
+    if sampling_frequency_index == 0xf:
+        # ADTS has only the index.
+        if asc["sampling_frequency"] not in sampling_frequency_tab:
+            raise ValueError("ADTS can not carry sampling frequency "
+                             f"{asc['sampling_frequency']}")
+        sampling_frequency_index = sampling_frequency_tab.index(
+                asc["sampling_frequency"])
+    return make_adts_template(asc["audio_object_type"],
+                              sampling_frequency_index,
+                              asc["channel_configuration"])
+
+ADTS_HEADER_SIZE = 7
+ADTS_MAX_FRAME_LENGTH = (1 << 13) - 1
+
+def make_adts_header(template, data_size):
+    """
+    return the ADTS header of a frame of data_size bytes.
+    """
+    frame_length = ADTS_HEADER_SIZE + data_size
+    if frame_length > ADTS_MAX_FRAME_LENGTH:
+        raise ValueError(f"frame_length {frame_length} exceeds "
+                         f"{ADTS_MAX_FRAME_LENGTH}")
+    return (template | frame_length << 13).to_bytes(ADTS_HEADER_SIZE, "big")
+
+def make_adts_headers(template, data_sizes):
+    """
+    return the list of the ADTS headers of the frames at once.
+    """
+    if data_sizes and max(data_sizes) + ADTS_HEADER_SIZE > ADTS_MAX_FRAME_LENGTH:
+        raise ValueError(f"frame_length {max(data_sizes)+ADTS_HEADER_SIZE} "
+                         f"exceeds {ADTS_MAX_FRAME_LENGTH}")
+    template |= ADTS_HEADER_SIZE << 13
+    return [(template + (size << 13)).to_bytes(ADTS_HEADER_SIZE, "big")
+            for size in data_sizes]
+
 adts_hdr = {
         "offset": "Offset",
         "header_length": "HL",
@@ -79,16 +270,16 @@ adts_fmt = "{offset:8} {header_length:2} {version:3} {b_crc_absent:1} {profile:4
 
 if __name__ == "__main__":
     import sys
+    import os
+    import mmap
     if len(sys.argv) != 2:
         print("Usage: adts_parser (file)")
         exit(0)
     else:
-        buf = open(sys.argv[1], "rb").read()
         print(adts_fmt.format(**adts_hdr))
-        i = 0
-        while i < len(buf):
-            hdr = parse_adts(buf[i:])
-            hdr.update({"offset":i})
-            print(adts_fmt.format(**hdr))
-            i += hdr["frame_length"]
-
+        with open(sys.argv[1], "rb") as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                exit(0)
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            for hdr in iter_adts(buf):
+                print(adts_fmt.format(**hdr))
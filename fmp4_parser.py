@@ -0,0 +1,317 @@
+import operator
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from mp4_parser import Mp4File, mp4parse, parse_box, decode_int
+from mp4_parser import TFHD_BASE_DATA_OFFSET, TFHD_DEFAULT_BASE_IS_MOOF
+from sample_table import SampleIndex
+
+"""
+fragmented MP4, i.e. moov/mvex and the pairs of moof and mdat.
+
+iter_fragments() walks the top level boxes one by one, and yields the
+samples of each moof with the absolute file offsets and the timestamps,
+so that the memory does not grow with the number of the fragments.
+find_fragment() finds the moof to start from by mfra/tfra or sidx if
+the file has them, or else by reading tfdt of each moof.
+"""
+
+# sample_is_non_sync_sample of the sample flags.
+SAMPLE_IS_NON_SYNC_SAMPLE = 0x00010000
+
+class Fragment:
+    """
+    the samples in a moof box.
+    tracks is the SampleIndex of each track_ID in the moof.
+    """
+    def __init__(self, sequence_number, offset, size, tracks):
+        self.sequence_number = sequence_number
+        self.offset = offset
+        self.size = size
+        self.tracks = tracks
+
+    def __repr__(self):
+        return (f"Fragment({self.sequence_number}, offset={self.offset}, "
+                f"tracks={list(self.tracks)})")
+
+def get_trex(mp4):
+    """
+    return the payload of trex of each track_ID.
+    """
+    return {box.payload["track_ID"]: box.payload
+            for box in mp4.find_all("moov/mvex/trex")}
+
+def get_timescale(mp4, track_id):
+    for trak in mp4.find_all("moov/trak"):
+        if trak.find("tkhd").payload["trackID"] == track_id:
+            return trak.find("mdia/mdhd").payload["timescale"]
+    return None
+
+def fill(v_val, typecode, default, count):
+    """
+    return v_val if the trun has the field, or else the default values.
+    """
+    if v_val is not None:
+        return v_val
+    return array(typecode, [default])*count
+
+def decode_traf(traf, moof_offset, data_offset, trex, dts):
+    """
+    return the SampleIndex of the samples in traf, the end of the data
+    and the decoding time of the next sample.
+
+    data_offset: the end of the data of the previous traf in the moof,
+        or the offset of the moof for the first traf.
+    trex: the payload of trex of each track_ID.
+    dts: the decoding time of the next sample of the track, used when
+        the traf does not have tfdt.
+    """
+    tfhd = traf.find("tfhd").payload
+    track_id = tfhd["track_ID"]
+    defaults = trex.get(track_id, {})
+    tf_flags = tfhd["tf_flags"]
+    if tf_flags & TFHD_BASE_DATA_OFFSET:
+        base_data_offset = tfhd["base_data_offset"]
+    elif tf_flags & TFHD_DEFAULT_BASE_IS_MOOF:
+        base_data_offset = moof_offset
+    else:
+        base_data_offset = data_offset
+    default_duration = tfhd.get("default_sample_duration",
+                                defaults.get("default_sample_duration", 0))
+    default_size = tfhd.get("default_sample_size",
+                            defaults.get("default_sample_size", 0))
+    default_flags = tfhd.get("default_sample_flags",
+                             defaults.get("default_sample_flags", 0))
+    tfdt = traf.find("tfdt")
+    if tfdt is not None:
+        dts = tfdt.payload["baseMediaDecodeTime"]
+    offset = array("Q")
+    size = array("L")
+    dts_array = array("Q")
+    cts = array("q")
+    sync = bytearray()
+    data_offset = base_data_offset
+    for trun in traf.find_all("trun"):
+        v = trun.payload
+        nb_samples = v["sample_count"]
+        if "data_offset" in v:
+            data_offset = base_data_offset + v["data_offset"]
+        sizes = fill(v.get("sample_size"), "L", default_size, nb_samples)
+        durations = fill(v.get("sample_duration"), "L", default_duration,
+                         nb_samples)
+        flags = fill(v.get("sample_flags"), "L", default_flags, nb_samples)
+        if "first_sample_flags" in v and nb_samples > 0:
+            flags = array("L", flags)
+            flags[0] = v["first_sample_flags"]
+        v_val = array("Q", accumulate(sizes, initial=data_offset))
+        data_offset = v_val.pop()
+        offset.extend(v_val)
+        size.fromlist(sizes.tolist())
+        v_val = array("Q", accumulate(durations, initial=dts))
+        dts = v_val.pop()
+        cto = v.get("sample_composition_time_offset")
+        if cto is None:
+            cts.fromlist(v_val.tolist())
+        else:
+            cts.extend(map(operator.add, v_val, cto))
+        dts_array.extend(v_val)
+        sync.extend([not (f & SAMPLE_IS_NON_SYNC_SAMPLE) for f in flags])
+    sync_samples = array("Q", [n for n,v in enumerate(sync) if v])
+    index = SampleIndex(offset, size, dts_array, cts, sync, sync_samples,
+                        track_id=track_id)
+    return index, data_offset, dts
+
+def iter_fragments(mp4, start=0):
+    """
+    yield the Fragment of each moof from the offset start.
+    start must be the offset of a top level box, e.g. find_fragment().
+    """
+    trex = get_trex(mp4)
+    next_dts = {}
+    for box in mp4parse(mp4, start, mp4.size):
+        if box.type != "moof":
+            continue
+        mfhd = box.find("mfhd")
+        sequence_number = None
+        if mfhd is not None:
+            sequence_number = mfhd.payload["sequence_number"]
+        tracks = {}
+        data_offset = box.offset
+        for traf in box.find_all("traf"):
+            track_id = traf.find("tfhd").payload["track_ID"]
+            index, data_offset, next_dts[track_id] = decode_traf(
+                    traf, box.offset, data_offset, trex,
+                    next_dts.get(track_id, 0))
+            tracks[track_id] = index
+        yield Fragment(sequence_number, box.offset, box.size, tracks)
+
+def get_tfra(mp4, track_id):
+    """
+    return (time, moof_offset) of tfra of the track in mfra, which is
+    found by mfro at the end of the file.  return None if not found.
+    """
+    if mp4.size < 16:
+        return None
+    buf = mp4.read(mp4.size-16, 16)
+    if bytes(buf[4:8]) != b"mfro":
+        return None
+    mfra_size = decode_int(buf[12:16])
+    if not 16 <= mfra_size <= mp4.size:
+        return None
+    mfra = parse_box(mp4, mp4.size-mfra_size, mp4.size)
+    if mfra.type != "mfra":
+        return None
+    for tfra in mfra.find_all("tfra"):
+        if tfra.payload["track_ID"] == track_id:
+            return tfra.payload["time"], tfra.payload["moof_offset"]
+    return None
+
+def read_sidx(mp4, box, timescale, time, offset):
+    """
+    append the presentation time in timescale and the offset of each moof
+    referred by sidx of box to time and offset.  a reference to sidx,
+    i.e. reference_type 1, is descended instead of taken as a moof.
+    """
+    v = box.payload
+    base = box.end + v["first_offset"]
+    t = v["earliest_presentation_time"]
+    for ref_type,size,duration in zip(v["reference_type"],
+                                      v["referenced_size"],
+                                      v["subsegment_duration"]):
+        if ref_type == 1:
+            child = parse_box(mp4, base, mp4.size)
+            if child.type != "sidx":
+                raise ValueError(f"{child.type} at {base} is referred "
+                                 "as sidx")
+            read_sidx(mp4, child, timescale, time, offset)
+        else:
+            time.append(t*timescale//v["timescale"])
+            offset.append(base)
+        base += size
+        t += duration
+
+def get_sidx(mp4):
+    """
+    return (reference_ID, timescale, time, offset) of the moofs referred
+    by the first sidx before the first moof, and the sidx referred by it.
+    the time is the earliest presentation time.  return None if not found.
+    """
+    for box in mp4parse(mp4, 0, mp4.size):
+        if box.type == "moof":
+            break
+        if box.type == "sidx":
+            v = box.payload
+            time = array("Q")
+            offset = array("Q")
+            read_sidx(mp4, box, v["timescale"], time, offset)
+            return v["reference_ID"], v["timescale"], time, offset
+    return None
+
+def get_tfdt(mp4, moof_offset, track_id):
+    """
+    return baseMediaDecodeTime of the track in the moof, or None.
+    """
+    moof = parse_box(mp4, moof_offset, mp4.size)
+    if moof.type != "moof":
+        return None
+    for traf in moof.find_all("traf"):
+        if traf.find("tfhd").payload["track_ID"] == track_id:
+            tfdt = traf.find("tfdt")
+            if tfdt is not None:
+                return tfdt.payload["baseMediaDecodeTime"]
+    return None
+
+def find_fragment(mp4, track_id, t):
+    """
+    return the offset of the moof from which the track is played at t,
+    in the timescale of the track.
+    """
+    tfra = get_tfra(mp4, track_id)
+    if tfra is not None:
+        time, moof_offset = tfra
+        if len(time):
+            # the time in tfra is the presentation time, see sidx below.
+            shift = 0
+            dts = get_tfdt(mp4, moof_offset[0], track_id)
+            if dts is not None:
+                shift = time[0] - dts
+            return moof_offset[max(bisect_right(time, t + shift)-1, 0)]
+    sidx = get_sidx(mp4)
+    if sidx is not None:
+        reference_id, timescale, time, offset = sidx
+        track_timescale = get_timescale(mp4, track_id)
+        if len(time) and track_timescale:
+            # the time in sidx is the presentation time.  the composition
+            # offset of the first moof is taken off, so that it is
+            # compared with the decoding time.
+            shift = 0
+            dts = get_tfdt(mp4, offset[0], reference_id)
+            reference_timescale = get_timescale(mp4, reference_id)
+            if dts is not None and reference_timescale:
+                shift = time[0] - dts*timescale//reference_timescale
+            i = bisect_right(time, t*timescale//track_timescale + shift) - 1
+            return offset[max(i, 0)]
+    # no index, read tfdt of each moof.
+    moof_offset = None
+    for box in mp4parse(mp4, 0, mp4.size):
+        if box.type != "moof":
+            continue
+        if moof_offset is None:
+            moof_offset = box.offset
+        for traf in box.find_all("traf"):
+            if traf.find("tfhd").payload["track_ID"] != track_id:
+                continue
+            tfdt = traf.find("tfdt")
+            if tfdt is None:
+                continue
+            if tfdt.payload["baseMediaDecodeTime"] > t:
+                return moof_offset
+            moof_offset = box.offset
+    return moof_offset
+
+#
+# parser main
+#
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="a parser for fragmented MP4.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("mp4file", help="MP4 file.")
+    ap.add_argument("--track", action="store", dest="track_id", type=int,
+                    help="specify the track_ID to seek with --time.")
+    ap.add_argument("--time", action="store", dest="time", type=float,
+                    help="specify the time in seconds to start from.")
+    ap.add_argument("-v", action="store_true", dest="verbose",
+                    help="enable verbose mode.")
+    opt = ap.parse_args(argv)
+
+    with Mp4File(opt.mp4file) as mp4:
+        start = 0
+        if opt.time is not None:
+            if opt.track_id is None:
+                ap.error("--time requires --track")
+            timescale = get_timescale(mp4, opt.track_id)
+            if timescale is None:
+                ap.error(f"no track {opt.track_id}")
+            start = find_fragment(mp4, opt.track_id,
+                                  int(opt.time*timescale))
+            if start is None:
+                return
+        for frag in iter_fragments(mp4, start):
+            print(f"+ moof: {frag.sequence_number} offset={frag.offset}")
+            for track_id,index in frag.tracks.items():
+                if len(index) == 0:
+                    print(f"  track{track_id}: 0 samples")
+                    continue
+                print(f"  track{track_id}: {len(index)} samples "
+                      f"dts={index.dts[0]} offset={index.offset[0]} "
+                      f"size={sum(index.size)}")
+                if opt.verbose:
+                    for n in range(len(index)):
+                        print("    {} {} {} {} {} {}".format(
+                                n, *index.sample(n)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import sys
+import json
+import struct
+from array import array
+from sample_table import SttsTable, CttsTable, StscTable, StszTable
+from sample_table import SampleTable, SampleIndex, typecode_of
+
+"""
+binary file of the typed arrays of each track.
+
+    magic         4 bytes, "MP4X"
+    version       unsigned int(32), little endian
+    header_size   unsigned int(32), little endian
+    header        JSON of header_size bytes
+    padding       to 8 bytes
+    arrays        each array is little endian and aligned to 8 bytes
+
+the header is:
+
+    {"meta": {...},
+     "tracks": [{"track_id": 1, "media": "video", "timescale": 12800,
+                 "codec": "avc1", "decoder_config": null,
+                 "arrays": {"offset": ["u", 8, offset, count], ...}}, ...]}
+
+where decoder_config is in hex, e.g. the AudioSpecificConfig of mp4a,
+and the offset of an array is from the head of the arrays.  on a little
+endian host the arrays are loaded as memoryview.cast() of the buffer,
+so that a mapped file is read without being copied.
+"""
+
+MAGIC = b"MP4X"
+VERSION = 1
+PREFIX = struct.Struct("<4sII")
+
+# (signed, itemsize) -> typecode
+typecode_tab = {(c.islower(), array(c).itemsize): c for c in "QqLlIiHhBb"}
+
+def align(offset, size=8):
+    return (offset + size - 1) // size * size
+
+def dump(fd, tracks, meta=None):
+    """
+    write the tracks into fd.
+    tracks: the list of dicts of the track, of which "arrays" is a dict
+        of the arrays, the memoryviews made by load(), or the bytes-like
+        objects of unsigned bytes.
+    """
+    arrays = []
+    header = {"meta": meta or {}, "tracks": []}
+    pos = 0
+    for track in tracks:
+        track_hdr = {k: v for k,v in track.items() if k != "arrays"}
+        track_hdr["arrays"] = {}
+        for name,v_val in track["arrays"].items():
+            if isinstance(v_val, memoryview):
+                v_val = array(typecode_of(v_val), v_val)
+            elif not isinstance(v_val, array):
+                v_val = array("B", v_val)
+            track_hdr["arrays"][name] = ["i" if v_val.typecode.islower()
+                                         else "u", v_val.itemsize, pos,
+                                         len(v_val)]
+            arrays.append((pos, v_val))
+            pos = align(pos + v_val.itemsize*len(v_val))
+        header["tracks"].append(track_hdr)
+    header_raw = json.dumps(header).encode()
+    fd.write(PREFIX.pack(MAGIC, VERSION, len(header_raw)))
+    fd.write(header_raw)
+    fd.write(b"\0"*(align(PREFIX.size + len(header_raw)) -
+                    (PREFIX.size + len(header_raw))))
+    pos = 0
+    for start,v_val in arrays:
+        fd.write(b"\0"*(start - pos))
+        if sys.byteorder == "big" and v_val.itemsize > 1:
+            v_val = array(v_val.typecode, v_val)
+            v_val.byteswap()
+        fd.write(v_val.tobytes())
+        pos = start + v_val.itemsize*len(v_val)
+
+def load(buf):
+    """
+    return (meta, tracks) of the file in buf, e.g. bytes or mmap.
+    the arrays refer to buf on a little endian host.
+    """
+    buf = memoryview(buf)
+    if len(buf) < PREFIX.size:
+        raise ValueError("index file is truncated")
+    magic, version, header_size = PREFIX.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError(f"not an index file, magic {magic!r}")
+    if version != VERSION:
+        raise ValueError(f"unsupported version {version}")
+    end = PREFIX.size + header_size
+    if len(buf) < end:
+        raise ValueError("index file is truncated")
+    header = json.loads(bytes(buf[PREFIX.size:end]))
+    buf = buf[align(end):]
+    for track in header["tracks"]:
+        for name,(kind,itemsize,offset,count) in track["arrays"].items():
+            typecode = typecode_tab.get((kind == "i", itemsize))
+            if typecode is None:
+                raise ValueError(f"unsupported array {kind}{itemsize}")
+            if offset + itemsize*count > len(buf):
+                raise ValueError(f"{name} of track {track.get('track_id')} "
+                                 "is truncated")
+            v_raw = buf[offset:offset+itemsize*count]
+            if sys.byteorder == "little" or itemsize == 1:
+                v_val = v_raw.cast(typecode)
+            else:
+                v_val = array(typecode, v_raw)
+                v_val.byteswap()
+            track["arrays"][name] = v_val
+    return header["meta"], header["tracks"]
+
+def codec_meta(track):
+    """
+    return the codec of a SampleTable or SampleIndex for the header.
+    """
+    decoder_config = track.decoder_config
+    return {"codec": track.codec,
+            "decoder_config": (None if decoder_config is None
+                               else bytes(decoder_config).hex())}
+
+def codec_args(track):
+    decoder_config = track.get("decoder_config")
+    return {"codec": track.get("codec"),
+            "decoder_config": (None if decoder_config is None
+                               else bytes.fromhex(decoder_config))}
+
+def dump_indexes(fd, indexes, meta=None):
+    """
+    write the SampleIndex of the tracks into fd.
+    """
+    tracks = []
+    for index in indexes:
+        arrays = {"offset": index.offset, "size": index.size,
+                  "dts": index.dts, "sync": index.sync}
+        if index.cts is not index.dts:
+            arrays["cts"] = index.cts
+        if index.sync_samples is not None:
+            arrays["sync_samples"] = index.sync_samples
+        tracks.append({"track_id": index.track_id, "media": index.media,
+                       "timescale": index.timescale,
+                       **codec_meta(index), "arrays": arrays})
+    dump(fd, tracks, meta)
+
+def load_indexes(buf):
+    """
+    return (meta, the SampleIndex of the tracks) of the file in buf.
+    """
+    meta, tracks = load(buf)
+    indexes = []
+    for track in tracks:
+        arrays = track["arrays"]
+        indexes.append(SampleIndex(arrays["offset"], arrays["size"],
+                                   arrays["dts"],
+                                   arrays.get("cts", arrays["dts"]),
+                                   arrays["sync"], arrays.get("sync_samples"),
+                                   track_id=track.get("track_id"),
+                                   media=track.get("media"),
+                                   timescale=track.get("timescale"),
+                                   **codec_args(track)))
+    return meta, indexes
+
+def dump_tables(fd, tables, meta=None):
+    """
+    write the SampleTable of the tracks into fd, i.e. the sample tables
+    in the run-length form of the boxes.
+    """
+    tracks = []
+    for table in tables:
+        arrays = {"stts_sample_count": table.stts.sample_count,
+                  "stts_sample_delta": table.stts.sample_delta,
+                  "stsc_first_chunk": table.stsc.first_chunk,
+                  "stsc_samples_per_chunk": table.stsc.samples_per_chunk,
+                  "chunk_offset": table.chunk_offset}
+        if table.stsc.sample_description_index is not None:
+            arrays["stsc_sample_description_index"] = \
+                    table.stsc.sample_description_index
+        if table.stsz.entry_size is not None:
+            arrays["stsz_entry_size"] = table.stsz.entry_size
+        if table.ctts is not None:
+            arrays["ctts_sample_count"] = table.ctts.sample_count
+            arrays["ctts_sample_offset"] = table.ctts.sample_offset
+        if table.stss is not None:
+            arrays["stss"] = table.stss
+        tracks.append({"track_id": table.track_id, "media": table.media,
+                       "timescale": table.timescale,
+                       **codec_meta(table),
+                       "sample_size": table.stsz.sample_size,
+                       "sample_count": table.stsz.sample_count,
+                       "arrays": arrays})
+    dump(fd, tracks, meta)
+
+def load_tables(buf):
+    """
+    return (meta, the SampleTable of the tracks) of the file in buf.
+    """
+    meta, tracks = load(buf)
+    tables = []
+    for track in tracks:
+        arrays = track["arrays"]
+        chunk_offset = arrays["chunk_offset"]
+        stts = SttsTable(arrays["stts_sample_count"],
+                         arrays["stts_sample_delta"])
+        stsc = StscTable(arrays["stsc_first_chunk"],
+                         arrays["stsc_samples_per_chunk"], len(chunk_offset),
+                         arrays.get("stsc_sample_description_index"))
+        stsz = StszTable(track["sample_size"], track["sample_count"],
+                         arrays.get("stsz_entry_size"))
+        ctts = None
+        if "ctts_sample_count" in arrays:
+            ctts = CttsTable(arrays["ctts_sample_count"],
+                             arrays["ctts_sample_offset"])
+        tables.append(SampleTable(track.get("track_id"), track.get("media"),
+                                  track.get("timescale"), stts, stsc, stsz,
+                                  chunk_offset, ctts=ctts,
+                                  stss=arrays.get("stss"),
+                                  **codec_args(track)))
+    return meta, tables
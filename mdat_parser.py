@@ -1,42 +1,136 @@
 import sys
 import os
-from adts_parser import parse_adts, adts_hdr, adts_fmt
+import re
+import mmap
+from adts_parser import decode_adts_header, adts_hdr, adts_fmt
 
-def read_mdat(buf, file_size):
-    print(adts_fmt.format(**adts_hdr))
-    i = 0
-    while i < file_size:
-        if buf[i] == 0xff and buf[i+1] in [0xf0, 0xf1, 0xf8, 0xf9]:
-            hdr = parse_adts(buf[i:])
-            if (hdr["frame_length"] > 7 and
-                hdr["freq"] not in ["RESERVED", "EXPLICIT"] and
-                hdr["profile"] == "LC" and
-                hdr["ch_conf"] not in ["PCE"]):
-                hdr.update({"offset":i})
-                print(adts_fmt.format(**hdr))
-                i += hdr["frame_length"]
+"""
+scan the data in mdat for the ADTS frames and the start codes.
+
+the candidates are found by a regular expression over a block of the
+buffer, e.g. mmap, and the ADTS headers of the candidates in a block are
+validated at once.  a candidate in an ADTS frame found before is skipped.
+each record is a dict, e.g.
+
+    {"type": "adts", "offset": 0, "profile": "LC", "freq": "48000Hz", ...}
+    {"type": "avcc", "offset": 124, "code": b"\\0\\0\\0\\x1d", "data": ...}
+    {"type": "annexb", "offset": 300, "code": b"\\0\\0\\1", "data": ...}
+
+where "avcc" is of 3 zero bytes, i.e. the length of AVCC or the start
+code of 4 bytes, and "annexb" is of the start code of 3 bytes.  "data"
+is the 4 bytes after the code.
+"""
+
+DEFAULT_KINDS = ("adts", "avcc")
+DEFAULT_BLOCK_SIZE = 4*1024*1024
+
+pattern_tab = {
+        "adts": rb"\xff[\xf0\xf1\xf8\xf9]",
+        "avcc": rb"\x00\x00\x00",
+        "annexb": rb"\x00\x00\x01",
+        }
+
+def get_pattern(kinds):
+    for kind in kinds:
+        if kind not in pattern_tab:
+            raise ValueError(f"unknown kind {kind}")
+    # the lookahead matches at every offset, i.e. overlapped candidates.
+    return re.compile(b"(?=" + b"|".join(pattern_tab[kind] for kind in kinds)
+                      + b")")
+
+def is_valid_adts(v):
+    """
+    v: the 56 bits of the header.
+    only LC with a sampling frequency index and a channel configuration
+    is taken, so that the bytes of other data are not taken as a frame.
+    """
+    return (v >> 13 & 0x1fff > 7 and     # frame_length
+            v >> 38 & 3 == 1 and         # profile, LC
+            v >> 34 & 0xf < 13 and       # not RESERVED nor EXPLICIT
+            v >> 30 & 7 != 0)            # ch_conf, not PCE
+
+def scan_mdat(buf, offset=0, end=None, kinds=DEFAULT_KINDS,
+              block_size=DEFAULT_BLOCK_SIZE):
+    """
+    yield the record of each ADTS frame and start code in buf from offset
+    to end in the order of the offset.
+    """
+    if end is None:
+        end = len(buf)
+    pattern = get_pattern(kinds)
+    scan_adts = "adts" in kinds
+    pos = offset
+    while pos < end:
+        block_end = min(pos + block_size, end)
+        # the bytes after the block are for a candidate at its end.
+        cands = [m.start() for m in pattern.finditer(buf, pos,
+                                                     min(block_end+2, end))]
+        if cands and cands[-1] >= block_end:
+            cands = [i for i in cands if i < block_end]
+        adts = {}
+        if scan_adts:
+            for i in cands:
+                if buf[i] == 0xff and i + 7 <= end:
+                    v = int.from_bytes(buf[i:i+7], "big")
+                    if is_valid_adts(v):
+                        adts[i] = v
+        for i in cands:
+            if i < pos:
+                # in the ADTS frame found before.
                 continue
-        elif buf[i:i+3] == b"\x00\x00\x00":
-            print(buf[i:i+4].hex(), buf[i+4:i+8].hex())
-        # other case
-        i += 1
+            if buf[i] == 0xff:
+                v = adts.get(i)
+                if v is not None:
+                    record = {"type": "adts", "offset": i}
+                    record.update(decode_adts_header(v))
+                    yield record
+                    pos = i + record["frame_length"]
+            elif buf[i+2] == 0:
+                yield {"type": "avcc", "offset": i, "code": bytes(buf[i:i+4]),
+                       "data": bytes(buf[i+4:i+8])}
+            else:
+                yield {"type": "annexb", "offset": i,
+                       "code": bytes(buf[i:i+3]), "data": bytes(buf[i+3:i+7])}
+        pos = max(pos, block_end)
+
+def read_mdat(buf, file_size, kinds=DEFAULT_KINDS,
+              block_size=DEFAULT_BLOCK_SIZE):
+    print(adts_fmt.format(**adts_hdr))
+    for record in scan_mdat(buf, 0, file_size, kinds, block_size):
+        if record["type"] == "adts":
+            print(adts_fmt.format(**record))
+        else:
+            print(record["code"].hex(), record["data"].hex())
 
 #
 # parser main
 #
-from argparse import ArgumentParser
-from argparse import ArgumentDefaultsHelpFormatter
-ap = ArgumentParser(
-        description="mdat parser.",
-        formatter_class=ArgumentDefaultsHelpFormatter)
-ap.add_argument("input_file", help="data file.")
-ap.add_argument("-v", action="store_true", dest="verbose",
-                help="enable verbose mode.")
-ap.add_argument("-d", action="store_true", dest="debug",
-                help="enable debug mode.")
-opt = ap.parse_args()
-
-file_size = os.stat(opt.input_file).st_size
-print(f"file size: {file_size}")
-buf = open(opt.input_file, "rb").read()
-read_mdat(buf, file_size)
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="mdat parser.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("input_file", help="data file.")
+    ap.add_argument("--scan", action="store", dest="kinds",
+                    default=",".join(DEFAULT_KINDS),
+                    help="specify the kinds to be scanned, "
+                         f"i.e. {','.join(pattern_tab)}.")
+    ap.add_argument("--block-size", action="store", dest="block_size",
+                    type=int, default=DEFAULT_BLOCK_SIZE,
+                    help="specify the size in bytes to be scanned at once.")
+    ap.add_argument("-v", action="store_true", dest="verbose",
+                    help="enable verbose mode.")
+    ap.add_argument("-d", action="store_true", dest="debug",
+                    help="enable debug mode.")
+    opt = ap.parse_args(argv)
+
+    file_size = os.stat(opt.input_file).st_size
+    print(f"file size: {file_size}")
+    with open(opt.input_file, "rb") as fd:
+        if file_size > 0:
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            read_mdat(buf, file_size, opt.kinds.split(","), opt.block_size)
+
+if __name__ == "__main__":
+    main()
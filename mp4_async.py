@@ -0,0 +1,283 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from mp4_parser import DEFAULT_MAX_ALLOC, con_tab, pf_tab, parse_box
+from mp4_parser import get_sample_table
+from mp4_parser import match_type, find_boxes
+from mp4_source import FileSource
+from sample_table import SampleIndex
+
+"""
+asyncio API of the parser.
+
+the file is read in the executor so that a slow file system does not
+block the event loop.  the box headers at the top level are read with
+read-ahead, and a container, e.g. moov, is read at once and then parsed
+in the memory by the same Box as Mp4File.  the samples of which the data
+is contiguous in the file are read at once.
+
+the executor is shared by all files and its size is bounded, so that
+hundreds of files can be probed at the same time, e.g.
+
+    async def probe(path):
+        async with await AsyncMp4File.open(path) as mp4:
+            return await mp4.get_sample_indexes()
+
+    await asyncio.gather(*[probe(path) for path in paths])
+"""
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_READ_AHEAD = 64*1024
+DEFAULT_MAX_READ = 1024*1024
+
+_executor = None
+
+def get_executor():
+    """
+    return the executor shared by the files.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS,
+                                       thread_name_prefix="mp4_async")
+    return _executor
+
+async def run_in_executor(executor, func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or get_executor(), func, *args)
+
+class AsyncFileSource:
+    """
+    an async byte source, i.e. it has the size of the data and
+    "await read(offset, size)".  the file is read by FileSource in the
+    executor.
+    """
+    def __init__(self, fd, executor=None):
+        self.fd = fd
+        self.executor = executor
+        self._source = FileSource(fd)
+        self.size = self._source.size
+
+    @classmethod
+    async def open(cls, path, executor=None):
+        fd = await run_in_executor(executor, open, path, "rb")
+        try:
+            return await run_in_executor(executor, cls, fd, executor)
+        except BaseException:
+            fd.close()
+            raise
+
+    async def read(self, offset, size):
+        return await run_in_executor(self.executor, self._source.read,
+                                     offset, size)
+
+    async def close(self):
+        await run_in_executor(self.executor, self.fd.close)
+
+class BufferSource:
+    """
+    the bytes read at offset in the file, which is given to the parsers
+    in place of Mp4File.
+    """
+    def __init__(self, buf, offset):
+        self.buf = buf
+        self.offset = offset
+        self.size = offset + len(buf)
+
+    def read(self, offset, size):
+        i = offset - self.offset
+        if not 0 <= i <= len(self.buf) - size:
+            raise ValueError(f"{size} bytes at {offset} are out of the buffer "
+                             f"at {self.offset}")
+        return self.buf[i:i+size]
+
+class AsyncMp4File:
+    """
+    an MP4 file read by an async byte source.
+    """
+    def __init__(self, source, max_alloc=DEFAULT_MAX_ALLOC,
+                 read_ahead=DEFAULT_READ_AHEAD, executor=None):
+        self.source = source
+        self.size = source.size
+        self.max_alloc = max_alloc
+        self.read_ahead = read_ahead
+        self.executor = executor
+        self._own_source = False
+        self._block = None
+        self._boxes = None
+        self._loaded = {}
+
+    @classmethod
+    async def open(cls, mp4file, executor=None, **kwargs):
+        """
+        mp4file: a path, or an async byte source.
+        """
+        if isinstance(mp4file, (str, bytes, os.PathLike)):
+            source = await AsyncFileSource.open(mp4file, executor)
+            self = cls(source, executor=executor, **kwargs)
+            self._own_source = True
+        else:
+            self = cls(mp4file, executor=executor, **kwargs)
+        return self
+
+    async def close(self):
+        if self._own_source:
+            await self.source.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def read(self, offset, size):
+        """
+        see Mp4File.read().
+        """
+        if size > self.max_alloc:
+            raise ValueError(f"read size {size} exceeds max_alloc {self.max_alloc}")
+        return await self.source.read(offset, size)
+
+    async def _read_header(self, offset):
+        """
+        return the BufferSource which has the box header at offset.
+        the bytes after the header are read together for the next box.
+        """
+        block = self._block
+        if (block is None or not block.offset <= offset or
+                offset + 32 > block.size and block.size < self.size):
+            size = min(max(self.read_ahead, 32), self.size - offset)
+            block = BufferSource(await self.read(offset, size), offset)
+            self._block = block
+        return block
+
+    async def boxes(self):
+        """
+        return the boxes at the top level.  only the headers are read.
+        """
+        if self._boxes is None:
+            boxes = []
+            offset = 0
+            while self.size - offset >= 8:
+                box = parse_box(await self._read_header(offset), offset,
+                                self.size)
+                if self.size - offset < box.size:
+                    raise ValueError(f"box_size is too big, {box.size} > "
+                                     f"{self.size-offset}")
+                if box.size < box.hdr_size:
+                    raise ValueError(f"box_size is too small, {box.size} < "
+                                     f"{box.hdr_size}")
+                boxes.append(box)
+                offset += box.size
+            self._boxes = boxes
+            self._block = None
+        return self._boxes
+
+    async def load(self, box):
+        """
+        read the whole box at once, and return the box of which the
+        children and the payload are decoded without I/O.
+        """
+        if box.offset not in self._loaded:
+            buf = await self.read(box.offset, box.size)
+            self._loaded[box.offset] = parse_box(BufferSource(buf, box.offset),
+                                                 box.offset, box.end,
+                                                 box.depth)
+        return self._loaded[box.offset]
+
+    async def load_decoded(self, box):
+        """
+        return the box loaded if it is decoded, i.e. a container or a box
+        of which the payload is parsed, or else the box of which only the
+        header is read, e.g. mdat.
+        """
+        if box.type in con_tab or box.type in pf_tab:
+            return await self.load(box)
+        return box
+
+    async def walk(self):
+        """
+        yield all boxes.  a box at the top level is loaded if it is
+        decoded, see load_decoded().
+        """
+        for box in await self.boxes():
+            box = await self.load_decoded(box)
+            for child in box.walk():
+                yield child
+
+    async def find_all(self, path):
+        name, _, rest = path.partition("/")
+        found = []
+        for box in await self.boxes():
+            if name == "**":
+                box = await self.load_decoded(box)
+                found.extend(find_boxes([box], path))
+                continue
+            if not match_type(box.type, name):
+                continue
+            if rest:
+                if box.type in con_tab:
+                    box = await self.load(box)
+                    found.extend(box.find_all(rest))
+            else:
+                found.append(await self.load_decoded(box))
+        return found
+
+    async def find(self, path):
+        found = await self.find_all(path)
+        return found[0] if found else None
+
+    async def get_moov(self):
+        moov = await self.find("moov")
+        if moov is None:
+            raise ValueError("moov is not found")
+        return await self.load(moov)
+
+    async def get_sample_tables(self):
+        """
+        see Mp4File.get_sample_tables().
+        """
+        moov = await self.get_moov()
+        return await run_in_executor(
+                self.executor,
+                lambda: [get_sample_table(trak) for trak in moov.find_all("trak")])
+
+    async def get_sample_indexes(self):
+        """
+        see Mp4File.get_sample_indexes().
+        """
+        tables = await self.get_sample_tables()
+        return await run_in_executor(
+                self.executor,
+                lambda: [SampleIndex.from_table(table) for table in tables])
+
+    async def iter_runs(self, index, samples=None, max_read=DEFAULT_MAX_READ):
+        """
+        yield (samples, data) of the runs of the samples of which the data
+        is contiguous in the file, up to max_read bytes.
+        samples: the sample numbers in SampleIndex, all samples if None.
+        """
+        for run,offset,size in index.runs(samples, max_read):
+            yield run, await self.read(offset, size)
+
+    async def iter_samples(self, index, samples=None,
+                           max_read=DEFAULT_MAX_READ):
+        """
+        yield (n, data) of each sample.
+        """
+        async for run,buf in self.iter_runs(index, samples, max_read):
+            start = index.offset[run[0]]
+            for n in run:
+                i = index.offset[n] - start
+                yield n, buf[i:i+index.size[n]]
+
+    async def extract(self, index, fd_dst, samples=None,
+                      max_read=DEFAULT_MAX_READ):
+        """
+        write the data of the samples into fd_dst, and return the size.
+        """
+        total = 0
+        async for run,buf in self.iter_runs(index, samples, max_read):
+            await run_in_executor(self.executor, fd_dst.write, buf)
+            total += len(buf)
+        return total
@@ -0,0 +1,148 @@
+import os
+import sys
+import glob
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from mp4_parser import Mp4File, DEFAULT_MAX_ALLOC, get_sample_table
+
+"""
+inspect many MP4 files with a process pool.
+
+the result of each file is a dict, and is yielded in the order of the
+completion.  an error in a file is put into the result of the file, e.g.
+
+    {"path": "a.mp4", "size": 1234,
+     "boxes": [{"type": "ftyp", "offset": 0, "size": 32}, ...],
+     "duration": 10.0,
+     "tracks": [{"track_id": 1, "media": "video", "timescale": 12800,
+                 "samples": 300, "duration": 10.0}, ...],
+     "error": null}
+"""
+
+DEFAULT_EXTENSIONS = (".mp4", ".m4a", ".m4v", ".mov")
+
+def iter_paths(inputs, extensions=DEFAULT_EXTENSIONS):
+    """
+    yield the files of inputs, which are files, directories or globs.
+    the files in a directory are found recursively by the extensions.
+    """
+    for name in inputs:
+        if os.path.isdir(name):
+            for root,dirs,files in os.walk(name):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if file_name.lower().endswith(tuple(extensions)):
+                        yield os.path.join(root, file_name)
+        elif glob.has_magic(name):
+            for path in sorted(glob.iglob(name, recursive=True)):
+                if os.path.isdir(path):
+                    yield from iter_paths([path], extensions)
+                else:
+                    yield path
+        else:
+            yield name
+
+def inspect_file(path, max_alloc=DEFAULT_MAX_ALLOC):
+    """
+    return the summary of a file.
+    """
+    result = {"path": path, "size": None, "boxes": [], "duration": None,
+              "tracks": [], "error": None}
+    try:
+        with Mp4File(path, max_alloc=max_alloc) as mp4:
+            result["size"] = mp4.size
+            for box in mp4.boxes:
+                result["boxes"].append({"type": box.type,
+                                        "offset": box.offset,
+                                        "size": box.size})
+            mvhd = mp4.find("moov/mvhd")
+            if mvhd is not None and mvhd.payload["timescale"]:
+                result["duration"] = (mvhd.payload["duration"] /
+                                      mvhd.payload["timescale"])
+            for trak in mp4.find_all("moov/trak"):
+                table = get_sample_table(trak)
+                track = {"track_id": table.track_id, "media": table.media,
+                         "timescale": table.timescale, "samples": len(table),
+                         "duration": None}
+                if table.timescale:
+                    track["duration"] = table.stts.duration / table.timescale
+                result["tracks"].append(track)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+def inspect_files(paths, max_workers=None, max_alloc=DEFAULT_MAX_ALLOC):
+    """
+    yield the summary of each file in the order of the completion.
+    the number of the files given to the pool at once is bounded, so
+    that paths can be a generator of many files.
+    max_workers: the number of the processes, the number of the cores
+        if None.  the files are inspected in this process if 1.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1:
+        for path in paths:
+            yield inspect_file(path, max_alloc)
+        return
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers) as executor:
+        pending = {}
+        while True:
+            for path in paths:
+                pending[executor.submit(inspect_file, path, max_alloc)] = path
+                if len(pending) >= max_workers*4:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # e.g. the worker process was killed.
+                    yield {"path": path, "error": f"{type(e).__name__}: {e}"}
+
+#
+# parser main
+#
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="inspect MP4 files, and print the result of each "
+                        "file in JSON Lines.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("inputs", nargs="+",
+                    help="MP4 files, directories or globs.")
+    ap.add_argument("-j", action="store", dest="jobs", type=int,
+                    help="specify the number of the processes, "
+                         "the number of the cores if not specified.")
+    ap.add_argument("--ext", action="store", dest="extensions",
+                    default=",".join(DEFAULT_EXTENSIONS),
+                    help="specify the extensions of the files "
+                         "in the directories.")
+    ap.add_argument("--max-alloc", action="store", dest="max_alloc",
+                    type=int, default=DEFAULT_MAX_ALLOC,
+                    help="specify the maximum size in bytes to be read at once.")
+    ap.add_argument("-o", action="store", dest="output",
+                    help="specify a file name to store the result.")
+    opt = ap.parse_args(argv)
+
+    paths = iter_paths(opt.inputs, opt.extensions.split(","))
+    fd = open(opt.output, "w") if opt.output else sys.stdout
+    try:
+        nb_errors = 0
+        for result in inspect_files(paths, opt.jobs, opt.max_alloc):
+            if result["error"]:
+                nb_errors += 1
+            fd.write(json.dumps(result) + "\n")
+            fd.flush()
+    finally:
+        if fd is not sys.stdout:
+            fd.close()
+    return 1 if nb_errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
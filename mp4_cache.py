@@ -0,0 +1,221 @@
+import os
+import time
+import hashlib
+import tempfile
+from sample_table import SampleIndex
+from index_file import dump_indexes, load_indexes
+
+"""
+on-disk cache of the SampleIndex of the files.
+
+an entry is an index file (see index_file.py) named by the hash of the
+real path of the MP4 file, and its meta has the size and mtime of the
+file and the hash of the moov box.  an entry is validated by stat()
+first, and then by the hash of moov, so that the sample tables are not
+decoded at all when the file is not changed.
+
+the entries are written to a temporary file and renamed, so that the
+processes sharing the directory never read a partial entry.  the
+entries are evicted from the least recently used one when the total
+size exceeds max_size, and the temporary files left by the killed
+writers are removed.
+"""
+
+DEFAULT_MAX_SIZE = 256*1024*1024
+SUFFIX = ".idx"
+TMP_SUFFIX = ".tmp"
+# a temporary file older than this, in seconds, is of a writer killed
+# before the rename.
+TMP_MAX_AGE = 3600
+
+def default_cache_dir():
+    cache_dir = os.environ.get("MP4_INDEX_CACHE")
+    if cache_dir:
+        return cache_dir
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "mp4parser")
+
+def hash_box(mp4, box, buf_size=1024*1024):
+    """
+    return the hash of the whole box.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    offset = box.offset
+    while offset < box.end:
+        buf = mp4.read(offset, min(buf_size, box.end-offset))
+        if not buf:
+            break
+        h.update(buf)
+        offset += len(buf)
+    return h.hexdigest()
+
+class IndexCache:
+    """
+    cache_dir: the directory of the entries, see default_cache_dir().
+    max_size: the total size of the entries in bytes.
+    """
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def entry_path(self, path):
+        name = hashlib.sha1(os.fsencode(os.path.realpath(path))).hexdigest()
+        return os.path.join(self.cache_dir, name + SUFFIX)
+
+    def file_key(self, mp4):
+        """
+        return the key of mp4 without the hash of moov, or None if mp4 is
+        not a file of which the path is known.
+        """
+        path = getattr(mp4.fd, "name", None)
+        if not isinstance(path, (str, bytes)):
+            return None
+        st = os.fstat(mp4.fd.fileno())
+        return {"path": os.path.realpath(os.fsdecode(path)),
+                "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def moov_hash(self, mp4):
+        moov = mp4.find("moov")
+        if moov is None:
+            return None
+        return hash_box(mp4, moov)
+
+    def get(self, mp4, key=None, moov_hash=None):
+        """
+        return the SampleIndex of the tracks of mp4 in the cache, or None.
+        moov_hash: the hash of moov if it is made before.
+        """
+        key = key or self.file_key(mp4)
+        if key is None:
+            return None
+        entry = self.entry_path(key["path"])
+        try:
+            with open(entry, "rb") as fd:
+                buf = fd.read()
+            meta, indexes = load_indexes(buf)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if any(meta.get(k) != key[k] for k in ("path", "size", "mtime_ns")):
+            self.misses += 1
+            return None
+        if moov_hash is None:
+            moov_hash = self.moov_hash(mp4)
+        if meta.get("moov_hash") != moov_hash:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # the mtime of the entry is the time of the last use.
+            os.utime(entry)
+        except OSError:
+            pass
+        return indexes
+
+    def put(self, mp4, indexes, key=None, moov_hash=None):
+        """
+        store the SampleIndex of the tracks of mp4.
+        moov_hash: the hash of moov if it is made before.
+        """
+        key = key or self.file_key(mp4)
+        if key is None:
+            return
+        if moov_hash is None:
+            moov_hash = self.moov_hash(mp4)
+        meta = dict(key, moov_hash=moov_hash)
+        fd_tmp, tmp_path = tempfile.mkstemp(suffix=TMP_SUFFIX,
+                                            dir=self.cache_dir)
+        try:
+            with os.fdopen(fd_tmp, "wb") as fd:
+                dump_indexes(fd, indexes, meta)
+            os.replace(tmp_path, self.entry_path(key["path"]))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def get_sample_indexes(self, mp4):
+        """
+        return the SampleIndex of the tracks from the cache, or decode and
+        store them if not cached.
+        """
+        key = self.file_key(mp4)
+        if key is None:
+            return [SampleIndex.from_table(table)
+                    for table in mp4.get_sample_tables()]
+        # moov is hashed once, either to validate the entry or to store
+        # a new one.
+        moov_hash = self.moov_hash(mp4)
+        indexes = self.get(mp4, key, moov_hash)
+        if indexes is None:
+            indexes = [SampleIndex.from_table(table)
+                       for table in mp4.get_sample_tables()]
+            self.put(mp4, indexes, key, moov_hash)
+        return indexes
+
+    def evict(self):
+        """
+        remove the least recently used entries until the total size is
+        max_size or less.
+        """
+        entries = []
+        total = 0
+        self.remove_stale_tmp()
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if not e.name.endswith(SUFFIX):
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, e.path))
+                total += st.st_size
+        entries.sort()
+        for mtime,size,path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # removed by another process.
+                pass
+            total -= size
+
+    def remove_stale_tmp(self, max_age=TMP_MAX_AGE):
+        """
+        remove the temporary files older than max_age seconds, which are
+        left by the writers killed before the rename.  the files of the
+        writers in progress are kept.
+        """
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if not e.name.endswith(TMP_SUFFIX):
+                    continue
+                try:
+                    if now - e.stat().st_mtime > max_age:
+                        os.unlink(e.path)
+                except FileNotFoundError:
+                    # removed by another process.
+                    pass
+
+    def clear(self):
+        self.remove_stale_tmp()
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(SUFFIX):
+                    try:
+                        os.unlink(e.path)
+                    except FileNotFoundError:
+                        pass
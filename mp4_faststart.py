@@ -0,0 +1,249 @@
+import os
+import sys
+import struct
+from array import array
+from bisect import bisect_right
+from mp4_parser import Mp4File, DEFAULT_MAX_ALLOC, con_tab, array_tab
+from mp4_source import copy_range
+
+"""
+faststart, i.e. move moov before mdat, so that a player can start to
+play the file before the whole file is downloaded.
+
+the chunk offsets in stco and co64 are shifted by the size of moov, and
+stco is promoted to co64 if an offset exceeds 32 bits.  only moov is
+made in the memory, and the other boxes are copied as they are by the
+kernel, so that the memory does not depend on the size of mdat.
+
+in place, moov is written into the free boxes before mdat, and the old
+moov is truncated if it is at the end of the file, or becomes a free box.
+mdat is not moved, so that no chunk offset is changed.
+
+Note: only the offsets in stco and co64 are changed as qt-faststart,
+    e.g. saio and iloc are not.
+"""
+
+MEDIA_DATA_TYPES = ("mdat",)
+FREE_TYPES = ("free", "skip")
+# the containers on the path to stco and co64, which are made again.
+REBUILD_TYPES = ("moov", "trak", "mdia", "minf", "stbl")
+
+def make_box(box_type, body, extended=False):
+    """
+    return the box of body, of which the size is 64 bits if needed.
+    """
+    size = 8 + len(body)
+    if extended or size > 0xffffffff:
+        return struct.pack(">I4sQ", 1, box_type.encode(), size + 8) + body
+    return struct.pack(">I4s", size, box_type.encode()) + body
+
+def encode_array(v_val, v_size):
+    """
+    encode the integers into big endian of v_size bytes at once.
+    """
+    v_val = array(array_tab[(v_size, False)], v_val)
+    if sys.byteorder == "little":
+        v_val.byteswap()
+    return v_val.tobytes()
+
+class Layout:
+    """
+    the new offsets of the boxes at the top level.
+    order: the boxes in the new order.
+    moov_size: the size of the new moov.
+    """
+    def __init__(self, order, moov, moov_size):
+        self.order = order
+        self.moves = []
+        offset = 0
+        for box in order:
+            if box is moov:
+                offset += moov_size
+                continue
+            self.moves.append((box.offset, box.end, offset - box.offset))
+            offset += box.size
+        self.moves.sort()
+        self.starts = [start for start,end,delta in self.moves]
+        self.size = offset
+
+    def shift(self, offsets):
+        """
+        return the new offsets of the offsets in the file.
+        """
+        deltas = {delta for start,end,delta in self.moves}
+        if len(deltas) == 1:
+            delta = deltas.pop()
+            if delta == 0:
+                return offsets
+            if min(offsets, default=0) + delta < 0:
+                raise ValueError("chunk offset is out of the boxes")
+            return array("Q", [x + delta for x in offsets])
+        v_val = array("Q")
+        for x in offsets:
+            i = bisect_right(self.starts, x) - 1
+            if i < 0 or x >= self.moves[i][1]:
+                raise ValueError(f"chunk offset {x} is out of the boxes")
+            v_val.append(x + self.moves[i][2])
+        return v_val
+
+def rebuild(box, layout):
+    """
+    return the bytes of box of which the chunk offsets are shifted.
+    """
+    if box.type in ("stco", "co64"):
+        offsets = layout.shift(box.payload["chunk_offset"])
+        if box.type == "co64" or max(offsets, default=0) > 0xffffffff:
+            box_type, v_size = "co64", 8
+        else:
+            box_type, v_size = "stco", 4
+        body = (struct.pack(">II", 0, len(offsets)) +
+                encode_array(offsets, v_size))
+        return make_box(box_type, body)
+    if box.type in REBUILD_TYPES:
+        body = b"".join(rebuild(child, layout) for child in box.children)
+        if box.body_size > con_tab[box.type] + sum(child.size for child in
+                                                   box.children):
+            raise ValueError(f"{box.type} has the data after the boxes")
+        return make_box(box.type, bytes(box.read(0, con_tab[box.type])) + body,
+                        box.extended)
+    return bytes(box.mp4.read(box.offset, box.size))
+
+def get_boxes(mp4):
+    """
+    return (moov, the index of the first mdat) of the boxes at the top level.
+    """
+    types = [box.type for box in mp4.boxes]
+    if types.count("moov") != 1:
+        raise ValueError(f"{types.count('moov')} moov boxes in the file")
+    if "moof" in types:
+        raise ValueError("fragmented file is not supported")
+    first_mdat = next((i for i,box_type in enumerate(types)
+                       if box_type in MEDIA_DATA_TYPES), None)
+    if first_mdat is None:
+        raise ValueError("no mdat in the file")
+    return mp4.boxes[types.index("moov")], first_mdat
+
+def is_faststart(mp4):
+    moov, first_mdat = get_boxes(mp4)
+    return mp4.boxes.index(moov) < first_mdat
+
+def make_layout(mp4):
+    """
+    return (Layout, the new moov).
+    the size of moov is fixed by iterations, because it grows when stco
+    is promoted to co64.
+    """
+    moov, first_mdat = get_boxes(mp4)
+    order = [box for box in mp4.boxes[:first_mdat] if box is not moov]
+    order.append(moov)
+    order.extend(box for box in mp4.boxes[first_mdat:] if box is not moov)
+    moov_size = moov.size
+    while True:
+        layout = Layout(order, moov, moov_size)
+        moov_raw = rebuild(moov, layout)
+        if len(moov_raw) == moov_size:
+            return layout, moov_raw
+        moov_size = len(moov_raw)
+
+def faststart(mp4, fd_dst):
+    """
+    write mp4 into fd_dst with moov before mdat.
+    """
+    layout, moov_raw = make_layout(mp4)
+    for box in layout.order:
+        if box.type == "moov":
+            fd_dst.write(moov_raw)
+        else:
+            copy_range(mp4.fd, fd_dst, box.offset, box.size)
+    fd_dst.flush()
+
+def find_free_space(mp4, size):
+    """
+    return the offset of the free boxes before mdat, of which the total
+    size is size, or more than size by a free box at least.
+    """
+    moov, first_mdat = get_boxes(mp4)
+    start = None
+    for box in mp4.boxes[:first_mdat] + [None]:
+        if box is not None and box.type in FREE_TYPES:
+            if start is None:
+                start = box.offset
+            continue
+        if start is not None:
+            space = (box.offset if box is not None else
+                     mp4.boxes[first_mdat].offset) - start
+            if space == size or space >= size + 8:
+                return start, space
+        start = None
+    return None, 0
+
+def faststart_in_place(fd):
+    """
+    move moov into the free boxes before mdat in fd opened in "r+b".
+    return False if moov is before mdat already.
+    """
+    with Mp4File(fd, backend="file") as mp4:
+        if is_faststart(mp4):
+            return False
+        moov, first_mdat = get_boxes(mp4)
+        offset, space = find_free_space(mp4, moov.size)
+        if offset is None:
+            raise ValueError(f"no free space of {moov.size} bytes "
+                             "before mdat")
+        buf = bytearray(mp4.read(moov.offset, moov.size))
+        if len(buf) != moov.size:
+            raise ValueError("moov is truncated")
+        if space > moov.size:
+            buf += make_box("free", b"")
+            buf[-8:-4] = struct.pack(">I", space - moov.size)
+        # the new moov is written first, so that the file has a moov at
+        # any time.
+        os.pwrite(fd.fileno(), buf, offset)
+        os.fsync(fd.fileno())
+        if moov.end == mp4.size:
+            os.ftruncate(fd.fileno(), moov.offset)
+        else:
+            os.pwrite(fd.fileno(), b"free", moov.offset + 4)
+    return True
+
+#
+# parser main
+#
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="move moov before mdat.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("mp4_file", help="MP4 file.")
+    ap.add_argument("output_file", nargs="?",
+                    help="specify a file name to be written.")
+    ap.add_argument("--in-place", action="store_true", dest="in_place",
+                    help="move moov into the free boxes before mdat "
+                         "in the file itself.")
+    ap.add_argument("--max-alloc", action="store", dest="max_alloc",
+                    type=int, default=DEFAULT_MAX_ALLOC,
+                    help="specify the maximum size in bytes to be read at once.")
+    opt = ap.parse_args(argv)
+
+    if opt.in_place:
+        if opt.output_file:
+            ap.error("output_file is not for --in-place")
+        with open(opt.mp4_file, "r+b") as fd:
+            if not faststart_in_place(fd):
+                print("moov is before mdat already.")
+        return 0
+    if not opt.output_file:
+        ap.error("output_file is required without --in-place")
+    if (os.path.exists(opt.output_file) and
+            os.path.samefile(opt.mp4_file, opt.output_file)):
+        ap.error("output_file is the same as mp4_file, use --in-place")
+    with Mp4File(opt.mp4_file, max_alloc=opt.max_alloc) as mp4:
+        if is_faststart(mp4):
+            print("moov is before mdat already.")
+        with open(opt.output_file, "wb") as fd_dst:
+            faststart(mp4, fd_dst)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+import os
+import sys
+import struct
+import operator
+from array import array
+from bisect import bisect_left
+from mp4_parser import Mp4File, DEFAULT_MAX_ALLOC
+from mp4_parser import TFHD_DEFAULT_SAMPLE_DURATION, TFHD_DEFAULT_SAMPLE_SIZE
+from mp4_parser import TFHD_DEFAULT_SAMPLE_FLAGS, TFHD_DEFAULT_BASE_IS_MOOF
+from mp4_parser import TRUN_DATA_OFFSET, TRUN_SAMPLE_DURATION
+from mp4_parser import TRUN_SAMPLE_SIZE, TRUN_SAMPLE_FLAGS
+from mp4_parser import TRUN_SAMPLE_COMPOSITION_TIME_OFFSET
+from mp4_faststart import make_box, encode_array, get_boxes
+from mp4_source import copy_range
+from sample_table import SampleIndex
+
+"""
+remux a progressive MP4 into fragmented MP4, i.e. the init segment of
+ftyp and moov, of which the sample tables are empty, and the media
+segments of moof and mdat, e.g. for DASH and HLS.
+
+the fragments are cut at the sync samples of the reference track, i.e.
+the first video track, every duration seconds at least, and the other
+tracks are cut at the same time.  the data of a track in a fragment is
+copied from the runs of the contiguous samples, i.e. the chunks, by the
+kernel, so that the samples are not read into the memory.
+
+the output is either a file of ftyp, moov, sidx and the pairs of moof
+and mdat, or the files of the segments, i.e. init.mp4 and each segment
+of styp, sidx, moof and mdat.
+
+Note: only the first sample entry of stsd is referred by the fragments,
+    and the sample groups, e.g. sbgp, are not carried.
+"""
+
+DEFAULT_DURATION = 4.0
+INIT_NAME = "init.mp4"
+SEGMENT_NAME = "seg-{:05d}.m4s"
+INIT_BRANDS = ("iso6", "iso5", "dash")
+SEGMENT_BRANDS = ("msdh", "msix")
+
+# ISO/IEC 14496-12 8.8.3.1, sample_depends_on and sample_is_non_sync_sample.
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+# the boxes in stbl which are emptied in the init segment.
+EMPTY_TABLES = (
+        ("stts", b"\0\0\0\0"),
+        ("stsc", b"\0\0\0\0"),
+        ("stsz", b"\0\0\0\0\0\0\0\0"),
+        ("stco", b"\0\0\0\0"),
+        )
+
+def make_full_box(box_type, version, flags, body):
+    return make_box(box_type, struct.pack(">I", version << 24 | flags) + body)
+
+def make_type_box(box_type, major_brand, brands):
+    return make_box(box_type, major_brand.encode() + b"\0\0\0\0" +
+                    "".join(brands).encode())
+
+def raw_box(box):
+    return bytes(box.mp4.read(box.offset, box.size))
+
+class Track:
+    """
+    the samples of a track to be fragmented.
+    duration is the array of the duration of each sample.
+    """
+    def __init__(self, table, trak):
+        if len(set(table.stsc.sample_description_index)) > 1:
+            raise ValueError(f"track {table.track_id} refers to "
+                             "multiple sample entries")
+        self.table = table
+        self.trak = trak
+        self.track_id = table.track_id
+        self.timescale = table.timescale
+        self.index = index = SampleIndex.from_table(table)
+        next_dts = index.dts[1:]
+        next_dts.append(table.stts.duration)
+        self.duration = array("Q", map(operator.sub, next_dts, index.dts))
+        if index.cts is index.dts:
+            self.cto = None
+        else:
+            self.cto = array("q", map(operator.sub, index.cts, index.dts))
+
+    def __len__(self):
+        return len(self.index)
+
+    def start_at(self, t, timescale):
+        """
+        the first sample of which the decoding time is t or after, in the
+        timescale, or the next sync sample of it.
+        """
+        dts = -(-t*self.timescale//timescale)
+        n = bisect_left(self.index.dts, dts)
+        sync_samples = self.index.sync_samples
+        if sync_samples is not None and n < len(self):
+            i = bisect_left(sync_samples, n)
+            n = sync_samples[i] if i < len(sync_samples) else len(self)
+        return n
+
+    def runs(self, start, stop):
+        """
+        the (offset, size) of the runs of the contiguous samples.
+        """
+        runs = []
+        offset = self.index.offset
+        size = self.index.size
+        for n in range(start, stop):
+            if runs and runs[-1][0] + runs[-1][1] == offset[n]:
+                runs[-1][1] += size[n]
+            else:
+                runs.append([offset[n], size[n]])
+        return runs
+
+    def make_traf(self, start, stop, data_offset):
+        """
+        return the traf of the samples from start to stop, of which the
+        data is at data_offset from moof.
+        """
+        index = self.index
+        tf_flags = TFHD_DEFAULT_BASE_IS_MOOF
+        tfhd = b""
+        columns = []
+        tr_flags = TRUN_DATA_OFFSET
+        version = 0
+        for v_val,tf_bit,tr_bit in (
+                (self.duration[start:stop], TFHD_DEFAULT_SAMPLE_DURATION,
+                 TRUN_SAMPLE_DURATION),
+                (index.size[start:stop], TFHD_DEFAULT_SAMPLE_SIZE,
+                 TRUN_SAMPLE_SIZE)):
+            if min(v_val) == max(v_val):
+                tf_flags |= tf_bit
+                tfhd += struct.pack(">I", v_val[0])
+            else:
+                tr_flags |= tr_bit
+                columns.append(v_val)
+        if index.sync_samples is None:
+            tf_flags |= TFHD_DEFAULT_SAMPLE_FLAGS
+            tfhd += struct.pack(">I", SYNC_SAMPLE_FLAGS)
+        else:
+            tr_flags |= TRUN_SAMPLE_FLAGS
+            columns.append([SYNC_SAMPLE_FLAGS if v else NON_SYNC_SAMPLE_FLAGS
+                            for v in index.sync[start:stop]])
+        if self.cto is not None:
+            tr_flags |= TRUN_SAMPLE_COMPOSITION_TIME_OFFSET
+            cto = self.cto[start:stop]
+            if min(cto) < 0:
+                version = 1
+            columns.append([v & 0xffffffff for v in cto])
+        nb_samples = stop - start
+        # interleave the fields of each sample.
+        v_val = array("Q", bytes(8*nb_samples*len(columns)))
+        for i,column in enumerate(columns):
+            v_val[i::len(columns)] = array("Q", column)
+        trun = make_full_box("trun", version, tr_flags,
+                             struct.pack(">Ii", nb_samples, data_offset) +
+                             encode_array(v_val, 4))
+        tfhd = make_full_box("tfhd", 0, tf_flags,
+                             struct.pack(">I", self.track_id) + tfhd)
+        tfdt = make_full_box("tfdt", 1, 0, struct.pack(">Q", index.dts[start]))
+        return make_box("traf", tfhd + tfdt + trun)
+
+    def presentation(self, start, stop):
+        """
+        return (the earliest presentation time, the end of it) of the
+        samples from start to stop.
+        """
+        if self.cto is None:
+            return self.index.dts[start], (self.index.dts[start] +
+                                           sum(self.duration[start:stop]))
+        cts = self.index.cts[start:stop]
+        return min(cts), max(map(operator.add, cts,
+                                 self.duration[start:stop]))
+
+class Fragment:
+    """
+    a pair of moof and mdat.
+    samples: the (Track, start, stop) of each track.
+    """
+    def __init__(self, sequence_number, samples):
+        self.sequence_number = sequence_number
+        self.samples = samples
+        self.mdat_size = sum(sum(track.index.size[start:stop])
+                             for track,start,stop in samples)
+        mdat_hdr_size = 8 if self.mdat_size + 8 <= 0xffffffff else 16
+        mfhd = make_full_box("mfhd", 0, 0, struct.pack(">I", sequence_number))
+        # the size of traf does not depend on data_offset.
+        moof_size = 8 + len(mfhd) + sum(len(track.make_traf(start, stop, 0))
+                                        for track,start,stop in samples)
+        data_offset = moof_size + mdat_hdr_size
+        trafs = []
+        for track,start,stop in samples:
+            trafs.append(track.make_traf(start, stop, data_offset))
+            data_offset += sum(track.index.size[start:stop])
+        self.moof = make_box("moof", mfhd + b"".join(trafs))
+        if mdat_hdr_size == 16:
+            self.mdat_hdr = struct.pack(">I4sQ", 1, b"mdat",
+                                        16 + self.mdat_size)
+        else:
+            self.mdat_hdr = struct.pack(">I4s", 8 + self.mdat_size, b"mdat")
+
+    @property
+    def size(self):
+        return len(self.moof) + len(self.mdat_hdr) + self.mdat_size
+
+    def write(self, fd_src, fd_dst):
+        fd_dst.write(self.moof)
+        fd_dst.write(self.mdat_hdr)
+        for track,start,stop in self.samples:
+            for offset,size in track.runs(start, stop):
+                copy_range(fd_src, fd_dst, offset, size)
+
+class Fragmenter:
+    """
+    the fragments of the tracks of mp4.
+    track_ids: the tracks to be fragmented, all tracks if None.
+    duration: the minimum duration of a fragment in seconds.
+    """
+    def __init__(self, mp4, track_ids=None, duration=DEFAULT_DURATION):
+        moov, first_mdat = get_boxes(mp4)
+        self.mp4 = mp4
+        self.moov = moov
+        self.tracks = []
+        for trak,table in zip(moov.find_all("trak"), mp4.get_sample_tables()):
+            if track_ids is None or table.track_id in track_ids:
+                self.tracks.append(Track(table, trak))
+        if track_ids is not None:
+            missing = set(track_ids) - {t.track_id for t in self.tracks}
+            if missing:
+                raise ValueError(f"no track {sorted(missing)}")
+        if not self.tracks:
+            raise ValueError("no track in the file")
+        self.ref = next((t for t in self.tracks if t.table.media == "video"),
+                        self.tracks[0])
+        self.duration = duration
+        self.fragments = list(self.make_fragments())
+
+    def cut_samples(self):
+        """
+        return the first sample of each fragment of the reference track.
+        """
+        ref = self.ref
+        dts = ref.index.dts
+        sync_samples = ref.index.sync_samples
+        if sync_samples is None:
+            sync_samples = range(len(ref))
+        sync_dts = [dts[n] for n in sync_samples]
+        step = max(1, int(self.duration*ref.timescale))
+        cuts = [0]
+        while True:
+            i = bisect_left(sync_dts, dts[cuts[-1]] + step)
+            if i >= len(sync_dts):
+                return cuts
+            cuts.append(sync_samples[i])
+
+    def make_fragments(self):
+        ref = self.ref
+        if len(ref) == 0:
+            return
+        cut_samples = self.cut_samples()
+        cuts = [ref.index.dts[n] for n in cut_samples]
+        starts = {}
+        for track in self.tracks:
+            if track is ref:
+                v_val = cut_samples
+            else:
+                v_val = [0] + [track.start_at(t, ref.timescale)
+                               for t in cuts[1:]]
+            starts[track] = v_val + [len(track)]
+        for i in range(len(cuts)):
+            samples = [(track, starts[track][i], starts[track][i+1])
+                       for track in self.tracks
+                       if starts[track][i] < starts[track][i+1]]
+            yield Fragment(i+1, samples)
+
+    def make_moov(self):
+        """
+        return moov of which the sample tables are empty, with mvex.
+        """
+        body = []
+        traks = {track.trak.offset: track for track in self.tracks}
+        for box in self.moov.children:
+            if box.type == "trak":
+                if box.offset in traks:
+                    body.append(self.make_trak(box))
+            elif box.type != "mvex":
+                body.append(raw_box(box))
+        mvhd = self.moov.find("mvhd").payload
+        mvex = [make_full_box("mehd", 1, 0, struct.pack(">Q",
+                                                        mvhd["duration"]))]
+        for track in self.tracks:
+            mvex.append(make_full_box("trex", 0, 0, struct.pack(
+                    ">IIIII", track.track_id, 1, 0, 0, 0)))
+        body.append(make_box("mvex", b"".join(mvex)))
+        return make_box("moov", b"".join(body))
+
+    def make_trak(self, box):
+        """
+        return the box of which stbl has only stsd and the empty tables.
+        """
+        if box.type == "stbl":
+            stsd = box.find("stsd")
+            if stsd is None:
+                raise ValueError("no stsd in stbl")
+            return make_box("stbl", raw_box(stsd) + b"".join(
+                    make_full_box(box_type, 0, 0, body)
+                    for box_type,body in EMPTY_TABLES))
+        if box.type in ("trak", "mdia", "minf"):
+            return make_box(box.type, b"".join(self.make_trak(child)
+                                               for child in box.children))
+        return raw_box(box)
+
+    def make_init(self):
+        brands = INIT_BRANDS
+        if len(self.tracks) == 1:
+            brands += ("cmfc",)
+        return make_type_box("ftyp", INIT_BRANDS[0], brands) + self.make_moov()
+
+    def make_sidx(self, fragments):
+        """
+        return sidx of the fragments, referred by the reference track.
+        """
+        references = []
+        ept = None
+        for frag in fragments:
+            for track,start,stop in frag.samples:
+                if track is self.ref:
+                    break
+            else:
+                raise ValueError(f"no sample of track {self.ref.track_id} "
+                                 f"in fragment {frag.sequence_number}")
+            t0, t1 = track.presentation(start, stop)
+            if ept is None:
+                ept = t0
+            references.append([frag.size, t0, t1,
+                               track.index.sync[start]])
+        buf = struct.pack(">IIQQHH", self.ref.track_id, self.ref.timescale,
+                          ept, 0, 0, len(references))
+        for i,(size,t0,t1,sap) in enumerate(references):
+            if i + 1 < len(references):
+                t1 = references[i+1][1]
+            if size > 0x7fffffff:
+                raise ValueError(f"fragment of {size} bytes is too large "
+                                 "for sidx")
+            buf += struct.pack(">III", size, t1 - t0,
+                               0x90000000 if sap else 0)
+        return make_full_box("sidx", 1, 0, buf)
+
+    def write(self, fd_dst):
+        """
+        write a file of the init segment, sidx and the fragments.
+        """
+        fd_dst.write(self.make_init())
+        fd_dst.write(self.make_sidx(self.fragments))
+        for frag in self.fragments:
+            frag.write(self.mp4.fd, fd_dst)
+        fd_dst.flush()
+
+    def write_segments(self, dir_name):
+        """
+        write the init segment and a file of each fragment into dir_name.
+        return the names of the files.
+        """
+        names = [INIT_NAME]
+        with open(os.path.join(dir_name, INIT_NAME), "wb") as fd_dst:
+            fd_dst.write(self.make_init())
+        styp = make_type_box("styp", SEGMENT_BRANDS[0], SEGMENT_BRANDS)
+        for frag in self.fragments:
+            name = SEGMENT_NAME.format(frag.sequence_number)
+            with open(os.path.join(dir_name, name), "wb") as fd_dst:
+                fd_dst.write(styp)
+                fd_dst.write(self.make_sidx([frag]))
+                frag.write(self.mp4.fd, fd_dst)
+            names.append(name)
+        return names
+
+#
+# parser main
+#
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="remux MP4 into fragmented MP4.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("mp4_file", help="MP4 file.")
+    ap.add_argument("output", help="specify a file name to be written, "
+                    "or a directory with --split.")
+    ap.add_argument("--duration", action="store", dest="duration",
+                    type=float, default=DEFAULT_DURATION,
+                    help="specify the minimum duration of a fragment "
+                         "in seconds.")
+    ap.add_argument("-t", action="append", dest="track_ids", type=int,
+                    help="specify the track ID to be written, "
+                         "all tracks if not.")
+    ap.add_argument("--split", action="store_true", dest="split",
+                    help=f"write {INIT_NAME} and a file of each segment "
+                         "into the directory.")
+    ap.add_argument("--max-alloc", action="store", dest="max_alloc",
+                    type=int, default=DEFAULT_MAX_ALLOC,
+                    help="specify the maximum size in bytes to be read at once.")
+    opt = ap.parse_args(argv)
+
+    if opt.duration <= 0:
+        ap.error("--duration must be positive")
+    if not opt.split and (os.path.exists(opt.output) and
+                          os.path.samefile(opt.mp4_file, opt.output)):
+        ap.error("output is the same as mp4_file")
+    with Mp4File(opt.mp4_file, max_alloc=opt.max_alloc) as mp4:
+        fragmenter = Fragmenter(mp4, opt.track_ids, opt.duration)
+        if opt.split:
+            os.makedirs(opt.output, exist_ok=True)
+            fragmenter.write_segments(opt.output)
+        else:
+            with open(opt.output, "wb") as fd_dst:
+                fragmenter.write(fd_dst)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,14 @@
-import os
-import argparse
+import sys
 import json
+import struct
+import operator
+from array import array
+from fnmatch import fnmatchcase
+from mp4_source import open_source, is_url, open_url
+from sample_table import SttsTable, CttsTable, StscTable, StszTable
+from sample_table import SampleTable, SampleIndex
+from index_file import dump_tables
+from adts_parser import decode_audio_specific_config
 
 # ISO/IEC 14496-12-2005
 # ISO/IEC 14496-1
@@ -83,8 +91,7 @@ stsc: Sample To Chunk Box
 
 """
 
-g_sample = None # placeholder, initialized at parse_trak()
-g_traks = {}
+DEFAULT_MAX_ALLOC = 64*1024*1024
 
 def indent(depth):
     return "  "*depth
@@ -94,22 +101,90 @@ def decode_int(v_raw, signed=False):
 
 def decode_str(v_raw, signed=False):
     try:
-        return v_raw.decode().replace("\x00","")
+        return bytes(v_raw).decode().replace("\x00","")
     except UnicodeDecodeError:
         return "(ERR)"
 
 def decode_hex(v_raw, signed=False):
-    return "0x" + "".join([ "{:02x}".format(i) for i in v_raw ])
+    return "0x" + bytes(v_raw).hex()
 
-def print_array1(depth, v_name, v_val, v_raw, offset, nb_item):
-    print(f"{indent(depth)}{v_name}({nb_item:02}): {v_val}", end="")
-    print(f" :: 0x{v_raw.hex()} offset={offset}" if opt.debug else "")
+# array typecode by (item size, signed)
+array_tab = {(array(c).itemsize, c.islower()): c for c in "QqLlIiHhBb"}
 
-def print_val(depth, v_name, v_val, v_raw, offset):
-    print(f"{indent(depth)}{v_name}: {v_val}", end="")
-    print(f" :: 0x{v_raw.hex()} offset={offset}" if opt.debug else "")
+def decode_array(v_raw, v_size, signed=False):
+    """
+    decode big endian integers of v_size bytes at once.
+    """
+    v_val = array(array_tab[(v_size, signed)])
+    v_val.frombytes(v_raw)
+    if sys.byteorder == "little":
+        v_val.byteswap()
+    return v_val
+
+class Table:
+    """
+    entries of a table decoded at once.
+    columns are the arrays of each field of the entries.
+    """
+    def __init__(self, names, columns, v_size):
+        self.names = names
+        self.columns = columns
+        self.v_size = v_size
 
-def parse_base(fd, depth, offset, v_name, v_size, v_buf_size, decode_func,
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __str__(self):
+        return f"({len(self)} entries)"
+
+    def entries(self):
+        """
+        yield (index, name, value, offset) of each field,
+        offset is the offset from the top of the table.
+        it is None if the size of the fields is not fixed (v_size is None).
+        """
+        nb_cols = len(self.names)
+        for i in range(len(self)):
+            for j,(name,col) in enumerate(zip(self.names, self.columns)):
+                if self.v_size is None:
+                    yield i, name, col[i], None
+                else:
+                    yield i, name, col[i], (i*nb_cols+j)*self.v_size
+
+class Fields:
+    """
+    a cursor to decode the body of a box.
+    each decoded field is kept in values by its name, and appended into
+    items as (depth, name, value, raw, offset, index) to be printed later.
+    offset is the offset in the body.
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.size = len(buf)
+        self.offset = 0
+        self.values = {}
+        self.items = []
+
+    def read(self, size):
+        if self.offset + size > self.size:
+            raise ValueError(f"field size {size} exceeds the body, "
+                             f"{self.size-self.offset} bytes left")
+        v_raw = self.buf[self.offset:self.offset+size]
+        self.offset += size
+        return v_raw
+
+    def add(self, depth, v_name, v_val, v_raw=b"", offset=None, index=None):
+        self.items.append((depth, v_name, v_val, v_raw, offset, index))
+
+def check_entries(f, entry_count, entry_size):
+    """
+    make sure that entry_count entries of entry_size bytes fit in the body.
+    """
+    if entry_count*entry_size > f.size - f.offset:
+        raise ValueError(f"entry_count {entry_count} x {entry_size} "
+                         f"exceeds the body, {f.size-f.offset} bytes left")
+
+def parse_base(f, depth, v_name, v_size, v_buf_size, decode_func,
                signed=False):
     """
     Note: uses bytes size though the spec uses in bit size.
@@ -118,40 +193,62 @@ def parse_base(fd, depth, offset, v_name, v_size, v_buf_size, decode_func,
     v_buf_size 16 bytes |----|----|----|----|
     """
     if v_buf_size is not None:
+        v_val = []
         for i in range(0, v_buf_size, v_size):
-            v_raw = fd.read(v_size)
-            v_val = decode_func(v_raw, signed=signed)
-            print_array1(depth, v_name, v_val, v_raw, offset, i//v_size)
-            offset += v_size
+            offset = f.offset
+            v_raw = f.read(v_size)
+            v = decode_func(v_raw, signed=signed)
+            f.add(depth, v_name, v, v_raw, offset, i//v_size)
+            v_val.append(v)
     else:
-        v_raw = fd.read(v_size)
+        offset = f.offset
+        v_raw = f.read(v_size)
         v_val = decode_func(v_raw, signed=signed)
-        print_val(depth, v_name, v_val, v_raw, offset)
-        offset += v_size
-    return v_val, offset
+        f.add(depth, v_name, v_val, v_raw, offset)
+    f.values[v_name] = v_val
+    return v_val
+
+def parse_table(f, depth, v_names, v_size, entry_count, signed=False):
+    """
+    decode entry_count entries of the fields in v_names at once.
+    each field is v_size bytes.  return the arrays of each field.
+    """
+    nb_cols = len(v_names)
+    check_entries(f, entry_count, v_size*nb_cols)
+    offset = f.offset
+    v_raw = f.read(entry_count*v_size*nb_cols)
+    v_val = decode_array(v_raw, v_size, signed)
+    if nb_cols > 1:
+        columns = [v_val[i::nb_cols] for i in range(nb_cols)]
+    else:
+        columns = [v_val]
+    f.add(depth, ", ".join(v_names), Table(v_names, columns, v_size), v_raw,
+          offset)
+    for v_name,col in zip(v_names, columns):
+        f.values[v_name] = col
+    return columns
 
-def parse_int(fd, depth, offset, v_name, v_size, v_buf_size=None, signed=False):
-    return parse_base(fd, depth, offset, v_name, v_size, v_buf_size, decode_int,
+def parse_int(f, depth, v_name, v_size, v_buf_size=None, signed=False):
+    return parse_base(f, depth, v_name, v_size, v_buf_size, decode_int,
                       signed=signed)
 
-def parse_str(fd, depth, offset, v_name, v_size, v_buf_size=None):
-    return parse_base(fd, depth, offset, v_name, v_size, v_buf_size, decode_str)
+def parse_str(f, depth, v_name, v_size, v_buf_size=None):
+    return parse_base(f, depth, v_name, v_size, v_buf_size, decode_str)
 
-def parse_hex(fd, depth, offset, v_name, v_size, v_buf_size=None):
-    return parse_base(fd, depth, offset, v_name, v_size, v_buf_size, decode_hex)
+def parse_hex(f, depth, v_name, v_size, v_buf_size=None):
+    return parse_base(f, depth, v_name, v_size, v_buf_size, decode_hex)
 
-def get_str_null(fd, offset, max_size):
+def get_str_null(f):
     buf = []
-    while max_size > offset:
-        a = fd.read(1)
-        offset += 1
+    while f.size > f.offset:
+        a = f.read(1)
         if a == b"\x00":
             break
         buf.append(a)
     name = b"".join(buf).decode()
-    return name, offset
+    return name
 
-def parse_fullbox(fd, depth, offset):
+def parse_fullbox(f, depth):
     """
     Note: assuming that the former part (i.e. Box) has been parsed before.
         only parse version and flags.
@@ -163,11 +260,11 @@ def parse_fullbox(fd, depth, offset):
         bit(24) flags = f;
     }
     """
-    version, offset = parse_int(fd, depth, offset, "version", 1)
-    flags, offset = parse_hex(fd, depth, offset, "flags", 3)
-    return version, flags, offset
+    version = parse_int(f, depth, "version", 1)
+    flags = parse_hex(f, depth, "flags", 3)
+    return version, int(flags, 16)
 
-def parse_sample_entry(fd, depth, offset):
+def parse_sample_entry(f, depth):
     """
     aligned(8) abstract class SampleEntry (unsigned int(32) format)
                               extends Box(format) {
@@ -175,68 +272,18 @@ def parse_sample_entry(fd, depth, offset):
         unsigned int(16) data_reference_index;
     }
     """
-    v, offset = parse_hex(fd, depth, offset, "reserved", 6) # 8 * 6 / 8
-    v, offset = parse_int(fd, depth, offset, "data_reference_index", 2)
-    return offset
+    v = parse_hex(f, depth, "reserved", 6) # 8 * 6 / 8
+    v = parse_int(f, depth, "data_reference_index", 2)
 
-def check_remaining(fd, depth, body_size, offset):
-    if body_size > offset:
-        print(f"{indent(depth)}==> body_size {body_size} != offset {offset}")
-        v, offset = parse_hex(fd, depth+1, offset, "remaining", body_size-offset)
-    elif body_size < offset:
-        raise ValueError(f"body_size {body_size} < offset {offset}")
+def check_remaining(f, depth):
+    if f.size > f.offset:
+        f.add(depth, f"==> body_size {f.size} != offset", f.offset)
+        v = parse_hex(f, depth+1, "remaining", f.size-f.offset)
 
 #
 # boxes parser
 #
-def parse_gen(fd, depth, body_size):
-    buf = fd.read(body_size)
-    if opt.debug:
-        print(f"{indent(depth)}gen: 0x{buf.hex()}")
-
-def parse_trak(fd, depth, body_size):
-    """
-    aligned(8) class TrackBox extends Box(‘trak’) { }
-    """
-    global g_sample
-    g_sample = {}
-    mp4parse(fd, depth+1, body_size)
-    if opt.save_stbl:
-        g_traks.update({"track{}".format(g_sample["track_id"]):
-                        g_sample.copy()}) # enough to shallow copy.
-
-def parse_con(fd, depth, body_size):
-    """
-    aligned(8) class MovieBox extends Box(‘moov’) { }
-    aligned(8) class MediaBox extends Box(‘mdia’) { }
-    aligned(8) class EditBox extends Box(‘edts’) { }
-    aligned(8) class DataInformationBox extends Box(‘dinf’) { }
-    aligned(8) class SampleTableBox extends Box(‘stbl’) { }
-    """
-    mp4parse(fd, depth+1, body_size)
-
-def parse_mdat(fd, depth, body_size):
-    """
-    aligned(8) class MediaDataBox
-                     extends Box(‘mdat’) {
-        bit(8) data[];
-    }
-    """
-    if opt.save_stbl:
-        g_traks.update({"mdat_offset": fd.tell()})
-    if opt.save_mdat:
-        with open(opt.save_mdat, "wb") as fd_dst:
-            max_read_size = 16*1024
-            while body_size > 0:
-                buf = fd.read(min([max_read_size,body_size]))
-                if not buf:
-                    break
-                fd_dst.write(buf)
-                body_size -= max_read_size
-    else:
-        fd.read(body_size)
-
-def parse_mdhd(fd, depth, body_size):
+def parse_mdhd(f, depth):
     """
     aligned(8) class MediaHeaderBox
                      extends FullBox(‘mdhd’, version, 0) {
@@ -255,34 +302,32 @@ def parse_mdhd(fd, depth, body_size):
         unsigned int(5)[3] language; // ISO-639-2/T language code
         unsigned int(16) pre_defined = 0;
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
+    version, flags = parse_fullbox(f, depth)
     if version == 1:
-        v, offset = parse_int(fd, depth, offset, "creation_time", 8)
-        v, offset = parse_int(fd, depth, offset, "modification_time", 8)
-        v, offset = parse_int(fd, depth, offset, "timescale", 4)
-        v, offset = parse_int(fd, depth, offset, "duration", 8)
+        v = parse_int(f, depth, "creation_time", 8)
+        v = parse_int(f, depth, "modification_time", 8)
+        v = parse_int(f, depth, "timescale", 4)
+        v = parse_int(f, depth, "duration", 8)
     elif version == 0:
-        v, offset = parse_int(fd, depth, offset, "creation_time", 4)
-        v, offset = parse_int(fd, depth, offset, "modification_time", 4)
-        v, offset = parse_int(fd, depth, offset, "timescale", 4)
-        v, offset = parse_int(fd, depth, offset, "duration", 4)
+        v = parse_int(f, depth, "creation_time", 4)
+        v = parse_int(f, depth, "modification_time", 4)
+        v = parse_int(f, depth, "timescale", 4)
+        v = parse_int(f, depth, "duration", 4)
     else:
         raise ValueError(f"unknown version {version}")
     #
-    v_raw = fd.read(2)
+    offset = f.offset
+    v_raw = f.read(2)
     buf = bin(decode_int(v_raw))[2:].rjust(16,"0")
-    print_val(depth, "pad", "b"+buf[0], v_raw, offset)
+    f.add(depth, "pad", "b"+buf[0], v_raw, offset)
+    # each character follows the pad bit in 5 bits, i.e. buf[1:6], buf[6:11]
+    # and buf[11:16].  e.g. "und" is b10101, b01110 and b00100.
     for i in range(3):
-        print_array1(depth, "language", "b"+buf[i:i+5], v_raw, offset, i)
-    offset += 2
+        f.add(depth, "language", "b"+buf[1+i*5:6+i*5], v_raw, offset, i)
     #
-    v, offset = parse_int(fd, depth, offset, "pre_defined", 2)
-    check_remaining(fd, depth, body_size, offset)
+    v = parse_int(f, depth, "pre_defined", 2)
 
-def parse_hdlr(fd, depth, body_size):
+def parse_hdlr(f, depth):
     """
     aligned(8) class HandlerBox
                      extends FullBox(‘hdlr’, version = 0, 0) {
@@ -292,16 +337,13 @@ def parse_hdlr(fd, depth, body_size):
         string   name;
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    v, offset = parse_int(fd, depth, offset, "pre_defined", 4)
-    v, offset = parse_int(fd, depth, offset, "handler_type", 4)
-    v, offset = parse_int(fd, depth, offset, "reserved", 4, 12)
-    v, offset = parse_str(fd, depth, offset, "name", body_size-offset)
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "pre_defined", 4)
+    v = parse_int(f, depth, "handler_type", 4)
+    v = parse_int(f, depth, "reserved", 4, 12)
+    v = parse_str(f, depth, "name", f.size-f.offset)
 
-def parse_tkhd(fd, depth, body_size):
+def parse_tkhd(f, depth):
     """
     aligned(8) class TrackHeaderBox
                      extends FullBox(‘tkhd’, version, flags) {
@@ -330,36 +372,31 @@ def parse_tkhd(fd, depth, body_size):
         unsigned int(32) height;
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
+    version, flags = parse_fullbox(f, depth)
     if version == 1:
-        v, offset = parse_int(fd, depth, offset, "creation_time", 8)
-        v, offset = parse_int(fd, depth, offset, "modification_time", 8)
-        track_id, offset = parse_int(fd, depth, offset, "trackID", 4)
-        v, offset = parse_int(fd, depth, offset, "reserved", 4)
-        v, offset = parse_int(fd, depth, offset, "duration", 8)
+        v = parse_int(f, depth, "creation_time", 8)
+        v = parse_int(f, depth, "modification_time", 8)
+        track_id = parse_int(f, depth, "trackID", 4)
+        v = parse_int(f, depth, "reserved", 4)
+        v = parse_int(f, depth, "duration", 8)
     elif version == 0:
-        v, offset = parse_int(fd, depth, offset, "creation_time", 4)
-        v, offset = parse_int(fd, depth, offset, "modification_time", 4)
-        track_id, offset = parse_int(fd, depth, offset, "trackID", 4)
-        v, offset = parse_int(fd, depth, offset, "reserved", 4)
-        v, offset = parse_int(fd, depth, offset, "duration", 4)
+        v = parse_int(f, depth, "creation_time", 4)
+        v = parse_int(f, depth, "modification_time", 4)
+        track_id = parse_int(f, depth, "trackID", 4)
+        v = parse_int(f, depth, "reserved", 4)
+        v = parse_int(f, depth, "duration", 4)
     else:
         raise ValueError(f"unknown version {version}")
-    v, offset = parse_int(fd, depth, offset, "reserved", 4, 8)
-    v, offset = parse_int(fd, depth, offset, "layer", 2)
-    v, offset = parse_int(fd, depth, offset, "alternate_group", 2)
-    v, offset = parse_int(fd, depth, offset, "volume", 2)
-    v, offset = parse_int(fd, depth, offset, "reserved", 2)
-    v, offset = parse_hex(fd, depth, offset, "matrix", 4, 36)
-    v, offset = parse_int(fd, depth, offset, "width", 4)
-    v, offset = parse_int(fd, depth, offset, "height", 4)
-    g_sample.setdefault("track_id", track_id)
-    check_remaining(fd, depth, body_size, offset)
-
-def parse_vmhd(fd, depth, body_size):
+    v = parse_int(f, depth, "reserved", 4, 8)
+    v = parse_int(f, depth, "layer", 2)
+    v = parse_int(f, depth, "alternate_group", 2)
+    v = parse_int(f, depth, "volume", 2)
+    v = parse_int(f, depth, "reserved", 2)
+    v = parse_hex(f, depth, "matrix", 4, 36)
+    v = parse_int(f, depth, "width", 4)
+    v = parse_int(f, depth, "height", 4)
+
+def parse_vmhd(f, depth):
     """
     aligned(8) class VideoMediaHeaderBox
                      extends FullBox(‘vmhd’, version = 0, 1) {
@@ -367,16 +404,11 @@ def parse_vmhd(fd, depth, body_size):
         template unsigned int(16)[3] opcolor = {0, 0, 0};
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    v, offset = parse_int(fd, depth, offset, "graphicsmode", 2)
-    v, offset = parse_int(fd, depth, offset, "opcolor", 2, 6)
-    g_sample.setdefault("media", "video")
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "graphicsmode", 2)
+    v = parse_int(f, depth, "opcolor", 2, 6)
 
-def parse_smhd(fd, depth, body_size):
+def parse_smhd(f, depth):
     """
     aligned(8) class SoundMediaHeaderBox
         extends FullBox(‘smhd’, version = 0, 0) {
@@ -384,16 +416,11 @@ def parse_smhd(fd, depth, body_size):
         const unsigned int(16) reserved = 0;
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    v, offset = parse_int(fd, depth, offset, "balance", 2)
-    v, offset = parse_int(fd, depth, offset, "reserved", 2)
-    g_sample.setdefault("media", "audio")
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "balance", 2)
+    v = parse_int(f, depth, "reserved", 2)
 
-def parse_elst(fd, depth, body_size):
+def parse_elst(f, depth):
     """
     aligned(8) class EditListBox
                      extends FullBox(‘elst’, version, 0) {
@@ -411,24 +438,20 @@ def parse_elst(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    v, offset = parse_int(fd, depth, offset, "entry_count", 4)
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "entry_count", 4)
     if version == 1:
-        v, offset = parse_int(fd, depth, offset, "segment_duration", 8)
-        v, offset = parse_int(fd, depth, offset, "media_time", 8)
+        v = parse_int(f, depth, "segment_duration", 8)
+        v = parse_int(f, depth, "media_time", 8)
     elif version == 0:
-        v, offset = parse_int(fd, depth, offset, "segment_duration", 4)
-        v, offset = parse_int(fd, depth, offset, "media_time", 4)
+        v = parse_int(f, depth, "segment_duration", 4)
+        v = parse_int(f, depth, "media_time", 4)
     else:
         raise ValueError(f"unknown version {version}")
-    v, offset = parse_int(fd, depth, offset, "media_rate_integer", 2)
-    v, offset = parse_int(fd, depth, offset, "media_rate_fraction", 2)
-    check_remaining(fd, depth, body_size, offset)
+    v = parse_int(f, depth, "media_rate_integer", 2)
+    v = parse_int(f, depth, "media_rate_fraction", 2)
 
-def parse_dref(fd, depth, body_size):
+def parse_dref(f, depth):
     """
     aligned(8) class DataEntryUrlBox (bit(24) flags)
         extends FullBox(‘url ’, version = 0, flags) {
@@ -446,24 +469,27 @@ def parse_dref(fd, depth, body_size):
             DataEntryBox(entry_version, entry_flags) data_entry;
         }
     }
-    DataEntryBox:
-        int(8) entry_version;
-        int(24) entry_flags;
-        string data_entry;  // URL or URN, UTF-8
+    Note: the data entries are the children boxes of dref.
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    while body_size > offset and entry_count > 0:
-        version, flags, offset = parse_fullbox(fd, depth+1, offset)
-        name, offset = get_str_null(fd, offset, body_size)
-        print(f"{indent(depth+1)}entry {entry_count}:{name}")
-        entry_count -= 1
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+
+def parse_url(f, depth):
+    """
+    Note: location is omitted when the flags is 1, which means that
+        the media data is in the same file.
+    """
+    version, flags = parse_fullbox(f, depth)
+    if f.size > f.offset:
+        f.add(depth, "location", get_str_null(f))
+
+def parse_urn(f, depth):
+    version, flags = parse_fullbox(f, depth)
+    f.add(depth, "name", get_str_null(f))
+    if f.size > f.offset:
+        f.add(depth, "location", get_str_null(f))
 
-def parse_stsd(fd, depth, body_size):
+def parse_stsd(f, depth):
     """
     class BitRateBox extends Box(‘btrt’) {
         unsigned int(32) bufferSizeDB;
@@ -478,29 +504,299 @@ def parse_stsd(fd, depth, body_size):
             SampleEntry(); // an instance of a class derived from SampleEntry
         }
     }
+    Note: the sample entries are the children boxes of stsd.
     """
-    if not opt.verbose:
-        fd.read(body_size)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+
+def parse_visual_sample_entry(f, depth):
+    """
+    class VisualSampleEntry(codingname) extends SampleEntry (codingname){
+        unsigned int(16) pre_defined = 0;
+        const unsigned int(16) reserved = 0;
+        unsigned int(32)[3] pre_defined = 0;
+        unsigned int(16) width;
+        unsigned int(16) height;
+        template unsigned int(32) horizresolution = 0x00480000; // 72 dpi
+        template unsigned int(32) vertresolution = 0x00480000; // 72 dpi
+        const unsigned int(32) reserved = 0;
+        template unsigned int(16) frame_count = 1;
+        string[32] compressorname;
+        template unsigned int(16) depth = 0x0018;
+        int(16) pre_defined = -1;
+    }
+    """
+    parse_sample_entry(f, depth)
+    v = parse_int(f, depth, "pre_defined", 2)
+    v = parse_int(f, depth, "reserved", 2)
+    v = parse_int(f, depth, "pre_defined", 4, 12)
+    v = parse_int(f, depth, "width", 2)
+    v = parse_int(f, depth, "height", 2)
+    v = parse_hex(f, depth, "horizresolution", 4)
+    v = parse_hex(f, depth, "vertresolution", 4)
+    v = parse_int(f, depth, "reserved", 4)
+    v = parse_int(f, depth, "frame_count", 2)
+    v = parse_str(f, depth, "compressorname", 32)
+    v = parse_int(f, depth, "depth", 2)
+    v = parse_int(f, depth, "pre_defined", 2, signed=True)
+
+def parse_audio_sample_entry(f, depth):
+    """
+    class AudioSampleEntry(codingname) extends SampleEntry (codingname){
+        const unsigned int(32)[2] reserved = 0;
+        template unsigned int(16) channelcount = 2;
+        template unsigned int(16) samplesize = 16;
+        unsigned int(16) pre_defined = 0;
+        const unsigned int(16) reserved = 0 ;
+        template unsigned int(32) samplerate = {default samplerate}<<16;
+    }
+    """
+    parse_sample_entry(f, depth)
+    v = parse_int(f, depth, "reserved", 4, 8)
+    v = parse_int(f, depth, "channelcount", 2)
+    v = parse_int(f, depth, "samplesize", 2)
+    v = parse_int(f, depth, "pre_defined", 2)
+    v = parse_int(f, depth, "reserved", 2)
+    v = parse_int(f, depth, "samplerate", 4)
+    f.values["samplerate"] = v >> 16
+
+def parse_descriptor(f, depth):
+    """
+    abstract aligned(8) expandable(2^28-1) class BaseDescriptor
+        : bit(8) tag=0 {
+        // empty. To be filled by classes extending this class.
+    }
+    Note: the size of expandable is coded in 7 bits of 1 to 4 bytes,
+        of which the most significant bit tells that the next byte follows.
+    """
+    tag = parse_int(f, depth, "tag", 1)
+    offset = f.offset
+    size = 0
+    for i in range(4):
+        b = decode_int(f.read(1))
+        size = size << 7 | b & 0x7f
+        if not b & 0x80:
+            break
+    f.add(depth, "size", size, f.buf[offset:f.offset], offset)
+    if size > f.size - f.offset:
+        raise ValueError(f"descriptor size {size} exceeds the body, "
+                         f"{f.size-f.offset} bytes left")
+    return tag, f.offset + size
+
+# descriptor tags
+ES_DESCR_TAG = 0x03
+DECODER_CONFIG_DESCR_TAG = 0x04
+DEC_SPECIFIC_INFO_TAG = 0x05
+
+def parse_es_descriptor(f, depth, end):
+    """
+    class ES_Descriptor extends BaseDescriptor : bit(8) tag=ES_DescrTag {
+        bit(16) ES_ID;
+        bit(1) streamDependenceFlag;
+        bit(1) URL_Flag;
+        bit(1) OCRstreamFlag;
+        bit(5) streamPriority;
+        if (streamDependenceFlag)
+            bit(16) dependsOn_ES_ID;
+        if (URL_Flag) {
+            bit(8) URLlength;
+            bit(8) URLstring[URLlength];
+        }
+        if (OCRstreamFlag)
+            bit(16) OCR_ES_Id;
+        DecoderConfigDescriptor decConfigDescr;
+        ...
+    }
+    """
+    v = parse_int(f, depth, "ES_ID", 2)
+    flags = parse_int(f, depth, "flags", 1)
+    if flags & 0x80:
+        v = parse_int(f, depth, "dependsOn_ES_ID", 2)
+    if flags & 0x40:
+        url_length = parse_int(f, depth, "URLlength", 1)
+        v = parse_str(f, depth, "URLstring", url_length)
+    if flags & 0x20:
+        v = parse_int(f, depth, "OCR_ES_Id", 2)
+
+def parse_decoder_config_descriptor(f, depth, end):
+    """
+    class DecoderConfigDescriptor extends BaseDescriptor
+        : bit(8) tag=DecoderConfigDescrTag {
+        bit(8) objectTypeIndication;
+        bit(6) streamType;
+        bit(1) upStream;
+        const bit(1) reserved=1;
+        bit(24) bufferSizeDB;
+        bit(32) maxBitrate;
+        bit(32) avgBitrate;
+        DecoderSpecificInfo decSpecificInfo[0 .. 1];
+        profileLevelIndicationIndexDescriptor profileLevelIndicationIndexDescr
+            [0..255];
+    }
+    """
+    v = parse_hex(f, depth, "objectTypeIndication", 1)
+    v = parse_hex(f, depth, "streamType", 1)
+    v = parse_int(f, depth, "bufferSizeDB", 3)
+    v = parse_int(f, depth, "maxBitrate", 4)
+    v = parse_int(f, depth, "avgBitrate", 4)
+
+def parse_decoder_specific_info(f, depth, end):
+    """
+    the AudioSpecificConfig for MPEG-4 audio.
+    """
+    offset = f.offset
+    v_raw = f.read(end - f.offset)
+    f.add(depth, "decSpecificInfo", decode_hex(v_raw), v_raw, offset)
+    f.values["decSpecificInfo"] = bytes(v_raw)
+    try:
+        asc = decode_audio_specific_config(v_raw)
+    except ValueError:
         return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    for i in range(entry_count):
-        box_type, box_size, box_hdr_size = parse_box(fd, depth, body_size)
-        sample_hdr_size  = parse_sample_entry(fd, depth+1, 0)
-        pf_tab.get(box_type, parse_gen)(fd, depth+1,
-                                        box_size-box_hdr_size-sample_hdr_size)
-        offset += box_size
-    check_remaining(fd, depth, body_size, offset)
-
-def decode_sample_dt(vals):
-    stts = []
-    for count,delta in vals:
-        for j in range(count):
-            stts.append(delta)
-    g_sample.setdefault("stts", stts)
-    return sum(stts)
-
-def parse_stts(fd, depth, body_size):
+    for v_name,v_val in asc.items():
+        f.add(depth+1, v_name, v_val)
+        f.values[v_name] = v_val
+
+descriptor_tab = {
+        ES_DESCR_TAG: parse_es_descriptor,
+        DECODER_CONFIG_DESCR_TAG: parse_decoder_config_descriptor,
+        DEC_SPECIFIC_INFO_TAG: parse_decoder_specific_info,
+        }
+
+def parse_descriptors(f, depth, end):
+    """
+    decode the descriptors until end, and the descriptors in them.
+    """
+    while end - f.offset >= 2:
+        tag, descr_end = parse_descriptor(f, depth)
+        parse_func = descriptor_tab.get(tag)
+        if parse_func is not None:
+            parse_func(f, depth+1, descr_end)
+            parse_descriptors(f, depth+1, descr_end)
+        if f.offset < descr_end:
+            v = parse_hex(f, depth+1, "descriptor", descr_end - f.offset)
+
+def parse_esds(f, depth):
+    """
+    aligned(8) class ESDBox extends FullBox(‘esds’, version = 0, 0) {
+        ES_Descriptor ES;
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    parse_descriptors(f, depth, f.size)
+
+def parse_nal_units(f, depth, v_name, count):
+    """
+    decode count NAL units of which the length is of 16 bits.
+    """
+    nal_units = []
+    for i in range(count):
+        length = parse_int(f, depth, f"{v_name}Length", 2)
+        offset = f.offset
+        v_raw = f.read(length)
+        f.add(depth, v_name, decode_hex(v_raw), v_raw, offset, i)
+        nal_units.append(bytes(v_raw))
+    f.values[v_name] = nal_units
+    return nal_units
+
+def parse_avcc(f, depth):
+    """
+    aligned(8) class AVCDecoderConfigurationRecord {
+        unsigned int(8) configurationVersion = 1;
+        unsigned int(8) AVCProfileIndication;
+        unsigned int(8) profile_compatibility;
+        unsigned int(8) AVCLevelIndication;
+        bit(6) reserved = ‘111111’b;
+        unsigned int(2) lengthSizeMinusOne;
+        bit(3) reserved = ‘111’b;
+        unsigned int(5) numOfSequenceParameterSets;
+        for (i=0; i< numOfSequenceParameterSets; i++) {
+            unsigned int(16) sequenceParameterSetLength ;
+            bit(8*sequenceParameterSetLength) sequenceParameterSetNALUnit;
+        }
+        unsigned int(8) numOfPictureParameterSets;
+        for (i=0; i< numOfPictureParameterSets; i++) {
+            unsigned int(16) pictureParameterSetLength;
+            bit(8*pictureParameterSetLength) pictureParameterSetNALUnit;
+        }
+        ...
+    }
+    Note: the fields of the high profiles after the PPS are not decoded.
+    """
+    v = parse_int(f, depth, "configurationVersion", 1)
+    v = parse_int(f, depth, "AVCProfileIndication", 1)
+    v = parse_hex(f, depth, "profile_compatibility", 1)
+    v = parse_int(f, depth, "AVCLevelIndication", 1)
+    v = parse_hex(f, depth, "lengthSizeMinusOne", 1)
+    f.values["lengthSizeMinusOne"] = int(v, 16) & 0x3
+    v = parse_hex(f, depth, "numOfSequenceParameterSets", 1)
+    parse_nal_units(f, depth+1, "sequenceParameterSetNALUnit",
+                    int(v, 16) & 0x1f)
+    v = parse_int(f, depth, "numOfPictureParameterSets", 1)
+    parse_nal_units(f, depth+1, "pictureParameterSetNALUnit", v)
+    if f.size > f.offset:
+        v = parse_hex(f, depth, "extension", f.size-f.offset)
+
+def parse_hvcc(f, depth):
+    """
+    aligned(8) class HEVCDecoderConfigurationRecord {
+        unsigned int(8) configurationVersion = 1;
+        unsigned int(2) general_profile_space;
+        unsigned int(1) general_tier_flag;
+        unsigned int(5) general_profile_idc;
+        unsigned int(32) general_profile_compatibility_flags;
+        unsigned int(48) general_constraint_indicator_flags;
+        unsigned int(8) general_level_idc;
+        bit(4) reserved = ‘1111’b;
+        unsigned int(12) min_spatial_segmentation_idc;
+        bit(6) reserved = ‘111111’b;
+        unsigned int(2) parallelismType;
+        bit(6) reserved = ‘111111’b;
+        unsigned int(2) chromaFormat;
+        bit(5) reserved = ‘11111’b;
+        unsigned int(3) bitDepthLumaMinus8;
+        bit(5) reserved = ‘11111’b;
+        unsigned int(3) bitDepthChromaMinus8;
+        bit(16) avgFrameRate;
+        bit(2) constantFrameRate;
+        bit(3) numTemporalLayers;
+        bit(1) temporalIdNested;
+        unsigned int(2) lengthSizeMinusOne;
+        unsigned int(8) numOfArrays;
+        for (j=0; j < numOfArrays; j++) {
+            bit(1) array_completeness;
+            unsigned int(1) reserved = 0;
+            unsigned int(6) NAL_unit_type;
+            unsigned int(16) numNalus;
+            for (i=0; i< numNalus; i++) {
+                unsigned int(16) nalUnitLength;
+                bit(8*nalUnitLength) nalUnit;
+            }
+        }
+    }
+    Note: nalUnit has the NAL units of all arrays.
+    """
+    v = parse_int(f, depth, "configurationVersion", 1)
+    v = parse_hex(f, depth, "general_profile_idc", 1)
+    v = parse_hex(f, depth, "general_profile_compatibility_flags", 4)
+    v = parse_hex(f, depth, "general_constraint_indicator_flags", 6)
+    v = parse_int(f, depth, "general_level_idc", 1)
+    v = parse_hex(f, depth, "min_spatial_segmentation_idc", 2)
+    v = parse_hex(f, depth, "parallelismType", 1)
+    v = parse_hex(f, depth, "chromaFormat", 1)
+    v = parse_hex(f, depth, "bitDepthLumaMinus8", 1)
+    v = parse_hex(f, depth, "bitDepthChromaMinus8", 1)
+    v = parse_int(f, depth, "avgFrameRate", 2)
+    v = parse_hex(f, depth, "lengthSizeMinusOne", 1)
+    f.values["lengthSizeMinusOne"] = int(v, 16) & 0x3
+    nb_arrays = parse_int(f, depth, "numOfArrays", 1)
+    nal_units = []
+    for j in range(nb_arrays):
+        v = parse_hex(f, depth+1, "NAL_unit_type", 1)
+        nb_nalus = parse_int(f, depth+1, "numNalus", 2)
+        nal_units.extend(parse_nal_units(f, depth+2, "nalUnit", nb_nalus))
+    f.values["nalUnit"] = nal_units
+
+def parse_stts(f, depth):
     """
     aligned(8) class TimeToSampleBox
         extends FullBox(’stts’, version = 0, 0) {
@@ -512,21 +808,15 @@ def parse_stts(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    vals = []
-    for i in range(entry_count):
-        sample_count, offset = parse_int(fd, depth+1, offset, "sample_count", 4)
-        sample_delta, offset = parse_int(fd, depth+1, offset, "sample_delta", 4)
-        vals.append((sample_count, sample_delta))
-    duration = decode_sample_dt(vals)
-    print(f"{indent(depth+1)}sum of delta: {duration}")
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    sample_count, sample_delta = parse_table(f, depth+1, ("sample_count",
+                                                          "sample_delta"),
+                                             4, entry_count)
+    duration = sum(map(operator.mul, sample_count, sample_delta))
+    f.add(depth+1, "sum of delta", duration)
 
-def parse_stss(fd, depth, body_size):
+def parse_stss(f, depth):
     """
     aligned(8) class SyncSampleBox
         extends FullBox(‘stss’, version = 0, 0) {
@@ -537,14 +827,9 @@ def parse_stss(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    for i in range(entry_count):
-        v, offset = parse_int(fd, depth+1, offset, "sample_number", 4)
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    v = parse_table(f, depth+1, ("sample_number",), 4, entry_count)
 
     """
     timescale = 1000
@@ -555,7 +840,7 @@ def parse_stss(fd, depth, body_size):
         ctts
     """
 
-def parse_ctts(fd, depth, body_size):
+def parse_ctts(f, depth):
     """
     aligned(8) class CompositionOffsetBox
         extends FullBox(‘ctts’, version, 0) {
@@ -574,40 +859,19 @@ def parse_ctts(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
     if version == 0:
-        for i in range(entry_count):
-            v, offset = parse_int(fd, depth+1, offset, "sample_count", 4)
-            v, offset = parse_int(fd, depth+1, offset, "sample_offset", 4)
+        v = parse_table(f, depth+1, ("sample_count", "sample_offset"), 4,
+                        entry_count)
     elif version == 1:
-        for i in range(entry_count):
-            v, offset = parse_int(fd, depth+1, offset, "sample_count", 4)
-            v, offset = parse_int(fd, depth+1, offset, "sample_offset", 4,
-                                  signed=True)
+        # sample_count is decoded as signed too, it never exceeds 2^31.
+        v = parse_table(f, depth+1, ("sample_count", "sample_offset"), 4,
+                        entry_count, signed=True)
     else:
         raise ValueError(f"unknown version {version}")
-    check_remaining(fd, depth, body_size, offset)
 
-def decode_chunk_samples(vals):
-    """
-    decoding Sample to Chunk (stsc)
-    """
-    stsc = []
-    n = 0
-    n,nb_samples = vals.pop(0)
-    for next_chunk_num,next_nb_samples in vals:
-        while next_chunk_num > n:
-            stsc.append(nb_samples)
-            n += 1
-        nb_samples = next_nb_samples
-    stsc.append(next_nb_samples)
-    g_sample.setdefault("stsc", stsc)
-
-def parse_stsc(fd, depth, body_size):
+def parse_stsc(f, depth):
     """
     aligned(8) class SampleToChunkBox
         extends FullBox(‘stsc’, version = 0, 0) {
@@ -619,24 +883,12 @@ def parse_stsc(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    vals = []
-    for i in range(entry_count):
-        first_chunk, offset = parse_int(fd, depth+1, offset,
-                                        f"first_chunk[{i}]", 4)
-        samples_per_chunk, offset = parse_int(fd, depth+1, offset,
-                                              f"samples_per_chunk[{i}]", 4)
-        v, offset = parse_int(fd, depth+1, offset,
-                              f"sample_description_index[{i}]", 4)
-        vals.append((first_chunk,samples_per_chunk))
-    decode_chunk_samples(vals)
-    check_remaining(fd, depth, body_size, offset)
-
-def parse_stsz(fd, depth, body_size):
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    v = parse_table(f, depth+1, ("first_chunk", "samples_per_chunk",
+                                 "sample_description_index"), 4, entry_count)
+
+def parse_stsz(f, depth):
     """
     aligned(8) class SampleSizeBox
         extends FullBox(‘stsz’, version = 0, 0) {
@@ -649,29 +901,18 @@ def parse_stsz(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    sample_size, offset = parse_int(fd, depth, offset, "sample_size", 4)
-    sample_count, offset = parse_int(fd, depth, offset, "sample_count", 4)
-    vals = []
+    version, flags = parse_fullbox(f, depth)
+    sample_size = parse_int(f, depth, "sample_size", 4)
+    sample_count = parse_int(f, depth, "sample_count", 4)
     if sample_size == 0:
-        total_entry_size = 0
-        for i in range(sample_count):
-            entry_size, offset = parse_int(fd, depth+1, offset,
-                                           f"entry_size[{i}]", 4)
-            vals.append(entry_size)
-            total_entry_size += entry_size
+        entry_size, = parse_table(f, depth+1, ("entry_size",), 4, sample_count)
+        total_entry_size = sum(entry_size)
     else:
-        for i in range(sample_count):
-            vals.append(sample_size)
+        # not expanded, see StszTable.
         total_entry_size = sample_size*sample_count
-    print(f"{indent(depth)}total_entry_size: {total_entry_size}")
-    g_sample.setdefault("stsz", vals)
-    check_remaining(fd, depth, body_size, offset)
+    f.add(depth, "total_entry_size", total_entry_size)
 
-def parse_stco(fd, depth, body_size):
+def parse_stco(f, depth):
     """
     aligned(8) class ChunkOffsetBox
         extends FullBox(‘stco’, version = 0, 0) {
@@ -681,20 +922,25 @@ def parse_stco(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    vals = []
-    for i in range(entry_count):
-        chunk_offset, offset = parse_int(fd, depth+1, offset,
-                                         f"chunk_offset[{i}]", 4)
-        vals.append(chunk_offset)
-    g_sample.setdefault("stco", vals)
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    v = parse_table(f, depth+1, ("chunk_offset",), 4, entry_count)
 
-def parse_sgpd(fd, depth, body_size):
+def parse_co64(f, depth):
+    """
+    aligned(8) class ChunkLargeOffsetBox
+        extends FullBox(‘co64’, version = 0, 0) {
+        unsigned int(32) entry_count;
+        for (i=1; i <= entry_count; i++) {
+            unsigned int(64) chunk_offset;
+        }
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    v = parse_table(f, depth+1, ("chunk_offset",), 8, entry_count)
+
+def parse_sgpd(f, depth):
     """
     abstract class SampleGroupDescriptionEntry (unsigned int(32) grouping_type)
     {
@@ -719,26 +965,21 @@ def parse_sgpd(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    grouping_type, offset = parse_int(fd, depth, offset, "grouping_type", 4)
+    version, flags = parse_fullbox(f, depth)
+    grouping_type = parse_int(f, depth, "grouping_type", 4)
     if version == 1:
-        default_length, offset = parse_int(fd, depth, offset, "default_length", 4)
+        default_length = parse_int(f, depth, "default_length", 4)
     elif version > 1:
-        v, offset = parse_int(fd, depth, offset,
-                              "default_sample_description_index", 4)
+        v = parse_int(f, depth, "default_sample_description_index", 4)
     else:
         raise ValueError(f"unknown version {version}")
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
+    entry_count = parse_int(f, depth, "entry_count", 4)
     for i in range(entry_count):
         if version == 1:
             if default_length == 0:
-                v, offset = parse_int(fd, depth+1, offset, "description_length", 4)
-    check_remaining(fd, depth, body_size, offset)
+                v = parse_int(f, depth+1, "description_length", 4)
 
-def parse_sbgp(fd, depth, body_size):
+def parse_sbgp(f, depth):
     """
     aligned(8) class SampleToGroupBox
         extends FullBox(‘sbgp’, version, 0) {
@@ -753,21 +994,15 @@ def parse_sbgp(fd, depth, body_size):
         }
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    grouping_type, offset = parse_int(fd, depth, offset, "grouping_type", 4)
+    version, flags = parse_fullbox(f, depth)
+    grouping_type = parse_int(f, depth, "grouping_type", 4)
     if version == 1:
-        grouping_type_parameter, offset = parse_int(fd, depth, offset,
-                                                    "grouping_type_parameter", 4)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    for i in range(entry_count):
-        v, offset = parse_int(fd, depth, offset, "sample_count", 4)
-        v, offset = parse_int(fd, depth, offset, "group_description_index", 4)
-    check_remaining(fd, depth, body_size, offset)
+        grouping_type_parameter = parse_int(f, depth, "grouping_type_parameter", 4)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    v = parse_table(f, depth+1, ("sample_count", "group_description_index"), 4,
+                    entry_count)
 
-def parse_meta(fd, depth, body_size):
+def parse_meta(f, depth):
     """
     aligned(8) class MetaBox (handler_type)
         extends FullBox(‘meta’, version = 0, 0) {
@@ -782,14 +1017,11 @@ def parse_meta(fd, depth, body_size):
         ItemDataBox item_data;
         Box   other_boxes[];
     }
+    Note: the boxes in meta are the children boxes of meta.
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    parse_con(fd, depth, body_size-offset)
+    version, flags = parse_fullbox(f, depth)
 
-def parse_icpv(fd, depth, body_size):
+def parse_icpv(f, depth):
     """
     class IncompleteAVCSampleEntry()
         extends VisualSampleEntry (‘icpv’){
@@ -799,16 +1031,11 @@ def parse_icpv(fd, depth, body_size):
         MPEG4ExtensionDescriptorsBox (); // optional
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
-    entry_count, offset = parse_int(fd, depth, offset, "entry_count", 4)
-    for i in range(entry_count):
-        v, offset = parse_int(fd, depth+1, offset, f"chunk_offset[{i}]", 4)
-    check_remaining(fd, depth, body_size, offset)
+    version, flags = parse_fullbox(f, depth)
+    entry_count = parse_int(f, depth, "entry_count", 4)
+    v = parse_table(f, depth+1, ("chunk_offset",), 4, entry_count)
 
-def parse_ftyp(fd, depth, body_size):
+def parse_ftyp(f, depth):
     """
     aligned(8) class FileTypeBox
         extends Box(‘ftyp’) {
@@ -817,16 +1044,11 @@ def parse_ftyp(fd, depth, body_size):
         unsigned int(32) compatible_brands[]; // to end of the box
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    v, offset = parse_str(fd, depth, 0, "major_brand", 4)
-    v, offset = parse_hex(fd, depth, offset, "minor_versions", 4)
-    v, offset = parse_str(fd, depth, offset, "compatible_brands", 4,
-                          body_size-offset)
-    check_remaining(fd, depth, body_size, offset)
+    v = parse_str(f, depth, "major_brand", 4)
+    v = parse_hex(f, depth, "minor_versions", 4)
+    v = parse_str(f, depth, "compatible_brands", 4, f.size-f.offset)
 
-def parse_mvhd(fd, depth, body_size):
+def parse_mvhd(f, depth):
     """
     aligned(8) class MovieHeaderBox
                      extends FullBox(‘mvhd’, version, 0) {
@@ -852,52 +1074,291 @@ def parse_mvhd(fd, depth, body_size):
         unsigned int(32) next_track_ID;
     }
     """
-    if not opt.verbose:
-        fd.read(body_size)
-        return
-    version, flags, offset = parse_fullbox(fd, depth, 0)
+    version, flags = parse_fullbox(f, depth)
     if version == 1:
-        v, offset = parse_int(fd, depth, offset, "creation_time", 8)
-        v, offset = parse_int(fd, depth, offset, "modification_time", 8)
-        v, offset = parse_int(fd, depth, offset, "timescale", 4)
-        v, offset = parse_int(fd, depth, offset, "duration", 8)
+        v = parse_int(f, depth, "creation_time", 8)
+        v = parse_int(f, depth, "modification_time", 8)
+        v = parse_int(f, depth, "timescale", 4)
+        v = parse_int(f, depth, "duration", 8)
     elif version == 0:
-        v, offset = parse_int(fd, depth, offset, "creation_time", 4)
-        v, offset = parse_int(fd, depth, offset, "modification_time", 4)
-        v, offset = parse_int(fd, depth, offset, "timescale", 4)
-        v, offset = parse_int(fd, depth, offset, "duration", 4)
+        v = parse_int(f, depth, "creation_time", 4)
+        v = parse_int(f, depth, "modification_time", 4)
+        v = parse_int(f, depth, "timescale", 4)
+        v = parse_int(f, depth, "duration", 4)
     else:
         raise ValueError(f"unknown version {version}")
-    v, offset = parse_hex(fd, depth, offset, "rate", 4)
-    v, offset = parse_hex(fd, depth, offset, "volume", 2)
-    v, offset = parse_int(fd, depth, offset, "reserved", 2)
-    v, offset = parse_int(fd, depth, offset, "reserved", 4)
-    v, offset = parse_int(fd, depth, offset, "reserved", 4)
-    v, offset = parse_hex(fd, depth, offset, "matrix", 4, 36)
-    v, offset = parse_int(fd, depth, offset, "pre_defined", 4, 24)
-    v, offset = parse_int(fd, depth, offset, "next_track_ID", 4)
-    check_remaining(fd, depth, body_size, offset)
+    v = parse_hex(f, depth, "rate", 4)
+    v = parse_hex(f, depth, "volume", 2)
+    v = parse_int(f, depth, "reserved", 2)
+    v = parse_int(f, depth, "reserved", 4)
+    v = parse_int(f, depth, "reserved", 4)
+    v = parse_hex(f, depth, "matrix", 4, 36)
+    v = parse_int(f, depth, "pre_defined", 4, 24)
+    v = parse_int(f, depth, "next_track_ID", 4)
+
+#
+# movie fragments
+#
+def parse_mehd(f, depth):
+    """
+    aligned(8) class MovieExtendsHeaderBox extends FullBox(‘mehd’, version, 0) {
+        if (version==1) {
+            unsigned int(64) fragment_duration;
+        } else { // version==0
+            unsigned int(32) fragment_duration;
+        }
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "fragment_duration", 8 if version == 1 else 4)
+
+def parse_trex(f, depth):
+    """
+    aligned(8) class TrackExtendsBox extends FullBox(‘trex’, 0, 0){
+        unsigned int(32) track_ID;
+        unsigned int(32) default_sample_description_index;
+        unsigned int(32) default_sample_duration;
+        unsigned int(32) default_sample_size;
+        unsigned int(32) default_sample_flags
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "track_ID", 4)
+    v = parse_int(f, depth, "default_sample_description_index", 4)
+    v = parse_int(f, depth, "default_sample_duration", 4)
+    v = parse_int(f, depth, "default_sample_size", 4)
+    v = parse_hex(f, depth, "default_sample_flags", 4)
+    f.values["default_sample_flags"] = int(v, 16)
+
+def parse_mfhd(f, depth):
+    """
+    aligned(8) class MovieFragmentHeaderBox
+        extends FullBox(‘mfhd’, 0, 0){
+        unsigned int(32) sequence_number;
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "sequence_number", 4)
+
+# tf_flags of tfhd
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x000002
+TFHD_DEFAULT_SAMPLE_DURATION = 0x000008
+TFHD_DEFAULT_SAMPLE_SIZE = 0x000010
+TFHD_DEFAULT_SAMPLE_FLAGS = 0x000020
+TFHD_DURATION_IS_EMPTY = 0x010000
+TFHD_DEFAULT_BASE_IS_MOOF = 0x020000
+
+def parse_tfhd(f, depth):
+    """
+    aligned(8) class TrackFragmentHeaderBox
+        extends FullBox(‘tfhd’, 0, tf_flags){
+        unsigned int(32) track_ID;
+        // all the following are optional fields
+        unsigned int(64) base_data_offset;
+        unsigned int(32) sample_description_index;
+        unsigned int(32) default_sample_duration;
+        unsigned int(32) default_sample_size;
+        unsigned int(32) default_sample_flags
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "track_ID", 4)
+    if flags & TFHD_BASE_DATA_OFFSET:
+        v = parse_int(f, depth, "base_data_offset", 8)
+    if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+        v = parse_int(f, depth, "sample_description_index", 4)
+    if flags & TFHD_DEFAULT_SAMPLE_DURATION:
+        v = parse_int(f, depth, "default_sample_duration", 4)
+    if flags & TFHD_DEFAULT_SAMPLE_SIZE:
+        v = parse_int(f, depth, "default_sample_size", 4)
+    if flags & TFHD_DEFAULT_SAMPLE_FLAGS:
+        v = parse_hex(f, depth, "default_sample_flags", 4)
+        f.values["default_sample_flags"] = int(v, 16)
+    f.values["tf_flags"] = flags
+
+def parse_tfdt(f, depth):
+    """
+    aligned(8) class TrackFragmentBaseMediaDecodeTimeBox
+        extends FullBox(‘tfdt’, version, 0) {
+        if (version==1) {
+            unsigned int(64) baseMediaDecodeTime;
+        } else { // version==0
+            unsigned int(32) baseMediaDecodeTime;
+        }
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "baseMediaDecodeTime", 8 if version == 1 else 4)
+
+# tr_flags of trun
+TRUN_DATA_OFFSET = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS = 0x000004
+TRUN_SAMPLE_DURATION = 0x000100
+TRUN_SAMPLE_SIZE = 0x000200
+TRUN_SAMPLE_FLAGS = 0x000400
+TRUN_SAMPLE_COMPOSITION_TIME_OFFSET = 0x000800
+
+def parse_trun(f, depth):
+    """
+    aligned(8) class TrackRunBox
+        extends FullBox(‘trun’, version, tr_flags) {
+        unsigned int(32) sample_count;
+        // the following are optional fields
+        signed int(32) data_offset;
+        unsigned int(32) first_sample_flags;
+        // all fields in the following array are optional
+        {
+            unsigned int(32) sample_duration;
+            unsigned int(32) sample_size;
+            unsigned int(32) sample_flags
+            if (version == 0)
+                { unsigned int(32) sample_composition_time_offset; }
+            else
+                { signed int(32) sample_composition_time_offset; }
+        }[ sample_count ]
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    sample_count = parse_int(f, depth, "sample_count", 4)
+    if flags & TRUN_DATA_OFFSET:
+        v = parse_int(f, depth, "data_offset", 4, signed=True)
+    if flags & TRUN_FIRST_SAMPLE_FLAGS:
+        v = parse_hex(f, depth, "first_sample_flags", 4)
+        f.values["first_sample_flags"] = int(v, 16)
+    v_names = [v_name for bit,v_name in (
+            (TRUN_SAMPLE_DURATION, "sample_duration"),
+            (TRUN_SAMPLE_SIZE, "sample_size"),
+            (TRUN_SAMPLE_FLAGS, "sample_flags"),
+            (TRUN_SAMPLE_COMPOSITION_TIME_OFFSET,
+             "sample_composition_time_offset")) if flags & bit]
+    if v_names:
+        # with version 1, all fields are decoded as signed.
+        # the others never exceed 2^31 in practice.
+        v = parse_table(f, depth+1, tuple(v_names), 4, sample_count,
+                        signed=(version == 1))
+    f.values["tr_flags"] = flags
+
+def parse_sidx(f, depth):
+    """
+    aligned(8) class SegmentIndexBox extends FullBox(‘sidx’, version, 0) {
+        unsigned int(32) reference_ID;
+        unsigned int(32) timescale;
+        if (version==0) {
+            unsigned int(32) earliest_presentation_time;
+            unsigned int(32) first_offset;
+        }
+        else {
+            unsigned int(64) earliest_presentation_time;
+            unsigned int(64) first_offset;
+        }
+        unsigned int(16) reserved = 0;
+        unsigned int(16) reference_count;
+        for(i=1; i <= reference_count; i++)
+        {
+            bit (1) reference_type;
+            unsigned int(31) referenced_size;
+            unsigned int(32) subsegment_duration;
+            bit(1) starts_with_SAP;
+            unsigned int(3) SAP_type;
+            unsigned int(28) SAP_delta_time;
+        }
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "reference_ID", 4)
+    v = parse_int(f, depth, "timescale", 4)
+    if version == 0:
+        v = parse_int(f, depth, "earliest_presentation_time", 4)
+        v = parse_int(f, depth, "first_offset", 4)
+    else:
+        v = parse_int(f, depth, "earliest_presentation_time", 8)
+        v = parse_int(f, depth, "first_offset", 8)
+    v = parse_int(f, depth, "reserved", 2)
+    reference_count = parse_int(f, depth, "reference_count", 2)
+    size, duration, sap = parse_table(f, depth+1, ("referenced_size",
+                                                   "subsegment_duration",
+                                                   "SAP"), 4, reference_count)
+    f.values["reference_type"] = array("B", [v >> 31 for v in size])
+    f.values["referenced_size"] = array(size.typecode,
+                                        [v & 0x7fffffff for v in size])
+
+def parse_tfra(f, depth):
+    """
+    aligned(8) class TrackFragmentRandomAccessBox
+        extends FullBox(‘tfra’, version, 0) {
+        unsigned int(32) track_ID;
+        const unsigned int(26) reserved = 0;
+        unsigned int(2) length_size_of_traf_num;
+        unsigned int(2) length_size_of_trun_num;
+        unsigned int(2) length_size_of_sample_num;
+        unsigned int(32) number_of_entry;
+        for(i=1; i <= number_of_entry; i++){
+            if(version==1){
+                unsigned int(64) time;
+                unsigned int(64) moof_offset;
+            }else{
+                unsigned int(32) time;
+                unsigned int(32) moof_offset;
+            }
+            unsigned int((length_size_of_traf_num+1) * 8) traf_number;
+            unsigned int((length_size_of_trun_num+1) * 8) trun_number;
+            unsigned int((length_size_of_sample_num+1) * 8) sample_number;
+        }
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "track_ID", 4)
+    v = parse_int(f, depth, "length_size", 4)
+    sizes = ((v >> 4) & 3) + 1, ((v >> 2) & 3) + 1, (v & 3) + 1
+    entry_count = parse_int(f, depth, "number_of_entry", 4)
+    v_size = 8 if version == 1 else 4
+    entry_size = v_size*2 + sum(sizes)
+    check_entries(f, entry_count, entry_size)
+    offset = f.offset
+    v_raw = f.read(entry_count*entry_size)
+    time = array("Q")
+    moof_offset = array("Q")
+    numbers = (array("L"), array("L"), array("L"))
+    for i in range(0, len(v_raw), entry_size):
+        time.append(decode_int(v_raw[i:i+v_size]))
+        moof_offset.append(decode_int(v_raw[i+v_size:i+v_size*2]))
+        i += v_size*2
+        for size,v_val in zip(sizes, numbers):
+            v_val.append(decode_int(v_raw[i:i+size]))
+            i += size
+    columns = [time, moof_offset] + list(numbers)
+    v_names = ("time", "moof_offset", "traf_number", "trun_number",
+               "sample_number")
+    f.add(depth+1, ", ".join(v_names), Table(v_names, columns, None),
+          v_raw, offset)
+    for v_name,col in zip(v_names, columns):
+        f.values[v_name] = col
+
+def parse_mfro(f, depth):
+    """
+    aligned(8) class MovieFragmentRandomAccessOffsetBox
+        extends FullBox(‘mfro’, version, 0) {
+        unsigned int(32) size;
+    }
+    """
+    version, flags = parse_fullbox(f, depth)
+    v = parse_int(f, depth, "size", 4)
 
 # parsing function table
 pf_tab = {
         "ftyp": parse_ftyp,
-        "mdat": parse_mdat,
-        "moov": parse_con,
+        "styp": parse_ftyp,
         "mvhd": parse_mvhd,
-        "iods": parse_gen, # spec ?
-        "trak": parse_trak,
         "tkhd": parse_tkhd,
-        "edts": parse_con,
         "elst": parse_elst,
-        "mdia": parse_con,
         "mdhd": parse_mdhd,
         "hdlr": parse_hdlr,
-        "minf": parse_con,
         "vmhd": parse_vmhd,
         "smhd": parse_smhd,
-        "dinf": parse_con,
-        "stbl": parse_con, 
         "dref": parse_dref,
+        "url ": parse_url,
+        "urn ": parse_urn,
         "stsd": parse_stsd,
         "stts": parse_stts,
         "stss": parse_stss,
@@ -905,15 +1366,210 @@ pf_tab = {
         "stsc": parse_stsc,
         "stsz": parse_stsz,
         "stco": parse_stco,
-        "avc1": parse_gen,
-        "mp4a": parse_gen,
+        "co64": parse_co64,
+        "avc1": parse_visual_sample_entry,
+        "avc3": parse_visual_sample_entry,
+        "hvc1": parse_visual_sample_entry,
+        "hev1": parse_visual_sample_entry,
+        "avcC": parse_avcc,
+        "hvcC": parse_hvcc,
+        "mp4a": parse_audio_sample_entry,
+        "esds": parse_esds,
         "sgpd": parse_sgpd,
         "sbgp": parse_sbgp,
-        "udta": parse_con,
         "meta": parse_meta,
+        "mehd": parse_mehd,
+        "trex": parse_trex,
+        "mfhd": parse_mfhd,
+        "tfhd": parse_tfhd,
+        "tfdt": parse_tfdt,
+        "trun": parse_trun,
+        "sidx": parse_sidx,
+        "tfra": parse_tfra,
+        "mfro": parse_mfro,
+        }
+
+"""
+aligned(8) class MovieBox extends Box(‘moov’) { }
+aligned(8) class TrackBox extends Box(‘trak’) { }
+aligned(8) class MediaBox extends Box(‘mdia’) { }
+aligned(8) class EditBox extends Box(‘edts’) { }
+aligned(8) class DataInformationBox extends Box(‘dinf’) { }
+aligned(8) class SampleTableBox extends Box(‘stbl’) { }
+"""
+# container table: the offset of the first child box in the body.
+con_tab = {
+        "moov": 0,
+        "trak": 0,
+        "edts": 0,
+        "mdia": 0,
+        "minf": 0,
+        "dinf": 0,
+        "stbl": 0,
+        "udta": 0,
+        "mvex": 0,
+        "moof": 0,
+        "traf": 0,
+        "mfra": 0,
+        "dref": 8,  # FullBox + entry_count
+        "stsd": 8,  # FullBox + entry_count
+        "meta": 4,  # FullBox
+        "avc1": 78, # VisualSampleEntry
+        "avc3": 78,
+        "hvc1": 78,
+        "hev1": 78,
+        "mp4a": 28, # AudioSampleEntry
         }
 
-def parse_box(fd, depth, rem_size):
+def decode_body(box_type, buf):
+    """
+    decode buf, the body of a box, or the part before the children
+    for a container, and return the Fields.
+    """
+    parse_func = pf_tab.get(box_type)
+    if parse_func is None:
+        return Fields(b"")
+    f = Fields(buf)
+    parse_func(f, 0)
+    if box_type not in con_tab:
+        check_remaining(f, 0)
+    return f
+
+class Box:
+    """
+    a box in the file.
+    the children boxes and the payload are read at the first access,
+    and are kept after that.
+    """
+    def __init__(self, mp4, box_type, offset, size, hdr_size, depth=0,
+                 parent=None, extended=False, uuid=None):
+        self.mp4 = mp4
+        self.type = box_type
+        self.offset = offset
+        self.size = size
+        self.hdr_size = hdr_size
+        self.depth = depth
+        self.parent = parent
+        self.extended = extended
+        self.uuid = uuid
+        self._children = None
+        self._fields = None
+
+    def __repr__(self):
+        return f"Box({self.type!r}, offset={self.offset}, size={self.size})"
+
+    @property
+    def path(self):
+        """
+        the types of the box and its parents, e.g. "moov/trak/tkhd".
+        """
+        if self.parent is None:
+            return self.type
+        return f"{self.parent.path}/{self.type}"
+
+    @property
+    def body_offset(self):
+        return self.offset + self.hdr_size
+
+    @property
+    def body_size(self):
+        return self.size - self.hdr_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    @property
+    def children(self):
+        if self._children is None:
+            if self.type in con_tab:
+                self._children = list(mp4parse(self.mp4,
+                                               self.body_offset+con_tab[self.type],
+                                               self.end, self.depth+1, self))
+            else:
+                self._children = []
+        return self._children
+
+    def decode(self):
+        """
+        decode the body, or the part before the children for a container.
+        """
+        if self._fields is None:
+            if self.type in pf_tab:
+                buf = self.read(0, con_tab.get(self.type, self.body_size))
+            else:
+                buf = b""
+            self._fields = decode_body(self.type, buf)
+        return self._fields
+
+    @property
+    def payload(self):
+        return self.decode().values
+
+    @property
+    def fields(self):
+        return self.decode().items
+
+    def read(self, offset=0, size=None):
+        """
+        read size bytes from offset in the body.
+        """
+        if size is None:
+            size = self.body_size - offset
+        return self.mp4.read(self.body_offset+offset, size)
+
+    def copy_body(self, fd_dst, buf_size=1024*1024):
+        offset = self.body_offset
+        while offset < self.end:
+            buf = self.mp4.read(offset, min(buf_size, self.end-offset))
+            if not buf:
+                break
+            fd_dst.write(buf)
+            offset += len(buf)
+
+    def walk(self):
+        yield self
+        for box in self.children:
+            yield from box.walk()
+
+    def find_all(self, path):
+        return list(find_boxes(self.children, path))
+
+    def find(self, path):
+        return next(find_boxes(self.children, path), None)
+
+def match_type(box_type, name):
+    """
+    name: a box type, or a glob pattern of the types, e.g. "tra?".
+    """
+    if name == box_type:
+        return True
+    return any(c in name for c in "*?[") and fnmatchcase(box_type, name)
+
+def find_boxes(boxes, path):
+    """
+    yield the boxes of the path in the order of the file.
+    path: box types separated by "/", e.g. "mdia/minf/stbl/stsz", of which
+        each can be a glob pattern, e.g. "trak/*/minf", and "**" matches
+        any boxes in the path, e.g. "**/stsz".
+    Note: only the children of the boxes matched are read, i.e. the other
+        boxes are skipped by their size.
+    """
+    name, _, rest = path.partition("/")
+    for box in boxes:
+        if name == "**":
+            if rest:
+                yield from find_boxes([box], rest)
+            else:
+                yield box
+            yield from find_boxes(box.children, path)
+        elif match_type(box.type, name):
+            if rest:
+                yield from find_boxes(box.children, rest)
+            else:
+                yield box
+
+def parse_box(mp4, offset, end, depth=0, parent=None):
     """
     aligned(8) class Box (unsigned int(32) boxtype,
                           optional unsigned int(8)[16] extended_type) {
@@ -929,69 +1585,461 @@ def parse_box(fd, depth, rem_size):
         }
     }
 
-    rem_size: size of the buffer from the begining to the end.
+    end: the offset of the end of the parent box, or the file.
     """
+    buf = mp4.read(offset, 8)
+    if len(buf) < 8:
+        raise ValueError(f"box header is truncated at {offset}")
     # box size and type.
-    box_size = decode_int(fd.read(4))
-    box_type = decode_str(fd.read(4))
+    box_size, box_type = struct.unpack_from(">I4s", buf)
+    box_type = decode_str(box_type)
     box_hdr_size = 8
     # box size or extended box size.
     box_size_extended = False
     if box_size == 1:
-        box_size = decode_int(fd.read(8))
+        buf = mp4.read(offset+box_hdr_size, 8)
+        if len(buf) < 8:
+            raise ValueError(f"box header is truncated at {offset}")
+        box_size, = struct.unpack_from(">Q", buf)
         box_size_extended = True
         box_hdr_size += 8
     elif box_size == 0:
-        box_size = rem_size
+        box_size = end - offset
     # extended box type.
-    box_type_uuid = False
+    uuid_box_type = None
     if box_type == "uuid":
-        uuid_box_type = decode_str(fd.read(8))
-        box_type_uuid = True
-        box_hdr_size += 8
-    #
-    print(f"{indent(depth)}+ {box_type}: {box_size}"
-            "{}".format(" E" if box_size_extended else ""), end="")
-    print(f" hdr_size={box_hdr_size}" if opt.debug else "")
-    return box_type, box_size, box_hdr_size
-
-def mp4parse(fd, depth, rem_size):
-    while rem_size > 0:
-        box_type, box_size, box_hdr_size = parse_box(fd, depth, rem_size)
-        pf_tab.get(box_type, parse_gen)(fd, depth+1, box_size-box_hdr_size)
+        buf = mp4.read(offset+box_hdr_size, 16)
+        if len(buf) < 16:
+            raise ValueError(f"box header is truncated at {offset}")
+        uuid_box_type = decode_hex(buf)
+        box_hdr_size += 16
+    return Box(mp4, box_type, offset, box_size, box_hdr_size, depth, parent,
+               box_size_extended, uuid_box_type)
+
+def mp4parse(mp4, offset, end, depth=0, parent=None):
+    """
+    yield the boxes from offset to end.
+    only the box headers are read.
+    """
+    while end - offset >= 8:
+        box = parse_box(mp4, offset, end, depth, parent)
         # cal remaining size.
-        if rem_size < box_size:
-            raise ValueError(f"box_size is too big, {box_size} > {rem_size}")
-        rem_size -= box_size
+        if end - offset < box.size:
+            raise ValueError(f"box_size is too big, {box.size} > {end-offset}")
+        if box.size < box.hdr_size:
+            raise ValueError(f"box_size is too small, {box.size} < {box.hdr_size}")
+        yield box
+        offset += box.size
+
+class Mp4File:
+    """
+    an MP4 file.
+    the boxes are read lazily from the top level.  an instance has its own
+    state only, so that many files can be parsed at the same time.
+    """
+    def __init__(self, mp4file, max_alloc=DEFAULT_MAX_ALLOC, backend="mmap",
+                 cache=None):
+        """
+        mp4file: a file name, a URL, a file object, or a source which has
+            size and read(offset, size), e.g. mp4_source.BlockCache.
+            fd is None if mp4file is a URL or a source.
+        backend: "mmap" or "file", see mp4_source.open_source().
+        cache: mp4_cache.IndexCache to keep the SampleIndex of the tracks.
+        """
+        self.fd = None
+        self._own_fd = False
+        self._own_source = True
+        if is_url(mp4file):
+            self.source = open_url(mp4file)
+        elif hasattr(mp4file, "seek"):
+            self.fd = mp4file
+        elif hasattr(mp4file, "read"):
+            self.source = mp4file
+            self._own_source = False
+        else:
+            self.fd = open(mp4file, "rb")
+            self._own_fd = True
+        self.max_alloc = max_alloc
+        self.cache = cache
+        if self.fd is not None:
+            self.source = open_source(self.fd, backend)
+        self.size = self.source.size
+        self._boxes = None
+
+    def close(self):
+        if self._own_source:
+            self.source.close()
+        if self._own_fd:
+            self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, offset, size):
+        """
+        read size bytes from offset.
+        size is bounded by max_alloc so that a broken box can not make
+        a single parse allocate the whole file.
+        """
+        if size > self.max_alloc:
+            raise ValueError(f"read size {size} exceeds max_alloc {self.max_alloc}")
+        return self.source.read(offset, size)
+
+    @property
+    def boxes(self):
+        if self._boxes is None:
+            self._boxes = list(mp4parse(self, 0, self.size))
+        return self._boxes
+
+    def walk(self):
+        for box in self.boxes:
+            yield from box.walk()
+
+    def select(self, path):
+        """
+        yield the boxes of the path, see find_boxes().
+        """
+        return find_boxes(self.boxes, path)
+
+    def find_all(self, path):
+        return list(find_boxes(self.boxes, path))
+
+    def find(self, path):
+        return next(find_boxes(self.boxes, path), None)
+
+    def get_stbl(self):
+        """
+        summarize the sample tables of all tracks, e.g.
+            {"mdat_offset": 48,
+             "track1": {"track_id": 1, "media": "video", "stts": [...],
+                        "stsc": [...], "stsz": [...], "stco": [...]}}
+        """
+        traks = {}
+        for box in self.boxes:
+            if box.type == "mdat":
+                traks.setdefault("mdat_offset", box.body_offset)
+            elif box.type == "moov":
+                for trak in box.find_all("trak"):
+                    sample = get_sample_table(trak).expand()
+                    traks.update({"track{}".format(sample["track_id"]): sample})
+        return traks
+
+    def get_sample_tables(self):
+        """
+        return the SampleTable of each track, which is not expanded.
+        """
+        return [get_sample_table(trak) for trak in self.find_all("moov/trak")]
+
+    def get_sample_indexes(self):
+        """
+        return the SampleIndex of each track.
+        """
+        if self.cache is not None:
+            return self.cache.get_sample_indexes(self)
+        return [SampleIndex.from_table(table)
+                for table in self.get_sample_tables()]
+
+def get_sample_table(trak):
+    track_id = trak.find("tkhd").payload["trackID"]
+    timescale = trak.find("mdia/mdhd").payload["timescale"]
+    minf = trak.find("mdia/minf")
+    if minf.find("vmhd"):
+        media = "video"
+    elif minf.find("smhd"):
+        media = "audio"
+    else:
+        media = None
+    stbl = minf.find("stbl")
+    stco = stbl.find("stco") or stbl.find("co64")
+    if stco is None:
+        raise ValueError("neither stco nor co64 in stbl")
+    stco = stco.payload["chunk_offset"]
+    v = stbl.find("stts").payload
+    stts = SttsTable(v["sample_count"], v["sample_delta"])
+    v = stbl.find("stsc").payload
+    stsc = StscTable(v["first_chunk"], v["samples_per_chunk"], len(stco),
+                     v["sample_description_index"])
+    v = stbl.find("stsz").payload
+    stsz = StszTable(v["sample_size"], v["sample_count"], v.get("entry_size"))
+    ctts = stbl.find("ctts")
+    if ctts is not None:
+        v = ctts.payload
+        ctts = CttsTable(v["sample_count"], v["sample_offset"])
+    stss = stbl.find("stss")
+    if stss is not None:
+        stss = stss.payload["sample_number"]
+    codec = decoder_config = None
+    stsd = stbl.find("stsd")
+    if stsd is not None and stsd.children:
+        # the first sample entry, which is referred by most tracks.
+        entry = stsd.children[0]
+        codec = entry.type
+        esds = entry.find("esds")
+        if esds is not None:
+            decoder_config = esds.payload.get("decSpecificInfo")
+        # the decoder configuration record of AVC or HEVC as it is.
+        config = entry.find("avcC") or entry.find("hvcC")
+        if config is not None:
+            decoder_config = bytes(config.read())
+    return SampleTable(track_id, media, timescale, stts, stsc, stsz, stco,
+                       ctts=ctts, stss=stss, codec=codec,
+                       decoder_config=decoder_config)
 
 #
 # parser main
 #
-from argparse import ArgumentParser
-from argparse import ArgumentDefaultsHelpFormatter
-ap = ArgumentParser(
-        description="a parser for MP4 format.",
-        formatter_class=ArgumentDefaultsHelpFormatter)
-ap.add_argument("mp4file", help="MP4 file.")
-ap.add_argument("--save-mdat", action="store", dest="save_mdat",
-                help="specify a file name to store mdat.")
-ap.add_argument("--save-stbl", action="store", dest="save_stbl",
-                help="specify a file name to store stbl.")
-ap.add_argument("-v", action="store_true", dest="verbose",
-                help="enable verbose mode.")
-ap.add_argument("-d", action="store_true", dest="debug",
-                help="enable debug mode.")
-opt = ap.parse_args()
-
-if opt.save_mdat or opt.save_stbl:
-    # enable verbose mode. to store mdat or stbl, need to parse detail.
-    opt.verbose = True
-
-file_size = os.stat(opt.mp4file).st_size
-print(f"file size: {file_size}")
-with open(opt.mp4file, "rb") as fd:
-    mp4parse(fd, 0, file_size)
-
-if opt.save_stbl:
-    with open(opt.save_stbl, "w") as fd_stbl:
-        json.dump(g_traks, fd_stbl)
+"""
+the emitters present the boxes decoded by the parser.  the fields of a
+box are decoded only if they are presented, i.e. in verbose mode, and
+are formatted only when they are written, e.g.
+
+    with Mp4File("test.mp4") as mp4:
+        JsonEmitter(sys.stdout, verbose=True).emit(mp4)
+"""
+
+class Emitter:
+    """
+    the base of the emitters.
+    verbose: present the fields of the boxes.
+    debug: present the raw bytes of the fields, and the header size.
+    entries: present each entry of the tables.
+    """
+    def __init__(self, fd=None, verbose=False, debug=False, entries=False):
+        self.fd = fd or sys.stdout
+        self.verbose = verbose
+        self.debug = debug
+        self.entries = entries
+
+    def emit(self, mp4, select=None):
+        """
+        select: the paths of the boxes to be emitted with their children,
+            see find_boxes().  all boxes if None.
+        """
+        self.start(mp4)
+        if select is None:
+            for box in mp4.boxes:
+                self.emit_box(box)
+        else:
+            for path in select:
+                for box in mp4.select(path):
+                    self.emit_box(box)
+        self.end(mp4)
+
+    def start(self, mp4):
+        pass
+
+    def emit_box(self, box):
+        pass
+
+    def end(self, mp4):
+        pass
+
+class NullEmitter(Emitter):
+    """
+    build the boxes, and decode the fields in verbose mode, but write
+    nothing, e.g. to measure the parser.
+    """
+    def emit_box(self, box):
+        for child in box.walk():
+            if self.verbose:
+                child.decode()
+
+class TextEmitter(Emitter):
+    """
+    the indented text of the boxes.
+    """
+    def start(self, mp4):
+        self.fd.write(f"file size: {mp4.size}\n")
+
+    def emit_box(self, box):
+        write = self.fd.write
+        write(f"{indent(box.depth*2)}+ {box.type}: {box.size}"
+              "{}".format(" E" if box.extended else ""))
+        write(f" hdr_size={box.hdr_size}\n" if self.debug else "\n")
+        if self.verbose:
+            self.emit_fields(box)
+        for child in box.children:
+            self.emit_box(child)
+
+    def emit_table(self, depth, table, v_raw, offset):
+        write = self.fd.write
+        for i, v_name, v_val, v_offset in table.entries():
+            if self.debug and v_offset is not None:
+                v_raw1 = v_raw[v_offset:v_offset+table.v_size]
+                write(f"{indent(depth)}{v_name}[{i}]: {v_val}"
+                      f" :: 0x{v_raw1.hex()} offset={offset+v_offset}\n")
+            else:
+                write(f"{indent(depth)}{v_name}[{i}]: {v_val}\n")
+
+    def emit_fields(self, box):
+        write = self.fd.write
+        for depth, v_name, v_val, v_raw, offset, index in box.fields:
+            depth += box.depth*2 + 1
+            if isinstance(v_val, Table):
+                if self.entries:
+                    self.emit_table(depth, v_val, v_raw, offset)
+                else:
+                    write(f"{indent(depth)}{v_name}: {v_val}\n")
+                continue
+            if index is None:
+                write(f"{indent(depth)}{v_name}: {v_val}")
+            else:
+                write(f"{indent(depth)}{v_name}({index:02}): {v_val}")
+            if self.debug and offset is not None:
+                write(f" :: 0x{v_raw.hex()} offset={offset}\n")
+            else:
+                write("\n")
+        if (self.debug and box.type not in pf_tab and
+            box.type not in con_tab and box.type != "mdat"):
+            dump_size = min(box.body_size, box.mp4.max_alloc)
+            write(f"{indent(box.depth*2+1)}gen: "
+                  f"0x{box.read(0, dump_size).hex()}"
+                  "{}\n".format(" ..." if box.body_size > dump_size else ""))
+
+class JsonEmitter(Emitter):
+    """
+    JSON of the tree of the boxes, i.e.
+        {"size": 1234, "boxes": [{"type": "moov", "offset": 0, ...,
+                                  "children": [...]}]}
+    the offsets of the fields are of the file.
+    """
+    def start(self, mp4):
+        self.boxes = []
+
+    def emit_box(self, box):
+        self.boxes.append(self.box_model(box, True))
+
+    def end(self, mp4):
+        # dumps() encodes at once, which is faster than dump().
+        self.fd.write(json.dumps({"size": mp4.size, "boxes": self.boxes},
+                                 default=self.default) + "\n")
+
+    def box_model(self, box, children=False):
+        model = {"type": box.type, "offset": box.offset, "size": box.size,
+                 "hdr_size": box.hdr_size}
+        if self.verbose:
+            model["fields"] = self.fields_model(box)
+        if children:
+            model["children"] = [self.box_model(child, True)
+                                 for child in box.children]
+        return model
+
+    def fields_model(self, box):
+        fields = []
+        for depth, v_name, v_val, v_raw, offset, index in box.fields:
+            field = {"name": v_name, "value": v_val, "depth": depth}
+            if index is not None:
+                field["index"] = index
+            if offset is not None:
+                field["offset"] = box.body_offset + offset
+            if self.debug and offset is not None:
+                field["raw"] = bytes(v_raw).hex()
+            fields.append(field)
+        return fields
+
+    def default(self, v_val):
+        if isinstance(v_val, Table):
+            if not self.entries:
+                return {"entry_count": len(v_val)}
+            return dict(zip(v_val.names, map(list, v_val.columns)))
+        if isinstance(v_val, (bytes, bytearray, memoryview)):
+            return bytes(v_val).hex()
+        return list(v_val)
+
+class JsonLinesEmitter(JsonEmitter):
+    """
+    a line of JSON of each box in the order of the file, of which
+    "path" is the types of the box and its parents, e.g. "moov/trak".
+    the children are not in the box.
+    """
+    def start(self, mp4):
+        pass
+
+    def emit_box(self, box, path=None):
+        model = self.box_model(box)
+        model["path"] = path or box.path
+        model["depth"] = box.depth
+        self.fd.write(json.dumps(model, default=self.default) + "\n")
+        for child in box.children:
+            self.emit_box(child, f"{model['path']}/{child.type}")
+
+    def end(self, mp4):
+        pass
+
+emitter_tab = {
+        "text": TextEmitter,
+        "json": JsonEmitter,
+        "jsonl": JsonLinesEmitter,
+        "null": NullEmitter,
+        }
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="a parser for MP4 format.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("mp4file", help="MP4 file, or the URL of it.")
+    ap.add_argument("--save-mdat", action="store", dest="save_mdat",
+                    help="specify a file name to store mdat.")
+    ap.add_argument("--save-stbl", action="store", dest="save_stbl",
+                    help="specify a file name to store stbl.")
+    ap.add_argument("--stbl-format", action="store", dest="stbl_format",
+                    choices=["binary", "json"], default="binary",
+                    help="specify the format of the file of --save-stbl. "
+                         "json is for debugging.")
+    ap.add_argument("--max-alloc", action="store", dest="max_alloc",
+                    type=int, default=DEFAULT_MAX_ALLOC,
+                    help="specify the maximum size in bytes to be read at once.")
+    ap.add_argument("--backend", action="store", dest="backend",
+                    choices=["mmap", "file"], default="mmap",
+                    help="specify how to read the file.")
+    ap.add_argument("--format", action="store", dest="format",
+                    choices=list(emitter_tab), default="text",
+                    help="specify the format of the output. "
+                         "null only parses the file.")
+    ap.add_argument("--select", action="append", dest="select",
+                    help="specify the path of the boxes to be printed, "
+                         "e.g. 'moov/trak/*/minf/stbl/stco' or '**/stsz'. "
+                         "the other boxes are not read.  "
+                         "it can be specified multiple times.")
+    ap.add_argument("--stats", action="store_true", dest="stats",
+                    help="print the statistics of the reads of a URL "
+                         "into stderr.")
+    ap.add_argument("-e", action="store_true", dest="entries",
+                    help="print each entry of the tables in verbose mode.")
+    ap.add_argument("-v", action="store_true", dest="verbose",
+                    help="enable verbose mode.")
+    ap.add_argument("-d", action="store_true", dest="debug",
+                    help="enable debug mode.")
+    opt = ap.parse_args(argv)
+
+    with Mp4File(opt.mp4file, max_alloc=opt.max_alloc,
+                 backend=opt.backend) as mp4:
+        emitter = emitter_tab[opt.format](sys.stdout, opt.verbose, opt.debug,
+                                          opt.entries)
+        emitter.emit(mp4, opt.select)
+        if opt.save_mdat:
+            mdat = mp4.find("mdat")
+            if mdat is None:
+                raise ValueError("no mdat box")
+            with open(opt.save_mdat, "wb") as fd_dst:
+                mdat.copy_body(fd_dst)
+        if opt.save_stbl and opt.stbl_format == "json":
+            with open(opt.save_stbl, "w") as fd_stbl:
+                json.dump(mp4.get_stbl(), fd_stbl, default=list)
+        elif opt.save_stbl:
+            meta = {}
+            mdat = mp4.find("mdat")
+            if mdat is not None:
+                meta["mdat_offset"] = mdat.body_offset
+            with open(opt.save_stbl, "wb") as fd_stbl:
+                dump_tables(fd_stbl, mp4.get_sample_tables(), meta)
+        if opt.stats and hasattr(mp4.source, "stats"):
+            print(mp4.source.stats(), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+import os
+import mmap
+import threading
+import http.client
+from collections import OrderedDict
+from urllib.parse import urlsplit, urljoin
+
+"""
+byte sources for Mp4File.
+
+a source has the size of the data and read(offset, size), which returns
+a bytes-like object of size bytes at most.  the parsers only use
+int.from_bytes(), struct and slicing on it, so that a memoryview works
+as well as bytes.
+
+a remote file is read by HttpSource, i.e. the Range requests, through
+BlockCache, which keeps the blocks read before and reads the blocks
+after a miss at once, so that the small reads of the box headers and the
+fields are not a request each, e.g.
+
+    with Mp4File("http://example.com/test.mp4") as mp4:
+        mp4.get_sample_indexes()
+"""
+
+class FileSource:
+    """
+    read a file object with pread(), or with seek() and read() if the
+    file object has no file descriptor.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.size = fd.seek(0, os.SEEK_END)
+        try:
+            self._fileno = fd.fileno()
+        except (AttributeError, OSError):
+            self._fileno = None
+        self._lock = threading.Lock()
+
+    def read(self, offset, size):
+        if self._fileno is not None and hasattr(os, "pread"):
+            return os.pread(self._fileno, size, offset)
+        with self._lock:
+            self.fd.seek(offset, os.SEEK_SET)
+            return self.fd.read(size)
+
+    def close(self):
+        pass
+
+class MmapSource:
+    """
+    map the whole file, and return a memoryview slice of the map.
+    nothing is read nor copied until a field is decoded, so that opening
+    and walking a big file only touches the pages of the box headers.
+    """
+    def __init__(self, fd):
+        self.size = os.fstat(fd.fileno()).st_size
+        self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def read(self, offset, size):
+        return self._view[offset:offset+size]
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a decoded payload still refers to the map.
+            # it will be unmapped when the payload is released.
+            pass
+
+def open_source(fd, backend="mmap"):
+    """
+    backend: "mmap" or "file".
+        mmap falls back to file if the file can not be mapped,
+        e.g. the file is empty or is not a regular file.
+    """
+    if backend == "mmap":
+        try:
+            return MmapSource(fd)
+        except (AttributeError, OSError, ValueError):
+            pass
+    elif backend != "file":
+        raise ValueError(f"unknown backend {backend}")
+    return FileSource(fd)
+
+DEFAULT_TIMEOUT = 30
+MAX_REDIRECTS = 5
+
+class HttpSource:
+    """
+    read a file over HTTP by the Range requests on a persistent
+    connection.  the size is taken by HEAD.
+    """
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.requests = 0
+        self.bytes = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        with self._lock:
+            res, body = self._request("HEAD")
+        size = res.getheader("Content-Length")
+        if res.status != 200 or size is None:
+            raise ValueError(f"no size of {self.url}, status {res.status}")
+        self.size = int(size)
+
+    def _connect(self):
+        u = urlsplit(self.url)
+        if u.scheme == "https":
+            conn_class = http.client.HTTPSConnection
+        elif u.scheme == "http":
+            conn_class = http.client.HTTPConnection
+        else:
+            raise ValueError(f"unsupported scheme {u.scheme}")
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = conn_class(u.netloc, timeout=self.timeout)
+        self._target = u.path or "/"
+        if u.query:
+            self._target += "?" + u.query
+
+    def _request(self, method, headers=None):
+        """
+        return the response and the body, following the redirects.
+        the request is sent again once if the connection was closed.
+        """
+        for _ in range(MAX_REDIRECTS+1):
+            if self._conn is None:
+                self._connect()
+            for retry in (True, False):
+                try:
+                    self._conn.request(method, self._target,
+                                       headers={**self.headers,
+                                                **(headers or {})})
+                    res = self._conn.getresponse()
+                    body = res.read()
+                    break
+                except (http.client.RemoteDisconnected,
+                        ConnectionResetError, BrokenPipeError):
+                    # e.g. the server closed the idle connection.
+                    if not retry:
+                        raise
+                    self._connect()
+            self.requests += 1
+            self.bytes += len(body)
+            location = res.getheader("Location")
+            if res.status in (301, 302, 303, 307, 308) and location:
+                self.url = urljoin(self.url, location)
+                self._connect()
+                continue
+            return res, body
+        raise ValueError(f"too many redirects of {self.url}")
+
+    def read(self, offset, size):
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b""
+        with self._lock:
+            res, body = self._request("GET", {
+                    "Range": f"bytes={offset}-{offset+size-1}"})
+        if res.status != 206:
+            # e.g. 200, the server returned the whole file.
+            raise ValueError(f"range request of {self.url} failed, "
+                             f"status {res.status}")
+        content_range = res.getheader("Content-Range", "")
+        if not content_range.startswith(f"bytes {offset}-"):
+            raise ValueError(f"unexpected Content-Range {content_range!r}")
+        return body
+
+    def stats(self):
+        return {"requests": self.requests, "bytes": self.bytes}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+DEFAULT_BLOCK_SIZE = 64*1024
+DEFAULT_MAX_BLOCKS = 256
+DEFAULT_READ_AHEAD = 1
+DEFAULT_MAX_READ_AHEAD = 64
+
+class BlockCache:
+    """
+    cache the blocks of block_size bytes of a source of which a read is
+    slow, e.g. HttpSource.
+
+    the blocks missed by a read are read by a request with read_ahead
+    blocks after them.  the read-ahead is doubled up to max_read_ahead
+    while the misses follow the blocks read before, e.g. the box headers
+    of a walk, and is reset by a miss elsewhere.  the adjacent blocks
+    missed are read by a request.  the blocks are evicted from the least
+    recently used one.  a read larger than the half of the cache is not
+    cached, e.g. a run of the samples.
+    """
+    def __init__(self, source, block_size=DEFAULT_BLOCK_SIZE,
+                 max_blocks=DEFAULT_MAX_BLOCKS, read_ahead=DEFAULT_READ_AHEAD,
+                 max_read_ahead=DEFAULT_MAX_READ_AHEAD):
+        self.source = source
+        self.size = source.size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.read_ahead = read_ahead
+        self.max_read_ahead = max_read_ahead
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._window = read_ahead
+        self._next = None
+        self._lock = threading.Lock()
+
+    def read(self, offset, size):
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b""
+        if size > self.block_size*self.max_blocks//2:
+            return self.source.read(offset, size)
+        first = offset//self.block_size
+        last = (offset+size-1)//self.block_size
+        start = offset - first*self.block_size
+        with self._lock:
+            self._load(first, last)
+            if first == last:
+                buf = self._blocks[first]
+            else:
+                buf = b"".join(self._blocks[n] for n in range(first, last+1))
+            # evicted after buf is made, so that a read of more blocks
+            # than max_blocks does not lose its own blocks.
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return memoryview(buf)[start:start+size]
+
+    def _load(self, first, last):
+        """
+        make the blocks from first to last cached.
+        """
+        missing = []
+        for n in range(first, last+1):
+            if n in self._blocks:
+                self._blocks.move_to_end(n)
+                self.hits += 1
+            else:
+                missing.append(n)
+        if not missing:
+            return
+        if missing[0] == self._next:
+            self._window = min(self._window*2, self.max_read_ahead)
+        else:
+            self._window = self.read_ahead
+        nb_blocks = -(-self.size//self.block_size)
+        # the read-ahead does not evict the blocks of this read.
+        window = min(self._window, self.max_blocks - (last-first+1))
+        n = last + 1
+        while (n < min(last + 1 + window, nb_blocks) and
+               n not in self._blocks):
+            missing.append(n)
+            n += 1
+        self._next = missing[-1] + 1
+        # a request of each run of the adjacent blocks.
+        run_first = missing[0]
+        for i,n in enumerate(missing):
+            if i + 1 == len(missing) or missing[i+1] != n + 1:
+                self._fetch(run_first, n)
+                if i + 1 < len(missing):
+                    run_first = missing[i+1]
+        # the blocks of this read are more recent than the read-ahead.
+        for n in range(first, last+1):
+            self._blocks.move_to_end(n)
+
+    def _fetch(self, first, last):
+        offset = first*self.block_size
+        buf = self.source.read(offset, (last-first+1)*self.block_size)
+        if len(buf) < min((last-first+1)*self.block_size, self.size-offset):
+            raise ValueError(f"{len(buf)} bytes at {offset} are truncated")
+        for n in range(first, last+1):
+            i = (n-first)*self.block_size
+            self._blocks[n] = bytes(buf[i:i+self.block_size])
+            self.misses += 1
+
+    def stats(self):
+        v = {"hits": self.hits, "misses": self.misses}
+        if hasattr(self.source, "stats"):
+            v.update(self.source.stats())
+        return v
+
+    def close(self):
+        self._blocks.clear()
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def is_url(name):
+    return isinstance(name, str) and name.startswith(("http://", "https://"))
+
+def open_url(url, block_size=DEFAULT_BLOCK_SIZE, max_blocks=DEFAULT_MAX_BLOCKS,
+             **kwargs):
+    """
+    return the BlockCache of HttpSource of url.
+    kwargs are passed to HttpSource, e.g. headers.
+    """
+    return BlockCache(HttpSource(url, **kwargs), block_size, max_blocks)
+
+def open_input(name):
+    """
+    return the file object of name, or the source of a URL, to be read by
+    read_run() and copy_range().
+    """
+    if is_url(name):
+        return open_url(name)
+    return open(name, "rb")
+
+DEFAULT_COPY_SIZE = 4*1024*1024
+
+def read_run(fd_src, offset, size):
+    """
+    read size bytes at offset of fd_src at once, e.g. a run of the samples.
+    fd_src is a file object, or a source, e.g. BlockCache.
+    """
+    if hasattr(fd_src, "fileno"):
+        buf = os.pread(fd_src.fileno(), size, offset)
+    else:
+        buf = fd_src.read(offset, size)
+    if len(buf) < size:
+        raise ValueError(f"{size} bytes at {offset} are truncated")
+    return memoryview(buf)
+
+def copy_range(fd_src, fd_dst, offset, size, buf_size=DEFAULT_COPY_SIZE):
+    """
+    copy size bytes at offset of fd_src to fd_dst by the kernel,
+    i.e. copy_file_range() or sendfile(), or by read and write of
+    buf_size bytes if the kernel can not copy them, e.g. fd_src is a
+    source of a URL.
+    """
+    fd_dst.flush()
+    src = fd_src.fileno() if hasattr(fd_src, "fileno") else None
+    dst = fd_dst.fileno()
+    for copy_func in (getattr(os, "copy_file_range", None),
+                      lambda src, dst, size, offset:
+                          os.sendfile(dst, src, offset, size)):
+        if copy_func is None or src is None:
+            continue
+        try:
+            while size > 0:
+                n = copy_func(src, dst, size, offset)
+                if n == 0:
+                    raise ValueError(f"{size} bytes at {offset} are truncated")
+                offset += n
+                size -= n
+            return
+        except OSError:
+            # e.g. the file systems do not support it.  the bytes copied
+            # before the error are not copied again.
+            pass
+    while size > 0:
+        n = min(size, buf_size)
+        fd_dst.write(read_run(fd_src, offset, n))
+        offset += n
+        size -= n
@@ -0,0 +1,218 @@
+import sys
+import struct
+from mp4_parser import DEFAULT_MAX_ALLOC, pf_tab, con_tab
+from mp4_parser import parse_box, decode_body, indent
+
+"""
+push-mode parser for the input which can not be seeked, e.g. a pipe or
+a socket.
+
+the bytes are given to feed() as they arrive, and the events are
+returned as soon as enough bytes are buffered:
+
+    ("start", box)  the header of the box is read.
+    ("table", box)  the body of the box is decoded, i.e. box.payload and
+                    box.fields, or the part before the children for a
+                    container.
+    ("end", box)    the last byte of the box is read.
+
+only the body of the box being decoded is buffered, and the other boxes,
+e.g. mdat, are skipped without being buffered.  the children of a box
+are not kept in the box, and box.children is always empty.
+"""
+
+class Mp4StreamParser:
+    """
+    decode: the box types to be decoded.  None means all types in pf_tab.
+    skip: the box types to be skipped with their children.
+    """
+    def __init__(self, decode=None, skip=(), max_alloc=DEFAULT_MAX_ALLOC):
+        self.decode = pf_tab.keys() if decode is None else set(decode)
+        self.skip = set(skip)
+        self.max_alloc = max_alloc
+        self.buf = bytearray()
+        # the offset of buf[0] in the stream.
+        self.offset = 0
+        # the containers to which the next box belongs.
+        self.stack = []
+        # the box of which the body is being buffered.
+        self.box = None
+        self.need = 0
+        # the bytes to be skipped, and the box ending after them.
+        self.skip_size = 0
+        self.skip_box = None
+        # the box of which the size is 0, i.e. lasting to the end.
+        self.last_box = None
+
+    def read(self, offset, size):
+        """
+        read the buffered bytes, called by parse_box().
+        """
+        i = offset - self.offset
+        if i < 0 or i + size > len(self.buf):
+            raise ValueError(f"{size} bytes at {offset} are not buffered")
+        return bytes(self.buf[i:i+size])
+
+    def feed(self, data):
+        """
+        give the next bytes of the stream, and return the list of events.
+        """
+        events = []
+        data = memoryview(data)
+        while True:
+            if self.skip_size or self.last_box is not None:
+                # skip without buffering.
+                n = len(self.buf) + len(data)
+                if self.last_box is None:
+                    n = min(n, self.skip_size)
+                    self.skip_size -= n
+                m = min(n, len(self.buf))
+                del self.buf[:m]
+                data = data[n-m:]
+                self.offset += n
+                if self.skip_size or self.last_box is not None:
+                    break
+            if self.skip_box is not None:
+                events.append(("end", self.skip_box))
+                self.skip_box = None
+            self.buf += data
+            data = data[:0]
+            if self.box is not None:
+                if len(self.buf) < self.need:
+                    break
+                self._decode(events)
+            while self.stack and self.offset >= self.stack[-1].end:
+                events.append(("end", self.stack.pop()))
+            if not self._parse_header(events):
+                break
+        return events
+
+    def close(self):
+        """
+        tell the end of the stream, and return the list of events.
+        """
+        events = []
+        if self.last_box is not None:
+            self.last_box.size = self.offset - self.last_box.offset
+            events.append(("end", self.last_box))
+            self.last_box = None
+        box = self.box or self.skip_box or (self.stack and self.stack[-1])
+        if box:
+            raise ValueError(f"{box.type} at {box.offset} is truncated")
+        return events
+
+    def _parse_header(self, events):
+        """
+        read the header of the next box if it is buffered.
+        """
+        parent = self.stack[-1] if self.stack else None
+        end = parent.end if parent else None
+        if end is not None and end - self.offset < 8:
+            # padding at the end of the container.
+            self.skip_size = end - self.offset
+            self.skip_box = self.stack.pop()
+            return True
+        if len(self.buf) < 8:
+            return False
+        box_size, box_type = struct.unpack_from(">I4s", self.buf)
+        hdr_size = 16 if box_size == 1 else 8
+        if box_type == b"uuid":
+            hdr_size += 16
+        if len(self.buf) < hdr_size:
+            return False
+        box = parse_box(self, self.offset,
+                        self.offset if end is None else end,
+                        len(self.stack), parent)
+        box._children = []
+        events.append(("start", box))
+        if box_size == 0 and end is None:
+            # lasts to the end of the stream.
+            self._consume(box.hdr_size)
+            self.last_box = box
+            return True
+        if end is not None and end - box.offset < box.size:
+            raise ValueError(f"box_size is too big, {box.size} > {end-box.offset}")
+        if box.size < box.hdr_size:
+            raise ValueError(f"box_size is too small, {box.size} < {box.hdr_size}")
+        self._consume(box.hdr_size)
+        if box.type in self.skip:
+            self.skip_size = box.body_size
+            self.skip_box = box
+        elif box.type in self.decode:
+            self.box = box
+            self.need = min(con_tab.get(box.type, box.body_size), box.body_size)
+            if self.need > self.max_alloc:
+                raise ValueError(f"{box.type} of {self.need} bytes exceeds "
+                                 f"max_alloc {self.max_alloc}")
+        elif box.type in con_tab:
+            # enter the container, skipping the part before the children.
+            self.skip_size = min(con_tab[box.type], box.body_size)
+            self.stack.append(box)
+        else:
+            self.skip_size = box.body_size
+            self.skip_box = box
+        return True
+
+    def _decode(self, events):
+        box = self.box
+        box._fields = decode_body(box.type, self.buf[:self.need])
+        events.append(("table", box))
+        self._consume(self.need)
+        self.box = None
+        if box.type in con_tab:
+            self.stack.append(box)
+        else:
+            events.append(("end", box))
+
+    def _consume(self, size):
+        del self.buf[:size]
+        self.offset += size
+
+def iter_events(fd, chunk_size=64*1024, **kwargs):
+    """
+    yield the events of the stream read from fd, e.g. sys.stdin.buffer.
+    """
+    parser = Mp4StreamParser(**kwargs)
+    while True:
+        data = fd.read(chunk_size)
+        if not data:
+            break
+        yield from parser.feed(data)
+    yield from parser.close()
+
+#
+# parser main
+#
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="a parser for MP4 read from a pipe.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("mp4file", nargs="?", default="-",
+                    help="MP4 file, or - for the standard input.")
+    ap.add_argument("--chunk-size", action="store", dest="chunk_size",
+                    type=int, default=64*1024,
+                    help="specify the size to read at once.")
+    ap.add_argument("--skip", action="append", dest="skip", default=[],
+                    help="specify the box type to be skipped.")
+    ap.add_argument("-v", action="store_true", dest="verbose",
+                    help="enable verbose mode.")
+    opt = ap.parse_args(argv)
+
+    if opt.mp4file == "-":
+        fd = sys.stdin.buffer
+    else:
+        fd = open(opt.mp4file, "rb")
+    with fd:
+        for event,box in iter_events(fd, opt.chunk_size, skip=opt.skip):
+            if event == "start":
+                print("{}{}: {} {}".format(indent(box.depth*2), box.type,
+                                           box.offset, box.size))
+            elif event == "table" and opt.verbose:
+                for v_depth,v_name,v_val,*_ in box.fields:
+                    print("{}{}: {}".format(indent(box.depth*2+1+v_depth),
+                                            v_name, v_val))
+
+if __name__ == "__main__":
+    main()
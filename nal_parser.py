@@ -0,0 +1,216 @@
+import sys
+from mp4_parser import decode_body
+
+"""
+NAL units of H.264 (AVC) and H.265 (HEVC) in the samples of MP4.
+
+a sample is of the NAL units each of which follows its length, of which
+the size is given by lengthSizeMinusOne in avcC or hvcC of the sample
+entry.  AnnexBWriter writes the samples as the byte stream of Annex B,
+i.e. each NAL unit follows the start code, and the parameter sets in
+avcC or hvcC are put before each IDR picture, e.g.
+
+    writer = AnnexBWriter(fd, index.codec, index.decoder_config)
+    for sample in samples:
+        writer.write(sample)
+    writer.flush()
+"""
+
+START_CODE = b"\x00\x00\x00\x01"
+
+# ISO/IEC 14496-10 Table 7-1
+AVC_NAL_IDR = 5
+AVC_NAL_SPS = 7
+AVC_NAL_PPS = 8
+
+# ISO/IEC 23008-2 Table 7-1
+HEVC_NAL_BLA_W_LP = 16
+HEVC_NAL_RSV_IRAP_23 = 23
+HEVC_NAL_VPS = 32
+HEVC_NAL_SPS = 33
+HEVC_NAL_PPS = 34
+
+codec_tab = {
+        # codec: (the box of the configuration, HEVC or not)
+        "avc1": ("avcC", False),
+        "avc3": ("avcC", False),
+        "hvc1": ("hvcC", True),
+        "hev1": ("hvcC", True),
+        }
+
+def nal_type_of(b, hevc=False):
+    """
+    return nal_unit_type of the first byte of the NAL unit header.
+    """
+    return (b >> 1) & 0x3f if hevc else b & 0x1f
+
+def is_irap(nal_type, hevc=False):
+    """
+    return True if the NAL unit is of a random access picture, i.e. IDR
+    of AVC, or IRAP of HEVC, i.e. BLA, IDR and CRA.
+    """
+    if hevc:
+        return HEVC_NAL_BLA_W_LP <= nal_type <= HEVC_NAL_RSV_IRAP_23
+    return nal_type == AVC_NAL_IDR
+
+def is_parameter_set(nal_type, hevc=False):
+    if hevc:
+        return HEVC_NAL_VPS <= nal_type <= HEVC_NAL_PPS
+    return nal_type in (AVC_NAL_SPS, AVC_NAL_PPS)
+
+def decode_decoder_config(codec, decoder_config):
+    """
+    return (the size of the length, the parameter sets, HEVC or not) of
+    the configuration record, i.e. the body of avcC or hvcC.
+    """
+    if codec not in codec_tab:
+        raise ValueError(f"unsupported codec {codec}")
+    box_type, hevc = codec_tab[codec]
+    if decoder_config is None:
+        # e.g. avc3 of which the parameter sets are in the samples.
+        return 4, [], hevc
+    v = decode_body(box_type, decoder_config).values
+    if hevc:
+        parameter_sets = v["nalUnit"]
+    else:
+        parameter_sets = (v["sequenceParameterSetNALUnit"] +
+                          v["pictureParameterSetNALUnit"])
+    return v["lengthSizeMinusOne"] + 1, parameter_sets, hevc
+
+def walk_nal_units(buf, length_size=4, offset=0, end=None):
+    """
+    yield (offset, size) of each NAL unit in buf, e.g. a sample.
+    """
+    if end is None:
+        end = len(buf)
+    while offset < end:
+        if end - offset < length_size:
+            raise ValueError(f"NAL unit length at {offset} is truncated")
+        size = int.from_bytes(buf[offset:offset+length_size], "big")
+        offset += length_size
+        if offset + size > end:
+            raise ValueError(f"NAL unit of {size} bytes at {offset} "
+                             "is truncated")
+        yield offset, size
+        offset += size
+
+def iter_nal_units(buf, length_size=4, hevc=False):
+    """
+    yield (nal_unit_type, NAL unit) of each NAL unit in buf.
+    the NAL unit is the memoryview of buf.
+    """
+    buf = memoryview(buf)
+    for offset,size in walk_nal_units(buf, length_size):
+        if size == 0:
+            continue
+        yield nal_type_of(buf[offset], hevc), buf[offset:offset+size]
+
+DEFAULT_BUF_SIZE = 4*1024*1024
+
+class AnnexBWriter:
+    """
+    write the samples of a track in the byte stream format of Annex B,
+    in buf_size bytes.
+    the parameter sets of the configuration are put before the NAL unit
+    of an IDR picture unless the sample has the parameter sets.
+    codec: the type of the sample entry, e.g. "avc1".
+    decoder_config: the body of avcC or hvcC.
+    """
+    def __init__(self, fd_dst, codec, decoder_config,
+                 buf_size=DEFAULT_BUF_SIZE):
+        self.fd_dst = fd_dst
+        self.buf_size = buf_size
+        self.length_size, parameter_sets, self.hevc = \
+                decode_decoder_config(codec, decoder_config)
+        self.parameter_sets = b"".join(START_CODE + ps
+                                       for ps in parameter_sets)
+        self.out = bytearray()
+
+    def write(self, buf):
+        """
+        write a sample.
+        """
+        self.convert(buf, self.out)
+        if len(self.out) >= self.buf_size:
+            self.flush()
+
+    def convert(self, buf, out):
+        """
+        append a sample in Annex B to out, i.e. bytearray.
+        """
+        buf = memoryview(buf)
+        nal_units = list(walk_nal_units(buf, self.length_size))
+        irap = None
+        if self.parameter_sets:
+            for offset,size in nal_units:
+                if size == 0:
+                    continue
+                nal_type = nal_type_of(buf[offset], self.hevc)
+                if is_parameter_set(nal_type, self.hevc):
+                    break
+                if irap is None and is_irap(nal_type, self.hevc):
+                    irap = offset
+        if irap is None and self.length_size == 4:
+            # replace the lengths with the start code in place.
+            base = len(out)
+            out += buf
+            for offset,size in nal_units:
+                out[base+offset-4:base+offset] = START_CODE
+        else:
+            for offset,size in nal_units:
+                if offset == irap:
+                    out += self.parameter_sets
+                out += START_CODE
+                out += buf[offset:offset+size]
+
+    def flush(self):
+        self.fd_dst.write(self.out)
+        self.out.clear()
+
+#
+# parser main
+#
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    from mp4_parser import Mp4File
+    ap = ArgumentParser(
+            description="print the NAL units of the video samples in MP4.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("mp4_file", help="MP4 file.")
+    ap.add_argument("-t", action="store", dest="track_id", type=int,
+                    help="specify the track ID, the first video if not.")
+    ap.add_argument("-n", action="store", dest="max_samples", type=int,
+                    help="specify the number of the samples to be printed.")
+    ap.add_argument("--cache", action="store", dest="cache_dir", nargs="?",
+                    const="",
+                    help="keep the index of the file in the cache directory, "
+                         "~/.cache/mp4parser if DIR is omitted.")
+    opt = ap.parse_args(argv)
+
+    cache = None
+    if opt.cache_dir is not None:
+        from mp4_cache import IndexCache
+        cache = IndexCache(opt.cache_dir or None)
+    with Mp4File(opt.mp4_file, cache=cache) as mp4:
+        for index in mp4.get_sample_indexes():
+            if (index.track_id == opt.track_id if opt.track_id is not None
+                    else index.media == "video"):
+                break
+        else:
+            print("no such track", file=sys.stderr)
+            return 1
+        length_size, parameter_sets, hevc = \
+                decode_decoder_config(index.codec, index.decoder_config)
+        for ps in parameter_sets:
+            print("config", nal_type_of(ps[0], hevc), len(ps))
+        nb_samples = len(index.offset)
+        if opt.max_samples is not None:
+            nb_samples = min(nb_samples, opt.max_samples)
+        for n in range(nb_samples):
+            sample = mp4.read(index.offset[n], index.size[n])
+            for nal_type,nal in iter_nal_units(sample, length_size, hevc):
+                print(n, index.offset[n], nal_type, len(nal))
+
+if __name__ == "__main__":
+    sys.exit(main())
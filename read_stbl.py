@@ -1,92 +1,423 @@
-import sys
 import json
+import mmap
+import heapq
+from bisect import bisect_left
+from array import array
+from sample_table import SttsTable, StscTable, StszTable
+from sample_table import SampleTable, SampleIndex
+from index_file import MAGIC, load_tables
+from mp4_parser import Mp4File
+from mp4_cache import IndexCache
+from mp4_source import read_run, copy_range, open_input
+from adts_parser import make_adts_template, make_adts_template_from_config
+from adts_parser import make_adts_header, make_adts_headers
+from nal_parser import AnnexBWriter
 
-def get_stbl(stbl_json, media):
-    x = []
-    for k,v in stbl_json.items():
-        if k.startswith("track") and v["media"] == media:
-            x.append(v)
+def load_stbl(stbl_file, start=None, end=None, sync_only=False):
+    """
+    return the SampleIndex of the tracks in the stbl file, which is
+    either the binary file or JSON made by mp4_parser.py --save-stbl.
+    the binary file is mapped, and its tables are not copied.
+    see clip_tables() for start, end and sync_only.
+    """
+    return clip_tables(load_stbl_tables(stbl_file), start, end, sync_only)
+
+def load_stbl_tables(stbl_file):
+    """
+    return the SampleTable of the tracks in the stbl file.
+    """
+    with open(stbl_file, "rb") as fd:
+        if fd.read(len(MAGIC)) == MAGIC:
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            meta, tables = load_tables(buf)
+            return tables
+        fd.seek(0)
+        stbl_json = json.load(fd)
+    return [get_table(v) for k,v in stbl_json.items() if k.startswith("track")]
+
+def clip_tables(tables, start=None, end=None, sync_only=False):
+    """
+    return the SampleIndex of the samples of each track from the nearest
+    sync sample before start to end, in seconds, or of the sync samples
+    only if sync_only.  the samples are searched in the tables, so that
+    the cost is of the samples in the clip, not of the track.
+    """
+    if start is None and end is None and not sync_only:
+        return [SampleIndex.from_table(table) for table in tables]
+    indexes = []
+    for table in tables:
+        t0 = t1 = None
+        if start is not None or end is not None:
+            if not table.timescale:
+                raise ValueError(f"timescale of track {table.track_id} "
+                                 "is unknown")
+            if start is not None:
+                t0 = int(start*table.timescale)
+            if end is not None:
+                t1 = int(end*table.timescale)
+        samples = table.clip_range(t0, t1)
+        if sync_only:
+            samples = table.sync_samples_in(samples)
+        indexes.append(SampleIndex.from_table(table, samples))
+    return indexes
+
+def load_mp4(mp4_file, start=None, end=None, sync_only=False, cache=None):
+    """
+    return the SampleIndex of the tracks of the MP4 file, which are kept
+    in cache, i.e. mp4_cache.IndexCache, if given.
+    see clip_tables() for start, end and sync_only.
+    """
+    with Mp4File(mp4_file, cache=cache) as mp4:
+        indexes = mp4.get_sample_indexes()
+    return clip_indexes(indexes, start, end, sync_only)
+
+def clip_indexes(indexes, start=None, end=None, sync_only=False):
+    """
+    clip the SampleIndex of the tracks as clip_tables() does.
+    """
+    if start is None and end is None and not sync_only:
+        return indexes
+    clipped = []
+    for index in indexes:
+        samples = range(len(index))
+        if start is not None or end is not None:
+            if not index.timescale:
+                raise ValueError(f"timescale of track {index.track_id} "
+                                 "is unknown")
+            first = 0
+            if start is not None and start > 0:
+                first = index.sync_sample_before(
+                        int(start*index.timescale)) or 0
+            stop = len(index)
+            if end is not None:
+                stop = bisect_left(index.dts, int(end*index.timescale))
+            samples = range(first, max(first, stop))
+        if sync_only:
+            samples = [n for n in samples if index.sync[n]]
+        clipped.append(index.take(samples))
+    return clipped
+
+def parse_time(v):
+    """
+    return the seconds of v, i.e. "[[hh:]mm:]ss[.fraction]".
+    """
+    seconds = 0
+    for x in v.split(":"):
+        seconds = seconds*60 + float(x)
+    return seconds
+
+def get_stbl(indexes, media):
+    x = [index for index in indexes if index.media == media]
     if len(x) == 0:
         raise ValueError(f"no data for {media}")
     return x
 
-def get_adts_hdr(data_size):
+def get_table(x):
+    """
+    make the SampleTable of a track in the stbl file.
+    each entry of stts and stsc in the file is of a sample or of a chunk.
+    """
+    nb_samples = len(x["stts"])
+    nb_chunks = len(x["stco"])
+    stts = SttsTable(array("L", [1])*nb_samples, array("L", x["stts"]))
+    stsc = StscTable(array("L", range(1, nb_chunks+1)), array("L", x["stsc"]),
+                     nb_chunks)
+    stsz = StszTable(0, len(x["stsz"]), array("L", x["stsz"]))
+    # stco may have the offsets of co64, i.e. 64 bits.
+    decoder_config = x.get("decoder_config")
+    if decoder_config is not None:
+        decoder_config = bytes.fromhex(decoder_config)
+    stss = x.get("stss")
+    if stss is not None:
+        stss = array("L", stss)
+    return SampleTable(x["track_id"], x.get("media"), x.get("timescale"),
+                       stts, stsc, stsz, array("Q", x["stco"]), stss=stss,
+                       codec=x.get("codec"), decoder_config=decoder_config)
+
+def get_index(x):
+    """
+    make the SampleIndex of a track in the stbl file.
+    """
+    return SampleIndex.from_table(get_table(x))
+
+def get_adts_hdr(data_size, template=None):
     """
     AAAAAAAA AAAABCCD EEFFFFGH HHIJKLMM MMMMMMMM MMMOOOOO OOOOOOPP
-    11111111 11110000 0110000H HH0000MM MMMMMMMM MMM11111 11111100
+    11111111 11110001 0110000H HH0000MM MMMMMMMM MMM11111 11111100
+    the template is of LC, 16000Hz and 2ch if None.
+    """
+    if template is None:
+        template = DEFAULT_ADTS_TEMPLATE
+    return make_adts_header(template, data_size)
+
+DEFAULT_ADTS_TEMPLATE = make_adts_template()
+
+def get_adts_template(index):
     """
-    hdr_size = 7
-    hdr_bin = "1111 1111 1111 0001 0110 000{}0000{}1 1111 1111 1100".format(
-            "010", # as 2ch or "001" as 1ch
-            bin(hdr_size + data_size)[2:].rjust(13,"0")).replace(" ","")
-    return int(hdr_bin,2).to_bytes(hdr_size,"big")
+    return the template of the ADTS header of the track from its
+    AudioSpecificConfig, or the default if the track does not have it.
+    """
+    if index.decoder_config is None:
+        return DEFAULT_ADTS_TEMPLATE
+    return make_adts_template_from_config(index.decoder_config)
 
 mdat_fmt = "{:4} {:8} {:5} {:5} {:8} {:16}"
 mdat_hdr = ("num", "offset", "size", "body", "data", "")
 
-def copy_audio(stbl_json, fd_src, fd_dst):
-    print(mdat_fmt.format(*mdat_hdr))
-    for x in get_stbl(stbl_json, "audio"):
-        sample_num = 0
-        for chunk_num,offset in enumerate(x["stco"]):
-            fd_src.seek(offset,0)
-            for nb_samples in range(x["stsc"][chunk_num]):
-                buf = fd_src.read(x["stsz"][sample_num])
-                print(mdat_fmt.format(sample_num, offset, x["stsz"][sample_num],
-                                 buf[0:4].hex(), buf[4:16].hex()))
-                fd_dst.write(get_adts_hdr(len(buf)))
-                fd_dst.write(buf)
-                sample_num += 1
-
-def copy_video(stbl_json, fd_src, fd_dst):
-    print(mdat_fmt.format(*mdat_hdr))
-    for x in get_stbl(stbl_json, "video"):
-        sample_num = 0
-        for chunk_num,offset in enumerate(x["stco"]):
-            fd_src.seek(offset,0)
-            for nb_samples in range(x["stsc"][chunk_num]):
-                buf = fd_src.read(x["stsz"][sample_num])
-                body_size = int.from_bytes(buf[0:4],"big")
-                print(mdat_fmt.format(sample_num, offset, x["stsz"][sample_num],
-                                 body_size, buf[0:4].hex(), buf[4:16].hex()))
-                fd_dst.write(buf)
-                sample_num += 1
+DEFAULT_BUF_SIZE = 4*1024*1024
+
+class AudioSink:
+    """
+    write the audio samples with the ADTS header of each, in buf_size
+    bytes.  the template of the header is made once for each track, and
+    the headers of a run are made at once.
+    """
+    def __init__(self, fd_dst, verbose=False, buf_size=DEFAULT_BUF_SIZE):
+        self.fd_dst = fd_dst
+        self.verbose = verbose
+        self.buf_size = buf_size
+        self.out = bytearray()
+        self.templates = {}
+
+    def write(self, index, run, offset, buf):
+        """
+        write the samples in run, of which the data is buf at offset.
+        """
+        template = self.templates.get(id(index))
+        if template is None:
+            template = get_adts_template(index)
+            self.templates[id(index)] = template
+        sizes = [index.size[sample_num] for sample_num in run]
+        hdrs = make_adts_headers(template, sizes)
+        for sample_num,size,hdr in zip(run, sizes, hdrs):
+            i = index.offset[sample_num] - offset
+            data = buf[i:i+size]
+            if self.verbose:
+                print(mdat_fmt.format(sample_num, index.offset[sample_num],
+                                      len(data), "-", data[0:4].hex(),
+                                      data[4:16].hex()))
+            self.out += hdr
+            self.out += data
+        if len(self.out) >= self.buf_size:
+            self.flush()
+
+    def flush(self):
+        self.fd_dst.write(self.out)
+        self.out.clear()
+
+class VideoSink:
+    """
+    write the video samples as they are.
+    """
+    def __init__(self, fd_dst, verbose=False, buf_size=DEFAULT_BUF_SIZE):
+        self.fd_dst = fd_dst
+        self.verbose = verbose
+
+    def print_samples(self, index, run, offset, buf):
+        for sample_num in run:
+            i = index.offset[sample_num] - offset
+            data = buf[i:i+index.size[sample_num]]
+            body_size = int.from_bytes(data[0:4],"big")
+            print(mdat_fmt.format(sample_num, index.offset[sample_num],
+                                  len(data), body_size, data[0:4].hex(),
+                                  data[4:16].hex()))
+
+    def write(self, index, run, offset, buf):
+        if self.verbose:
+            self.print_samples(index, run, offset, buf)
+        self.fd_dst.write(buf)
+
+    def flush(self):
+        pass
+
+class AnnexBSink(VideoSink):
+    """
+    write the video samples in the byte stream format of Annex B, in
+    buf_size bytes.  see nal_parser.AnnexBWriter.
+    """
+    def __init__(self, fd_dst, verbose=False, buf_size=DEFAULT_BUF_SIZE):
+        super().__init__(fd_dst, verbose, buf_size)
+        self.buf_size = buf_size
+        self.out = bytearray()
+        self.writers = {}
+
+    def write(self, index, run, offset, buf):
+        if self.verbose:
+            self.print_samples(index, run, offset, buf)
+        writer = self.writers.get(id(index))
+        if writer is None:
+            writer = AnnexBWriter(self.fd_dst, index.codec,
+                                  index.decoder_config)
+            self.writers[id(index)] = writer
+        for sample_num in run:
+            i = index.offset[sample_num] - offset
+            writer.convert(buf[i:i+index.size[sample_num]], self.out)
+        if len(self.out) >= self.buf_size:
+            self.flush()
+
+    def flush(self):
+        self.fd_dst.write(self.out)
+        self.out.clear()
+
+sink_tab = {
+        "audio": AudioSink,
+        "video": VideoSink,
+        "annexb": AnnexBSink,
+        }
+
+DEFAULT_MAX_GAP = 64*1024
+
+def demux(fd_src, tracks, buf_size=DEFAULT_BUF_SIZE, max_gap=DEFAULT_MAX_GAP):
+    """
+    read the samples of all tracks in one pass in the order of the file
+    offset, and give each run of the samples to the sink of its track.
+    the runs less than max_gap bytes apart are read at once up to
+    buf_size bytes, so that the file is read sequentially.
+    tracks: the list of (SampleIndex, sink).
+    """
+    runs = heapq.merge(*[track_runs(i, index, buf_size)
+                         for i,(index,sink) in enumerate(tracks)])
+    window = []
+    start = end = 0
+    for offset,size,i,run in runs:
+        if window and not (end <= offset <= end + max_gap and
+                           offset + size - start <= buf_size):
+            demux_window(fd_src, tracks, window, start, end)
+            window = []
+        if not window:
+            start = offset
+        window.append((offset, size, i, run))
+        end = max(end, offset + size) if len(window) > 1 else offset + size
+    if window:
+        demux_window(fd_src, tracks, window, start, end)
+
+def track_runs(i, index, buf_size):
+    for run,offset,size in index.runs(max_size=buf_size):
+        yield offset, size, i, run
+
+def demux_window(fd_src, tracks, window, start, end):
+    buf = read_run(fd_src, start, end - start)
+    for offset,size,i,run in window:
+        index, sink = tracks[i]
+        sink.write(index, run, offset, buf[offset-start:offset-start+size])
+
+def copy_tracks(indexes, fd_src, outputs, verbose=False,
+                buf_size=DEFAULT_BUF_SIZE, annexb=False):
+    """
+    copy the samples of the tracks in one pass.
+    outputs: the file to be written of each media, e.g. {"audio": fd}.
+    annexb: write the video in the byte stream format of Annex B.
+    """
+    if verbose:
+        print(mdat_fmt.format(*mdat_hdr))
+    sinks = {media: sink_tab["annexb" if media == "video" and annexb
+                             else media](fd_dst, verbose, buf_size)
+             for media,fd_dst in outputs.items()}
+    tracks = []
+    for media,sink in sinks.items():
+        tracks.extend((index, sink) for index in get_stbl(indexes, media))
+    demux(fd_src, tracks, buf_size)
+    for sink in sinks.values():
+        sink.flush()
+
+def copy_audio(indexes, fd_src, fd_dst, verbose=False,
+               buf_size=DEFAULT_BUF_SIZE):
+    """
+    copy the audio samples with the ADTS header of each.
+    """
+    copy_tracks(indexes, fd_src, {"audio": fd_dst}, verbose, buf_size)
+
+def copy_video(indexes, fd_src, fd_dst, verbose=False,
+               buf_size=DEFAULT_BUF_SIZE, annexb=False):
+    """
+    copy the video samples as they are, or in Annex B if annexb.
+    the samples in a run are copied by the kernel, or are read at once
+    in verbose mode or in Annex B.
+    """
+    if verbose or annexb:
+        copy_tracks(indexes, fd_src, {"video": fd_dst}, verbose, buf_size,
+                    annexb)
+        return
+    for index in get_stbl(indexes, "video"):
+        for run,offset,size in index.runs(max_size=buf_size):
+            copy_range(fd_src, fd_dst, offset, size)
 
 #
 # parser main
 #
-from argparse import ArgumentParser
-from argparse import ArgumentDefaultsHelpFormatter
-ap = ArgumentParser(
-        description="stbl box parser.",
-        formatter_class=ArgumentDefaultsHelpFormatter)
-# 5301  python read_stbl.py stbl.dmp test2.mp4 audio.dmp
-
-ap.add_argument("stbl_file", help="filename of the stbl box in JSON.")
-ap.add_argument("-i", action="store", dest="mp4_file",
-                help="specify the file name that contained the stbl box.")
-ap.add_argument("-m", action="store_true", dest="mdat_file",
-                help="specify that the file is mdat box, instaed of MP4 file.")
-ap.add_argument("--audio-file", action="store", dest="audio_file",
-                help="specify a file name to be stored the audio data.")
-ap.add_argument("--video-file", action="store", dest="video_file",
-                help="specify a file name to be stored the video data.")
-ap.add_argument("-v", action="store_true", dest="verbose",
-                help="enable verbose mode.")
-ap.add_argument("-d", action="store_true", dest="debug",
-                help="enable debug mode.")
-opt = ap.parse_args()
-
-with open(opt.stbl_file) as fd:
-    stbl_json = json.load(fd)
-
-if opt.audio_file:
-    with open(opt.audio_file,"wb") as fd_dst:
-        with open(opt.mp4_file,"rb") as fd_src:
-            copy_audio(stbl_json, fd_src, fd_dst)
-
-if opt.video_file:
-    with open(opt.video_file,"wb") as fd_dst:
-        with open(opt.mp4_file,"rb") as fd_src:
-            copy_video(stbl_json, fd_src, fd_dst)
+def main(argv=None):
+    from argparse import ArgumentParser
+    from argparse import ArgumentDefaultsHelpFormatter
+    ap = ArgumentParser(
+            description="stbl box parser.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    # 5301  python read_stbl.py stbl.dmp test2.mp4 audio.dmp
+
+    ap.add_argument("stbl_file", nargs="?",
+                    help="filename of the stbl box, in binary or in JSON.  "
+                         "the tables are read from the file of -i if not.")
+    ap.add_argument("-i", action="store", dest="mp4_file",
+                    help="specify the file name that contained the stbl box, "
+                         "or the URL of it.")
+    ap.add_argument("--cache", action="store", dest="cache_dir", nargs="?",
+                    const="",
+                    help="keep the index of the file of -i in the cache "
+                         "directory, ~/.cache/mp4parser if DIR is omitted.")
+    ap.add_argument("--audio-file", action="store", dest="audio_file",
+                    help="specify a file name to be stored the audio data.")
+    ap.add_argument("--video-file", action="store", dest="video_file",
+                    help="specify a file name to be stored the video data.")
+    ap.add_argument("--start", action="store", dest="start", type=parse_time,
+                    help="specify the time to start from, i.e. [[hh:]mm:]ss, "
+                         "the nearest sync sample before it is taken.")
+    ap.add_argument("--end", action="store", dest="end", type=parse_time,
+                    help="specify the time to end at, i.e. [[hh:]mm:]ss.")
+    ap.add_argument("--sync-only", action="store_true", dest="sync_only",
+                    help="take only the sync samples, i.e. the key frames.")
+    ap.add_argument("--annexb", action="store_true", dest="annexb",
+                    help="write the video in the byte stream format of "
+                         "Annex B.")
+    ap.add_argument("--buf-size", action="store", dest="buf_size", type=int,
+                    default=DEFAULT_BUF_SIZE,
+                    help="specify the size in bytes to be read at once.")
+    ap.add_argument("-v", action="store_true", dest="verbose",
+                    help="enable verbose mode, i.e. print each sample.")
+    ap.add_argument("-d", action="store_true", dest="debug",
+                    help="enable debug mode.")
+    opt = ap.parse_args(argv)
+
+    if opt.stbl_file:
+        if opt.cache_dir is not None:
+            ap.error("--cache is for the file of -i without stbl_file")
+        indexes = load_stbl(opt.stbl_file, opt.start, opt.end, opt.sync_only)
+    elif opt.mp4_file:
+        cache = None
+        if opt.cache_dir is not None:
+            cache = IndexCache(opt.cache_dir or None)
+        indexes = load_mp4(opt.mp4_file, opt.start, opt.end, opt.sync_only,
+                           cache)
+    else:
+        ap.error("either stbl_file or -i is required")
+
+    if opt.audio_file and opt.video_file:
+        # both tracks are read in one pass.
+        with open(opt.audio_file,"wb") as fd_audio, \
+                open(opt.video_file,"wb") as fd_video, \
+                open_input(opt.mp4_file) as fd_src:
+            copy_tracks(indexes, fd_src,
+                        {"audio": fd_audio, "video": fd_video},
+                        opt.verbose, opt.buf_size, opt.annexb)
+
+    elif opt.audio_file:
+        with open(opt.audio_file,"wb") as fd_dst:
+            with open_input(opt.mp4_file) as fd_src:
+                copy_audio(indexes, fd_src, fd_dst, opt.verbose, opt.buf_size)
+
+    elif opt.video_file:
+        with open(opt.video_file,"wb") as fd_dst:
+            with open_input(opt.mp4_file) as fd_src:
+                copy_video(indexes, fd_src, fd_dst, opt.verbose, opt.buf_size,
+                           opt.annexb)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import operator
+
+"""
+sample tables kept in the run-length form of the boxes.
+
+the accessors find the run of a sample, or of a chunk, by the binary
+search over the cumulative counts of the runs, so that the memory grows
+with the number of runs, not with the number of samples.
+expand() makes the table of each sample, or of each chunk, only when it
+is called.
+
+Note: the sample numbers and the chunk numbers of the accessors start
+from 0, though those in the boxes start from 1.
+"""
+
+def cumulate(counts, values=None):
+    """
+    return the starting position of each run.
+    e.g. counts [3,2,4] -> [0,3,5], or the weighted sum if values is given.
+    """
+    if values is not None:
+        counts = map(operator.mul, counts, values)
+    starts = array("Q", [0])
+    starts.extend(accumulate(counts))
+    return starts
+
+def typecode_of(values):
+    """
+    the typecode of an array, or the format of a memoryview.
+    """
+    return getattr(values, "typecode", None) or values.format
+
+def expand_runs(counts, values, typecode):
+    v_val = array(typecode)
+    for count,value in zip(counts, values):
+        v_val.extend(array(typecode, [value])*count)
+    return v_val
+
+class SttsTable:
+    """
+    Decoding Time to Sample (stts)
+        DT(n+1) = DT(n) + STTS(n)
+    """
+    def __init__(self, sample_count, sample_delta):
+        self.sample_count = sample_count
+        self.sample_delta = sample_delta
+        self.first_sample = cumulate(sample_count)
+        self.first_time = cumulate(sample_count, sample_delta)
+
+    def __len__(self):
+        return self.first_sample[-1]
+
+    @property
+    def duration(self):
+        return self.first_time[-1]
+
+    def _run(self, n):
+        if not 0 <= n < len(self):
+            raise IndexError(f"sample {n} is out of range")
+        return bisect_right(self.first_sample, n) - 1
+
+    def delta(self, n):
+        return self.sample_delta[self._run(n)]
+
+    def time(self, n):
+        """
+        DT(n), the decoding time of the sample n.
+        """
+        if n == len(self):
+            return self.duration
+        i = self._run(n)
+        return self.first_time[i] + (n-self.first_sample[i])*self.sample_delta[i]
+
+    def sample_at(self, t):
+        """
+        the last sample of which the decoding time is t or before.
+        """
+        if len(self) == 0 or t < 0:
+            return None
+        i = min(bisect_right(self.first_time, t), len(self.sample_count)) - 1
+        while self.sample_count[i] == 0:
+            i -= 1
+        if self.sample_delta[i] == 0:
+            n = self.sample_count[i] - 1
+        else:
+            n = min((t-self.first_time[i])//self.sample_delta[i],
+                    self.sample_count[i]-1)
+        return self.first_sample[i] + n
+
+    def expand(self):
+        return expand_runs(self.sample_count, self.sample_delta,
+                           typecode_of(self.sample_delta))
+
+class CttsTable:
+    """
+    Composition Time to Sample (ctts)
+        CT(n) = DT(n) + CTTS(n)
+    """
+    def __init__(self, sample_count, sample_offset):
+        self.sample_count = sample_count
+        self.sample_offset = sample_offset
+        self.first_sample = cumulate(sample_count)
+
+    def __len__(self):
+        return self.first_sample[-1]
+
+    def offset(self, n):
+        if not 0 <= n < len(self):
+            raise IndexError(f"sample {n} is out of range")
+        return self.sample_offset[bisect_right(self.first_sample, n) - 1]
+
+    def expand(self):
+        return expand_runs(self.sample_count, self.sample_offset,
+                           typecode_of(self.sample_offset))
+
+class StscTable:
+    """
+    Sample To Chunk (stsc)
+    the last entry lasts until the last chunk, i.e. nb_chunks.
+    """
+    def __init__(self, first_chunk, samples_per_chunk, nb_chunks,
+                 sample_description_index=None):
+        self.first_chunk = first_chunk
+        self.samples_per_chunk = samples_per_chunk
+        self.sample_description_index = sample_description_index
+        self.nb_chunks = nb_chunks
+        self.chunk_count = array("Q", [max(0, next_chunk-first)
+                                       for first,next_chunk in
+                                       zip(first_chunk,
+                                           list(first_chunk[1:])+[nb_chunks+1])])
+        self.first_sample = cumulate(self.chunk_count, samples_per_chunk)
+
+    def __len__(self):
+        """
+        the number of samples.
+        """
+        return self.first_sample[-1]
+
+    def _run_of_chunk(self, chunk):
+        if not 0 <= chunk < self.nb_chunks:
+            raise IndexError(f"chunk {chunk} is out of range")
+        return bisect_right(self.first_chunk, chunk+1) - 1
+
+    def samples_in_chunk(self, chunk):
+        return self.samples_per_chunk[self._run_of_chunk(chunk)]
+
+    def description_index(self, chunk):
+        return self.sample_description_index[self._run_of_chunk(chunk)]
+
+    def chunk_of(self, n):
+        """
+        return the chunk of the sample n, and the first sample of the chunk.
+        """
+        if not 0 <= n < len(self):
+            raise IndexError(f"sample {n} is out of range")
+        i = bisect_right(self.first_sample, n) - 1
+        while self.samples_per_chunk[i] == 0:
+            i -= 1
+        k = (n - self.first_sample[i]) // self.samples_per_chunk[i]
+        return (self.first_chunk[i] - 1 + k,
+                self.first_sample[i] + k*self.samples_per_chunk[i])
+
+    def runs(self):
+        """
+        yield (first chunk, number of chunks, samples per chunk, first sample)
+        of each run.
+        """
+        for i in range(len(self.first_chunk)):
+            yield (self.first_chunk[i]-1, self.chunk_count[i],
+                   self.samples_per_chunk[i], self.first_sample[i])
+
+    def expand(self):
+        return expand_runs(self.chunk_count, self.samples_per_chunk,
+                           typecode_of(self.samples_per_chunk))
+
+class StszTable:
+    """
+    Sample Size (stsz)
+    the size of the samples is kept as a scalar when it is constant.
+    """
+    def __init__(self, sample_size, sample_count, entry_size=None):
+        self.sample_size = sample_size
+        self.sample_count = sample_count
+        self.entry_size = entry_size
+
+    def __len__(self):
+        return self.sample_count
+
+    def size(self, n):
+        if not 0 <= n < self.sample_count:
+            raise IndexError(f"sample {n} is out of range")
+        if self.entry_size is None:
+            return self.sample_size
+        return self.entry_size[n]
+
+    @property
+    def total_size(self):
+        if self.entry_size is None:
+            return self.sample_size*self.sample_count
+        return sum(self.entry_size)
+
+    def expand(self):
+        if self.entry_size is None:
+            return array("I", [self.sample_size])*self.sample_count
+        return self.entry_size
+
+class SampleTable:
+    """
+    the sample tables of a track in the compact form.
+    chunk_offset is of stco or co64.
+    stss and ctts are None if the track does not have them.
+    codec is the type of the sample entry, e.g. "mp4a", and decoder_config
+    is the configuration of the decoder in it, e.g. AudioSpecificConfig.
+    """
+    def __init__(self, track_id, media, timescale, stts, stsc, stsz,
+                 chunk_offset, ctts=None, stss=None, codec=None,
+                 decoder_config=None):
+        self.track_id = track_id
+        self.media = media
+        self.timescale = timescale
+        self.codec = codec
+        self.decoder_config = decoder_config
+        self.stts = stts
+        self.stsc = stsc
+        self.stsz = stsz
+        self.chunk_offset = chunk_offset
+        self.ctts = ctts
+        self.stss = stss
+
+    def __len__(self):
+        return len(self.stsz)
+
+    def sample_offset(self, n):
+        """
+        the file offset of the sample n.
+        """
+        chunk, first = self.stsc.chunk_of(n)
+        if self.stsz.entry_size is None:
+            return self.chunk_offset[chunk] + (n-first)*self.stsz.sample_size
+        return self.chunk_offset[chunk] + sum(self.stsz.entry_size[first:n])
+
+    def sync_sample_before(self, n):
+        """
+        the nearest sync sample of the sample n or before it.
+        """
+        if self.stss is None:
+            return n
+        i = bisect_right(self.stss, n+1) - 1
+        return self.stss[i] - 1 if i >= 0 else None
+
+    def clip_range(self, t0=None, t1=None):
+        """
+        the samples from the nearest sync sample of which the decoding
+        time is t0 or before, to the last sample of which the decoding
+        time is before t1.  the time is in the timescale of the track.
+        only the runs of the tables are searched.
+        """
+        start = 0
+        if t0 is not None and t0 > 0:
+            n = self.stts.sample_at(t0)
+            if n is not None:
+                n = self.sync_sample_before(n)
+            start = n or 0
+        stop = len(self)
+        if t1 is not None:
+            n = self.stts.sample_at(t1-1) if t1 > 0 else None
+            stop = min(stop, n+1 if n is not None else 0)
+        return range(start, max(start, stop))
+
+    def sync_samples_in(self, samples):
+        """
+        the sync samples in samples, i.e. a range.
+        """
+        if self.stss is None:
+            return samples
+        i = bisect_left(self.stss, samples.start+1)
+        j = bisect_left(self.stss, samples.stop+1)
+        return array("Q", [n-1 for n in self.stss[i:j]])
+
+    def expand(self):
+        """
+        make the dict of the tables of each sample, or of each chunk.
+        """
+        sample = {}
+        sample["track_id"] = self.track_id
+        if self.media is not None:
+            sample["media"] = self.media
+        if self.timescale is not None:
+            sample["timescale"] = self.timescale
+        if self.codec is not None:
+            sample["codec"] = self.codec
+        if self.decoder_config is not None:
+            sample["decoder_config"] = self.decoder_config.hex()
+        sample["stts"] = self.stts.expand()
+        sample["stsc"] = self.stsc.expand()
+        sample["stsz"] = self.stsz.expand()
+        sample["stco"] = self.chunk_offset
+        if self.stss is not None:
+            sample["stss"] = self.stss
+        return sample
+
+class SampleIndex:
+    """
+    the index of the samples of a track, made once from the sample tables.
+    offset, size, dts and cts are the arrays of each sample, and sync is
+    1 if the sample is a sync sample.  the time is in the timescale of
+    the track.
+    """
+    def __init__(self, offset, size, dts, cts, sync, sync_samples=None,
+                 track_id=None, media=None, timescale=None, codec=None,
+                 decoder_config=None):
+        self.offset = offset
+        self.size = size
+        self.dts = dts
+        self.cts = cts
+        self.sync = sync
+        self.sync_samples = sync_samples
+        self.track_id = track_id
+        self.media = media
+        self.timescale = timescale
+        self.codec = codec
+        self.decoder_config = decoder_config
+        self._offset_order = None
+
+    @classmethod
+    def from_table(cls, table, samples=None):
+        """
+        samples: the sample numbers in the order, e.g. a range, of which
+            the index is made by the tables searched for each sample, so
+            that the cost is of the samples, not of the track.  the
+            sample n of the index is samples[n] of the track.
+        """
+        if samples is not None:
+            return cls.from_samples(table, samples)
+        size = table.stsz.expand()
+        if len(table.stsc) != len(size):
+            raise ValueError(f"stsc has {len(table.stsc)} samples "
+                             f"but stsz has {len(size)}")
+        offset = array("Q")
+        for chunk,nb_chunks,nb_samples,n in table.stsc.runs():
+            for i in range(chunk, chunk+nb_chunks):
+                v_val = array("Q", accumulate(size[n:n+nb_samples],
+                                              initial=table.chunk_offset[i]))
+                v_val.pop()
+                offset.extend(v_val)
+                n += nb_samples
+        dts = array("Q", accumulate(table.stts.expand(), initial=0))
+        dts.pop()
+        if len(dts) != len(size):
+            raise ValueError(f"stts has {len(dts)} samples "
+                             f"but stsz has {len(size)}")
+        if table.ctts is None:
+            cts = dts
+        else:
+            if len(table.ctts) != len(size):
+                raise ValueError(f"ctts has {len(table.ctts)} samples "
+                                 f"but stsz has {len(size)}")
+            cts = array("q", map(operator.add, dts, table.ctts.expand()))
+        if table.stss is None:
+            # all samples are sync samples.
+            sync = bytearray(b"\x01")*len(size)
+            sync_samples = None
+        else:
+            sync = bytearray(len(size))
+            sync_samples = array("Q", [n-1 for n in table.stss])
+            for n in sync_samples:
+                sync[n] = 1
+        return cls(offset, size, dts, cts, sync, sync_samples,
+                   track_id=table.track_id, media=table.media,
+                   timescale=table.timescale, codec=table.codec,
+                   decoder_config=table.decoder_config)
+
+    @classmethod
+    def from_samples(cls, table, samples):
+        entry_size = table.stsz.entry_size
+        offset = array("Q")
+        size = array("I" if entry_size is None else typecode_of(entry_size))
+        dts = array("Q")
+        cts = dts if table.ctts is None else array("q")
+        sync = bytearray()
+        stss = table.stss
+        j = None
+        chunk_first = chunk_end = 0
+        pos = pos_n = 0
+        for n in samples:
+            if not chunk_first <= n < chunk_end or n < pos_n:
+                chunk, chunk_first = table.stsc.chunk_of(n)
+                chunk_end = chunk_first + table.stsc.samples_in_chunk(chunk)
+                pos = table.chunk_offset[chunk]
+                pos_n = chunk_first
+            while pos_n < n:
+                pos += table.stsz.size(pos_n)
+                pos_n += 1
+            offset.append(pos)
+            size.append(table.stsz.size(n))
+            dts.append(table.stts.time(n))
+            if table.ctts is not None:
+                cts.append(dts[-1] + table.ctts.offset(n))
+            if stss is None:
+                sync.append(1)
+                continue
+            if j is None:
+                j = bisect_left(stss, n+1)
+            while j < len(stss) and stss[j] < n+1:
+                j += 1
+            sync.append(1 if j < len(stss) and stss[j] == n+1 else 0)
+        sync_samples = None
+        if stss is not None:
+            sync_samples = array("Q", [i for i,v in enumerate(sync) if v])
+        return cls(offset, size, dts, cts, sync, sync_samples,
+                   track_id=table.track_id, media=table.media,
+                   timescale=table.timescale, codec=table.codec,
+                   decoder_config=table.decoder_config)
+
+    def __len__(self):
+        return len(self.size)
+
+    def take(self, samples):
+        """
+        return the SampleIndex of samples, e.g. a range, of which the
+        sample n is samples[n] of this index.
+        """
+        if isinstance(samples, range) and samples.step == 1:
+            def pick(v_val):
+                return v_val[samples.start:samples.stop]
+            sync = bytearray(self.sync[samples.start:samples.stop])
+        else:
+            def pick(v_val):
+                return array(typecode_of(v_val), [v_val[n] for n in samples])
+            sync = bytearray([self.sync[n] for n in samples])
+        dts = pick(self.dts)
+        cts = dts if self.cts is self.dts else pick(self.cts)
+        sync_samples = None
+        if self.sync_samples is not None:
+            sync_samples = array("Q", [n for n,v in enumerate(sync) if v])
+        return SampleIndex(pick(self.offset), pick(self.size), dts, cts, sync,
+                           sync_samples, track_id=self.track_id,
+                           media=self.media, timescale=self.timescale,
+                           codec=self.codec,
+                           decoder_config=self.decoder_config)
+
+    def sample(self, n):
+        """
+        return (offset, size, dts, cts, sync) of the sample n.
+        """
+        return (self.offset[n], self.size[n], self.dts[n], self.cts[n],
+                bool(self.sync[n]))
+
+    def runs(self, samples=None, max_size=None):
+        """
+        yield (samples, offset, size) of the runs of the samples of which
+        the data is contiguous in the file, e.g. the samples in a chunk,
+        so that a run can be read at once.
+        samples: the sample numbers, all samples if None.
+        max_size: the maximum size of a run in bytes, except a run of a
+            sample larger than it.
+        """
+        if samples is None:
+            samples = range(len(self))
+        run = []
+        start = end = 0
+        for n in samples:
+            offset = self.offset[n]
+            size = self.size[n]
+            if run and (offset != end or
+                        max_size is not None and end + size - start > max_size):
+                yield run, start, end - start
+                run = []
+            if not run:
+                start = offset
+            run.append(n)
+            end = offset + size
+        if run:
+            yield run, start, end - start
+
+    def sample_at_time(self, t):
+        """
+        the last sample of which the decoding time is t or before.
+        """
+        n = bisect_right(self.dts, t) - 1
+        return n if n >= 0 else None
+
+    def sync_sample_before(self, t):
+        """
+        the nearest sync sample of which the decoding time is t or before.
+        """
+        n = self.sample_at_time(t)
+        if n is None or self.sync_samples is None:
+            return n
+        i = bisect_right(self.sync_samples, n) - 1
+        return self.sync_samples[i] if i >= 0 else None
+
+    def sample_range(self, t0, t1):
+        """
+        the samples of which the decoding time is in [t0, t1).
+        """
+        return range(bisect_left(self.dts, t0), bisect_left(self.dts, t1))
+
+    def sample_at_offset(self, x):
+        """
+        the sample which contains the byte at the file offset x.
+        """
+        if self._offset_order is None:
+            if all(map(operator.le, self.offset, self.offset[1:])):
+                self._offset_order = False
+            else:
+                order = sorted(range(len(self)), key=self.offset.__getitem__)
+                self._offset_order = (array("Q", order),
+                                      array("Q", [self.offset[n] for n in order]))
+        if self._offset_order is False:
+            n = bisect_right(self.offset, x) - 1
+        else:
+            order, offset = self._offset_order
+            i = bisect_right(offset, x) - 1
+            n = order[i] if i >= 0 else -1
+        if n >= 0 and x < self.offset[n] + self.size[n]:
+            return n
+        return None